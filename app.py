@@ -1,4 +1,5 @@
 import flet as ft
+import flet.canvas as cv
 import threading
 import queue
 import os
@@ -6,7 +7,9 @@ import logging
 import re
 import tkinter as tk
 from tkinter import filedialog
-from transposer_core import download_and_transpose, get_default_output_dir
+from transposer_core import download_and_transpose, get_default_output_dir, parse_time
+from profiling import profiled
+from presets import get_preset
 
 # 顏色方案（與 app.py 保持一致）
 COLORS = {
@@ -21,12 +24,18 @@ COLORS = {
     'danger': '#f44336',
     'text_muted': '#b0b0b0',
     'border': '#555555',
+    'waveform': '#4a9eff',
+    'selection': '#334caf50',
 }
 
+# 波形總覽的大小（像素）
+WAVEFORM_WIDTH = 340
+WAVEFORM_HEIGHT = 56
+
 def main(page: ft.Page):
     page.title = "YouTube 音檔轉調工具"
     page.window.width = 380
-    page.window.height = 680
+    page.window.height = 800
     page.window.resizable = False
     page.window.center()
     page.bgcolor = COLORS['bg']
@@ -178,6 +187,126 @@ def main(page: ft.Page):
     
     speed_slider.on_change = on_speed_change
     
+    # 片段與循環（練習用）：只下載並處理指定範圍
+    def create_small_field(label, hint):
+        return ft.TextField(
+            label=label,
+            hint_text=hint,
+            expand=True,
+            height=40,
+            text_size=10,
+            bgcolor=COLORS['entry_bg'],
+            color=COLORS['entry_fg'],
+            border_color=COLORS['border'],
+            focused_border_color=COLORS['accent'],
+        )
+    
+    start_field = create_small_field("開始", "0:00")
+    end_field = create_small_field("結束", "結尾")
+    loop_field = create_small_field("循環次數", "1")
+    
+    # 速度/品質預設：排練用草稿可大幅縮短處理時間；初始值依 YT_TRANSPOSE_PRESET（與命令列相同）
+    try:
+        default_preset = get_preset().name
+    except Exception as e:
+        logging.warning(f"YT_TRANSPOSE_PRESET 無效，改用標準預設: {e}")
+        default_preset = "standard"
+    preset_dropdown = ft.Dropdown(
+        options=[
+            ft.dropdown.Option("draft", "草稿"),
+            ft.dropdown.Option("standard", "標準"),
+            ft.dropdown.Option("archival", "保存"),
+        ],
+        value=default_preset,
+        width=90,
+        text_size=10,
+        bgcolor=COLORS['entry_bg'],
+        color=COLORS['fg'],
+        border_color=COLORS['border'],
+        focused_border_color=COLORS['accent'],
+    )
+    
+    section_row = ft.Row([
+        start_field,
+        end_field,
+        loop_field,
+        preset_dropdown,
+    ], spacing=5)
+    
+    # 波形總覽：載入後可在波形上拖曳選取片段（填入開始/結束時間）
+    waveform_peaks = None
+    waveform_drag = {'start': None}
+    waveform_canvas = cv.Canvas(shapes=[], width=WAVEFORM_WIDTH, height=WAVEFORM_HEIGHT)
+    
+    def format_field_time(seconds):
+        minutes, secs = divmod(max(0.0, seconds), 60)
+        return f"{int(minutes)}:{secs:04.1f}"
+    
+    def get_field_time(field):
+        try:
+            return parse_time(field.value)
+        except Exception:
+            return None
+    
+    def draw_waveform():
+        if waveform_peaks is None:
+            return
+        shapes = []
+        duration = waveform_peaks.duration or 1.0
+        # 目前選取的片段
+        start_time = get_field_time(start_field)
+        end_time = get_field_time(end_field)
+        if start_time is not None or end_time is not None:
+            x0 = (start_time or 0) / duration * WAVEFORM_WIDTH
+            x1 = (end_time if end_time is not None else duration) / duration * WAVEFORM_WIDTH
+            shapes.append(cv.Rect(x0, 0, max(1, x1 - x0), WAVEFORM_HEIGHT,
+                                  paint=ft.Paint(color=COLORS['selection'], style=ft.PaintingStyle.FILL)))
+        # 每個像素一條最小值到最大值的垂直線
+        middle = WAVEFORM_HEIGHT / 2
+        line_paint = ft.Paint(color=COLORS['waveform'], stroke_width=1)
+        for x, (low, high) in enumerate(waveform_peaks.overview(WAVEFORM_WIDTH)):
+            shapes.append(cv.Line(x, middle - high * middle, x, middle - low * middle + 1, paint=line_paint))
+        waveform_canvas.shapes = shapes
+        page.update()
+    
+    def x_to_time(x):
+        duration = waveform_peaks.duration if waveform_peaks else 0
+        return min(max(x, 0), WAVEFORM_WIDTH) / WAVEFORM_WIDTH * duration
+    
+    def on_waveform_pan_start(e):
+        if waveform_peaks is None:
+            return
+        waveform_drag['start'] = x_to_time(e.local_x)
+    
+    def on_waveform_pan_update(e):
+        if waveform_peaks is None or waveform_drag['start'] is None:
+            return
+        a, b = sorted((waveform_drag['start'], x_to_time(e.local_x)))
+        start_field.value = format_field_time(a)
+        end_field.value = format_field_time(b)
+        draw_waveform()
+    
+    def on_waveform_pan_end(e):
+        waveform_drag['start'] = None
+    
+    waveform_container = ft.Container(
+        content=ft.GestureDetector(
+            content=waveform_canvas,
+            on_pan_start=on_waveform_pan_start,
+            on_pan_update=on_waveform_pan_update,
+            on_pan_end=on_waveform_pan_end,
+        ),
+        width=WAVEFORM_WIDTH,
+        height=WAVEFORM_HEIGHT,
+        bgcolor=COLORS['entry_bg'],
+        border_radius=4,
+        visible=False,
+    )
+    
+    # 手動修改開始/結束時間時更新波形上的選取範圍
+    start_field.on_blur = lambda e: draw_waveform()
+    end_field.on_blur = lambda e: draw_waveform()
+    
     output_dir_field = ft.TextField(
         label="輸出目錄",
         value=default_output_dir,
@@ -193,6 +322,15 @@ def main(page: ft.Page):
     
     progress_bar = ft.ProgressBar(value=0, color=COLORS['accent'], bgcolor=COLORS['frame_bg'])
     status_text = ft.Text("", size=9, color=COLORS['text_muted'])
+    waveform_button = ft.ElevatedButton(
+        text="波形",
+        bgcolor=COLORS['entry_bg'],
+        color=COLORS['fg'],
+        width=60,
+        height=40,
+        tooltip="下載音訊並顯示波形，可在波形上選取片段",
+        on_click=lambda e: load_waveform(),
+    )
     start_button = ft.ElevatedButton(
         text="開始下載",
         bgcolor=COLORS['success'],
@@ -361,6 +499,57 @@ def main(page: ft.Page):
         ]
         return any(re.search(pattern, url, re.IGNORECASE) for pattern in youtube_patterns)
     
+    def load_waveform():
+        url = url_field.value.strip()
+        if not is_valid_youtube_url(url):
+            status_text.value = "請輸入有效的 YouTube 連結"
+            status_text.color = COLORS['danger']
+            page.update()
+            return
+        waveform_button.disabled = True
+        status_text.value = "載入波形中..."
+        status_text.color = COLORS['text_muted']
+        page.update()
+        
+        def work():
+            try:
+                from source_cache import fetch_source
+                from peaks import get_peaks
+                
+                def progress_callback(value, msg):
+                    def update_ui(progress_val=value, progress_text=msg):
+                        progress_bar.value = progress_val / 100.0
+                        status_text.value = progress_text
+                        page.update()
+                    invoke_on_main_thread(update_ui)
+                
+                # 下載的來源會保存在來源快取，之後開始處理時不需再下載
+                source_path = fetch_source(url, progress_callback)
+                loaded = get_peaks(source_path)
+                
+                def update_waveform():
+                    nonlocal waveform_peaks
+                    waveform_peaks = loaded
+                    waveform_container.visible = True
+                    waveform_button.disabled = False
+                    progress_bar.value = 0
+                    status_text.value = f"波形已載入（{format_field_time(loaded.duration)}），可在波形上拖曳選取片段"
+                    status_text.color = COLORS['success']
+                    draw_waveform()
+                invoke_on_main_thread(update_waveform)
+            except Exception as e:
+                logging.error(f"載入波形失敗: {e}", exc_info=True)
+                
+                def update_error(err=str(e)):
+                    waveform_button.disabled = False
+                    progress_bar.value = 0
+                    status_text.value = f"載入波形失敗：{err}"
+                    status_text.color = COLORS['danger']
+                    page.update()
+                invoke_on_main_thread(update_error)
+        
+        threading.Thread(target=work, daemon=True).start()
+    
     def start_process():
         url = url_field.value.strip()
         if not url:
@@ -376,6 +565,27 @@ def main(page: ft.Page):
             page.update()
             return
         
+        # 驗證片段範圍與循環次數
+        try:
+            start_time = parse_time(start_field.value)
+            end_time = parse_time(end_field.value)
+            if start_time is not None and end_time is not None and end_time <= start_time:
+                raise Exception("結束時間必須晚於開始時間")
+            loop_text = (loop_field.value or "").strip()
+            loop_count = int(loop_text) if loop_text else 1
+            if loop_count < 1:
+                raise Exception("循環次數必須至少為 1")
+        except ValueError:
+            status_text.value = "循環次數必須是整數"
+            status_text.color = COLORS['danger']
+            page.update()
+            return
+        except Exception as ex:
+            status_text.value = f"片段設定錯誤：{ex}"
+            status_text.color = COLORS['danger']
+            page.update()
+            return
+        
         # 禁用按鈕
         start_button.disabled = True
         start_button.bgcolor = '#888888'
@@ -452,7 +662,10 @@ def main(page: ft.Page):
                     # 使用輔助函數在主線程執行更新
                     invoke_on_main_thread(update_ui)
                 
-                download_and_transpose(url, semitones, progress_callback, output_dir, tempo_val, rate_val, bpm_val)
+                # 設定 YT_TRANSPOSE_PROFILE=1 時，分析報告會寫在輸出檔旁
+                profiled(download_and_transpose, url, semitones, progress_callback, output_dir, tempo_val, rate_val, bpm_val,
+                         start=start_time, end=end_time, loop=loop_count,
+                         preset=preset_dropdown.value)
                 # 成功完成
                 # 將 output_dir 作為局部變量捕獲，避免閉包問題
                 output_dir_final = output_dir
@@ -744,9 +957,18 @@ def main(page: ft.Page):
                     padding=ft.padding.symmetric(vertical=10, horizontal=5),
                 ),
                 ft.Container(
-                    content=url_field,
+                    content=ft.Row([url_field, waveform_button], spacing=5),
+                    padding=ft.padding.symmetric(horizontal=12, vertical=5),
+                ),
+                ft.Container(
+                    content=section_row,
                     padding=ft.padding.symmetric(horizontal=12, vertical=5),
                 ),
+                ft.Container(
+                    content=waveform_container,
+                    alignment=ft.alignment.center,
+                    padding=ft.padding.symmetric(horizontal=12, vertical=0),
+                ),
                 ft.Container(
                     content=ft.Column([
                         transpose_card,
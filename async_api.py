@@ -0,0 +1,229 @@
+"""asyncio 版本的 API
+
+    path = await download_and_transpose_async(url, -2, tempo=10)
+
+    async for event in iter_transpose_progress(url, -2):
+        print(event.progress, event.message)
+        if event.result:
+            print("done:", event.result)
+
+與 download_and_transpose 執行相同的工作流程（transposer_core.iter_transpose_steps），差別在於：
+
+- ffmpeg / soundstretch 以 asyncio.create_subprocess_exec 執行，並即時解析 stderr 的
+  time= 輸出換算進度，等待子行程時不佔用任何執行緒
+- yt-dlp 與其他阻塞的步驟（解析影片資訊、下載、搬移檔案）在有上限的執行緒池中執行
+- 排隊等待排程器放行、暫存空間或重試退避（WaitStep）時在事件迴圈中定期檢查，
+  不佔用執行緒池：等待中的工作不會擋住已放行工作的下一個步驟
+- 同時執行的子行程數量有上限，等待中的工作只是一個協程與一個佇列，數千個也只佔少量記憶體
+
+可用環境變數設定：
+    YT_TRANSPOSE_ASYNC_WORKERS=8     阻塞步驟（主要是下載）的執行緒數
+    YT_TRANSPOSE_ASYNC_PROCESSES=N   同時執行的 ffmpeg/soundstretch 數量（預設為 CPU 核心數）
+"""
+import asyncio
+import os
+import re
+import subprocess
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from backends import WaitStep
+from transposer_core import iter_transpose_steps, get_subprocess_kwargs
+
+DEFAULT_WORKERS = 8
+# 等待資源時檢查的間隔（秒）
+WAIT_POLL_INTERVAL = 0.2
+
+# ffmpeg 進度行中的目前時間，例如 "time=00:01:23.45"
+TIME_PATTERN = re.compile(rb'time=\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+_executor = None
+_executor_lock = threading.Lock()
+_process_semaphores = weakref.WeakKeyDictionary()
+
+
+def _env_int(name, default):
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def get_executor():
+    """取得阻塞步驟共用的有上限執行緒池"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_env_int('YT_TRANSPOSE_ASYNC_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='yt_transpose_async',
+            )
+        return _executor
+
+
+def _get_process_semaphore():
+    """每個事件迴圈一個子行程數量上限"""
+    loop = asyncio.get_running_loop()
+    semaphore = _process_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _process_semaphores[loop] = asyncio.Semaphore(
+            _env_int('YT_TRANSPOSE_ASYNC_PROCESSES', os.cpu_count() or 2))
+    return semaphore
+
+
+class TransposeProgress:
+    """進度事件；最後一個事件的 result 為輸出檔路徑"""
+
+    def __init__(self, progress, message, result=None):
+        self.progress = progress
+        self.message = message
+        self.result = result
+
+    def __repr__(self):
+        return f"TransposeProgress({self.progress}, {self.message!r}, result={self.result!r})"
+
+
+def _advance(steps, value):
+    """在執行緒中推進產生器；StopIteration 不能穿過 Future，改以回傳值表示"""
+    try:
+        return False, steps.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+async def run_step_async(step, progress_callback=None):
+    """以 asyncio 子行程執行一個 RenderStep，串流解析 stderr 回報進度"""
+    async with _get_process_semaphore():
+        if progress_callback and step.message:
+            progress_callback(step.progress, step.message)
+        kwargs = get_subprocess_kwargs()
+        process = await asyncio.create_subprocess_exec(
+            *step.cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **kwargs,
+        )
+        stdout_task = asyncio.ensure_future(process.stdout.read())
+        stderr_chunks = []
+        last_report = 0.0
+        try:
+            while True:
+                chunk = await process.stderr.read(65536)
+                if not chunk:
+                    break
+                stderr_chunks.append(chunk)
+                if not (progress_callback and step.duration and step.progress is not None):
+                    continue
+                # ffmpeg 以 \r 更新同一行進度，只取這個區塊中最後一個時間
+                matches = TIME_PATTERN.findall(chunk)
+                now = time.monotonic()
+                if matches and now - last_report >= 0.5:
+                    hours, minutes, seconds = matches[-1]
+                    position = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+                    fraction = min(1.0, position / step.duration)
+                    progress = step.progress + (step.progress_end - step.progress) * fraction
+                    progress_callback(round(progress, 1), f"{step.message} {fraction * 100:.0f}%")
+                    last_report = now
+            returncode = await process.wait()
+            stdout = await stdout_task
+        except BaseException:
+            # 取消或錯誤時結束子行程，避免留下孤兒行程
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            stdout_task.cancel()
+            raise
+    stderr = b"".join(stderr_chunks).decode('utf-8', errors='ignore')
+    return subprocess.CompletedProcess(step.cmd, returncode, stdout.decode('utf-8', errors='ignore'), stderr)
+
+
+async def _wait_async(pending):
+    """在事件迴圈中等待 WaitStep（定期 poll），等待期間不佔用執行緒池"""
+    try:
+        while True:
+            result = pending.poll()
+            if result is not None:
+                return result
+            await asyncio.sleep(WAIT_POLL_INTERVAL)
+    except BaseException:
+        pending.cancel()
+        raise
+
+
+async def _drive(steps, progress_callback):
+    """推進工作產生器：阻塞的部分在執行緒池中執行，外部命令以 asyncio 子行程執行，
+    等待資源（WaitStep）時在事件迴圈中等待"""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    value = None
+    try:
+        while True:
+            done, item = await loop.run_in_executor(executor, _advance, steps, value)
+            if done:
+                return item
+            if isinstance(item, WaitStep):
+                value = await _wait_async(item.pending)
+            else:
+                value = await run_step_async(item, progress_callback)
+    finally:
+        # 產生器的 finally 會清理暫存目錄，在執行緒池中關閉以免阻塞事件迴圈；
+        # 取消時若產生器仍在執行緒中執行，則交給垃圾回收處理
+        if not steps.gi_running:
+            await loop.run_in_executor(executor, steps.close)
+
+
+async def download_and_transpose_async(url, semitones, progress_callback=None, **kwargs):
+    """download_and_transpose 的非同步版本，參數相同，回傳輸出檔路徑
+
+    progress_callback 一律在事件迴圈的執行緒中呼叫。
+    """
+    loop = asyncio.get_running_loop()
+    callback = None
+    if progress_callback is not None:
+        def callback(progress, message):
+            # 阻塞步驟在執行緒池中回報進度，轉回事件迴圈執行緒
+            loop.call_soon_threadsafe(progress_callback, progress, message)
+
+    in_progress = metrics.jobs_in_progress()
+    in_progress.inc()
+    started = time.perf_counter()
+    status = "failure"
+    try:
+        result = await _drive(iter_transpose_steps(url, semitones, callback, **kwargs), callback)
+        status = "success"
+        return result
+    finally:
+        in_progress.dec()
+        metrics.job_duration().observe(time.perf_counter() - started)
+        metrics.jobs_total().inc(status=status)
+
+
+async def iter_transpose_progress(url, semitones, **kwargs):
+    """以非同步迭代器回傳進度事件，最後一個事件帶有輸出檔路徑；失敗時拋出例外"""
+    events = asyncio.Queue()
+
+    def on_progress(progress, message):
+        events.put_nowait(TransposeProgress(progress, message))
+
+    task = asyncio.ensure_future(download_and_transpose_async(url, semitones, on_progress, **kwargs))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        # 任務完成後，佇列中可能還有 call_soon_threadsafe 排入的事件
+        while not events.empty():
+            event = events.get_nowait()
+            if event is not None:
+                yield event
+        result = task.result()
+        yield TransposeProgress(100, "Completed!", result=result)
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,536 @@
+"""音訊處理引擎（backend）
+
+    soundstretch  ffmpeg 解碼為 WAV → soundstretch → ffmpeg 編碼
+                  （三個行程、兩次完整的 WAV 落地）
+    ffmpeg        單一 ffmpeg 行程直接從來源檔完成解碼、變調/變速與編碼
+                  （有 rubberband 濾鏡時使用 rubberband，否則以 asetrate+aresample+atempo 串接）
+
+預設（auto）依執行時偵測到的工具能力選擇；BPM 模式需要 soundstretch 的節拍偵測。
+可用環境變數 YT_TRANSPOSE_BACKEND=auto|ffmpeg|soundstretch 或 backend 參數指定。
+
+每個 backend 把處理流程表示為「命令計畫」：產生器逐步 yield RenderStep，
+執行端執行命令後把結果 send 回產生器。同一份計畫可由不同的執行端執行。
+需要等待資源（排程器、暫存空間）或重試退避時則 yield WaitStep，由執行端決定如何等待。
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+
+from transposer_core import (
+    get_ffmpeg, get_soundstretch, check_soundstretch_available, get_subprocess_kwargs, get_format_args,
+    parse_integrated_loudness, get_loudness_gain, limit_gain_to_peak, LOUDNESS_PEAK_CEILING_DB,
+)
+from scheduler import run_with_usage
+
+# ffmpeg backend 變調時的處理取樣率（asetrate 需要已知的取樣率）
+PROCESSING_RATE = 48000
+
+# atempo 每一級的倍率範圍（舊版 ffmpeg 只接受 0.5～2.0，超出時串接多級）
+ATEMPO_MIN = 0.5
+ATEMPO_MAX = 2.0
+
+
+class Toolchain:
+    """執行時偵測到的外部工具與 ffmpeg 濾鏡"""
+
+    def __init__(self, ffmpeg=None, soundstretch=None, filters=()):
+        self.ffmpeg = ffmpeg
+        self.soundstretch = soundstretch
+        self.filters = frozenset(filters)
+
+    def has_filter(self, name):
+        return name in self.filters
+
+
+def probe_ffmpeg_filters(ffmpeg):
+    """列出 ffmpeg 支援的濾鏡名稱（ffmpeg -filters）"""
+    if not ffmpeg:
+        return set()
+    try:
+        result = subprocess.run(
+            [ffmpeg, "-hide_banner", "-filters"],
+            capture_output=True, text=True, encoding='utf-8', errors='ignore',
+            timeout=10, **get_subprocess_kwargs()
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return set()
+    # 每行格式為 " ..C rubberband        A->A       Apply time-stretching..."
+    return set(re.findall(r'^\s*[A-Z.|]{2,3}\s+(\w+)\s+\S+->\S+', result.stdout, re.MULTILINE))
+
+
+_toolchain = None
+_toolchain_lock = threading.Lock()
+
+
+def probe_toolchain(refresh=False):
+    """偵測可用的工具（每個行程只偵測一次）"""
+    global _toolchain
+    with _toolchain_lock:
+        if _toolchain is None or refresh:
+            ffmpeg = get_ffmpeg()
+            soundstretch = get_soundstretch() if check_soundstretch_available() else None
+            _toolchain = Toolchain(ffmpeg, soundstretch, probe_ffmpeg_filters(ffmpeg))
+        return _toolchain
+
+
+def soundstretch_missing_message():
+    local_dir = os.path.dirname(os.path.abspath(__file__))
+    return (
+        "soundstretch CLI 未找到！\n\n"
+        "請安裝 SoundTouch CLI 工具：\n"
+        "1. 從以下網址下載：\n"
+        "   - https://www.surina.net/soundtouch/download.html\n"
+        "   - 或 https://github.com/SoundTouch/SoundTouch/releases\n\n"
+        f"2. 解壓縮後，將 'soundstretch.exe' 複製到此目錄：\n"
+        f"   {local_dir}\n\n"
+        "3. 或者將 soundstretch 加入到系統 PATH\n\n"
+        "執行 'python setup_env.py' 可檢查安裝狀態。"
+    )
+
+
+class RenderRequest:
+    """一次處理的參數（semitones 應為已正規化的值）"""
+
+    def __init__(self, semitones=0.0, tempo=None, rate=None, bpm=None, loudness=None, loop=1,
+                 output_format='mp3', encoder_args=None, preset=None, channels=None, samplerate=None, duration=None):
+        self.semitones = semitones
+        self.tempo = tempo
+        self.rate = rate
+        self.bpm = bpm
+        self.loudness = loudness
+        self.loop = loop
+        self.output_format = output_format
+        self.encoder_args = list(encoder_args or [])
+        # 速度/品質預設（presets.Preset），None 表示標準設定
+        self.preset = preset
+        # 明確指定的處理聲道數/取樣率（優先於預設）
+        self._channels = channels
+        self._samplerate = samplerate
+        # 輸入長度（秒），未知時為 None；只用於換算進度
+        self.duration = duration
+        # 解碼後 PCM 快取中的來源（pcm_cache.DecodedSource），有時不需再從壓縮檔解碼
+        self.decoded = None
+
+    @property
+    def samplerate(self):
+        """處理取樣率，None 表示沿用來源"""
+        if self._samplerate:
+            return self._samplerate
+        return self.preset.samplerate if self.preset else None
+
+    @property
+    def channels(self):
+        """處理聲道數，None 表示沿用來源"""
+        if self._channels:
+            return self._channels
+        return self.preset.channels if self.preset else None
+
+    def output_duration(self):
+        """預期的輸出長度（秒），無法估計時回傳 None"""
+        if not self.duration or self.bpm is not None:
+            return None
+        length = self.duration * self.loop
+        if self.rate is not None and self.rate != 0.0:
+            length /= 1 + self.rate / 100.0
+        elif self.tempo is not None and self.tempo != 0.0:
+            length /= 1 + self.tempo / 100.0
+        return length
+
+    def format_options(self):
+        """解碼階段的取樣率與聲道參數"""
+        return get_format_args(self.channels, self.samplerate)
+
+    @property
+    def needs_stretch(self):
+        """是否需要變調/變速（單純響度正規化或循環只需 ffmpeg）"""
+        return (
+            self.semitones != 0 or
+            (self.tempo is not None and self.tempo != 0.0) or
+            (self.rate is not None and self.rate != 0.0) or
+            (self.bpm is not None and self.bpm != 120)
+        )
+
+    def describe(self):
+        if self.bpm is not None:
+            msg_parts = [f"Adjusting to {self.bpm} BPM"]
+        elif self.rate is not None:
+            msg_parts = [f"Rate {self.rate:+.1f}%"]
+        else:
+            msg_parts = []
+            if self.semitones != 0:
+                msg_parts.append(f"Transpose {self.semitones:+} semitones")
+            if self.tempo is not None:
+                msg_parts.append(f"Tempo {self.tempo:+.1f}%")
+        if self.loudness is not None:
+            msg_parts.append(f"Normalizing loudness to {self.loudness:g} LUFS")
+        if self.loop > 1:
+            msg_parts.append(f"Looping {self.loop}x")
+        return ", ".join(msg_parts) if msg_parts else "Processing"
+
+
+class RenderStep:
+    """計畫中的一個外部命令"""
+
+    def __init__(self, cmd, progress=None, message=None, duration=None, progress_end=None):
+        self.cmd = cmd
+        self.progress = progress
+        self.message = message
+        # 預期輸出長度（秒），供執行端依 ffmpeg 的 time= 輸出換算進度
+        self.duration = duration
+        # 這個步驟結束時的進度（預設為開始進度 + 10）
+        self.progress_end = progress_end if progress_end is not None else (progress or 0) + 10
+
+
+class WaitStep:
+    """計畫中的一個等待（排程器放行、暫存空間、重試前的退避）
+
+    pending 提供 poll()（不阻塞，可放行時回傳結果，否則回傳 None）、wait()（阻塞直到放行並回傳結果）
+    與 cancel()（放棄等待）。同步執行端直接呼叫 wait()；非同步執行端在事件迴圈中定期 poll()，
+    等待期間不佔用執行緒。放行的結果會 send 回產生器。
+    """
+
+    progress = None
+    message = None
+
+    def __init__(self, pending):
+        self.pending = pending
+
+
+class Delay:
+    """WaitStep 可等待的計時器"""
+
+    def __init__(self, seconds):
+        self.deadline = time.monotonic() + seconds
+
+    def poll(self):
+        return True if time.monotonic() >= self.deadline else None
+
+    def wait(self):
+        remaining = self.deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
+    def cancel(self):
+        pass
+
+
+def iter_wait(pending):
+    """命令計畫：可立即放行時直接回傳結果，否則交給執行端等待"""
+    result = pending.poll()
+    if result is None:
+        try:
+            result = yield WaitStep(pending)
+        except BaseException:
+            # 等待中被取消（計畫被關閉）
+            pending.cancel()
+            raise
+    return result
+
+
+def parse_true_peak(ffmpeg_stderr):
+    """從 ebur128=peak=true 的摘要解析真實峰值（dBFS）"""
+    matches = re.findall(r'Peak:\s+(-?(?:\d+(?:\.\d+)?|inf))\s+dBFS', ffmpeg_stderr or '')
+    if not matches:
+        return None
+    return float(matches[-1])
+
+
+def split_atempo(factor):
+    """將速度倍率拆成多個 atempo 都能接受的倍率"""
+    factors = []
+    while factor > ATEMPO_MAX:
+        factors.append(ATEMPO_MAX)
+        factor /= ATEMPO_MAX
+    while factor < ATEMPO_MIN:
+        factors.append(ATEMPO_MIN)
+        factor /= ATEMPO_MIN
+    if abs(factor - 1.0) > 1e-6 or not factors:
+        factors.append(factor)
+    return factors
+
+
+class SoundStretchBackend:
+    """ffmpeg 解碼 → soundstretch → ffmpeg 編碼"""
+
+    name = 'soundstretch'
+
+    def unsupported_reason(self, request, toolchain):
+        if not toolchain.ffmpeg:
+            return "ffmpeg not found"
+        if request.needs_stretch and not toolchain.soundstretch:
+            return soundstretch_missing_message()
+        return None
+
+    def _decode(self, source_path, wav_path, request, ff):
+        """解碼為 soundstretch 使用的 WAV（同時測量響度），回傳響度增益（dB）"""
+        convert_cmd = [
+            ff,
+            "-i", source_path,
+            "-y",  # 覆蓋輸出檔案
+            "-acodec", "pcm_s16le",  # 16-bit PCM
+            # 依預設降低取樣率/聲道，soundstretch 與之後的編碼都沿用 WAV 的格式
+            *request.format_options(),
+        ]
+        if request.loudness is not None:
+            # 解碼時同時以 ebur128 測量整合響度（只輸出摘要，避免逐幀日誌）
+            convert_cmd.extend(["-af", "ebur128=framelog=quiet"])
+        convert_cmd.append(wav_path)
+        result = yield RenderStep(convert_cmd, 75, "Converting to WAV format...", duration=request.duration,
+                                  progress_end=80)
+        if result.returncode != 0:
+            raise Exception(f"Failed to convert source to WAV: {result.stderr}")
+
+        loudness_gain = 0.0
+        if request.loudness is not None:
+            measured_lufs = parse_integrated_loudness(result.stderr)
+            loudness_gain = get_loudness_gain(measured_lufs, request.loudness)
+            loudness_gain = limit_gain_to_peak(loudness_gain, wav_path)
+            if measured_lufs is not None:
+                print(f"Measured loudness: {measured_lufs:.1f} LUFS, gain: {loudness_gain:+.2f} dB")
+        return loudness_gain
+
+    def plan(self, source_path, output_path, work_dir, request, toolchain):
+        ff = toolchain.ffmpeg
+        # soundstretch 需要 WAV 格式，使用臨時檔案（在臨時工作目錄中）
+        # 響度在這個既有的解碼階段順便測量，增益則在最後編碼時套用，不需額外解碼
+        temp_wav_input = os.path.join(work_dir, "temp_input.wav")
+        temp_wav_output = os.path.join(work_dir, "temp_output.wav")
+        decoded = request.decoded
+        try:
+            if decoded is not None:
+                # PCM 快取中已是 soundstretch 使用的格式，直接讀取（不複製、不刪除），響度也已在存入時測量
+                wav_input = decoded.path
+                loudness_gain = 0.0
+                if request.loudness is not None:
+                    loudness_gain = get_loudness_gain(decoded.lufs, request.loudness)
+                    loudness_gain = limit_gain_to_peak(loudness_gain, wav_input)
+                    if decoded.lufs is not None:
+                        print(f"Cached loudness: {decoded.lufs:.1f} LUFS, gain: {loudness_gain:+.2f} dB")
+            else:
+                wav_input = temp_wav_input
+                loudness_gain = yield from self._decode(source_path, wav_input, request, ff)
+
+            # 沒有音調/速度調整時，直接將解碼後的 WAV 送去編碼
+            wav_to_encode = wav_input
+
+            if request.needs_stretch:
+                soundstretch_cmd = [toolchain.soundstretch, wav_input, temp_wav_output]
+                # 添加處理參數（按優先級：BPM > rate > tempo + transpose）
+                # 注意：BPM 和 rate 模式也會支援 pitch 調整
+                if request.bpm is not None:
+                    soundstretch_cmd.append(f"-bpm={request.bpm}")
+                elif request.rate is not None:
+                    soundstretch_cmd.append(f"-rate={request.rate:.2f}")
+                elif request.tempo is not None:
+                    soundstretch_cmd.append(f"-tempo={request.tempo:.2f}")
+                if request.semitones != 0:
+                    soundstretch_cmd.append(f"-pitch={request.semitones:.2f}")
+                if request.preset is not None:
+                    soundstretch_cmd.extend(request.preset.soundstretch_options())
+                result = yield RenderStep(soundstretch_cmd, 80, "Processing with SoundTouch...")
+                if result.returncode != 0:
+                    raise Exception(f"SoundTouch processing failed: {result.stderr}")
+                wav_to_encode = temp_wav_output
+
+            # 將 WAV 編碼為輸出格式（在臨時工作目錄中）
+            convert_back_cmd = [ff]
+            if request.loop > 1:
+                # 循環練習：編碼時重複讀取輸入 loop 次，不需額外的中間檔
+                convert_back_cmd.extend(["-stream_loop", str(request.loop - 1)])
+            convert_back_cmd.extend(["-i", wav_to_encode])
+            if loudness_gain != 0.0:
+                # 在最終編碼時套用響度增益
+                convert_back_cmd.extend(["-af", f"volume={loudness_gain:.2f}dB"])
+            convert_back_cmd.extend([*request.encoder_args, "-y", output_path])
+            result = yield RenderStep(convert_back_cmd, 90, f"Converting back to {request.output_format.upper()}...",
+                                      duration=request.output_duration(), progress_end=95)
+            if result.returncode != 0:
+                raise Exception(f"Failed to convert WAV to {request.output_format.upper()}: {result.stderr}")
+        finally:
+            # 清理臨時 WAV 檔案
+            for temp_file in [temp_wav_input, temp_wav_output]:
+                if os.path.exists(temp_file):
+                    try:
+                        os.remove(temp_file)
+                    except OSError:
+                        pass
+
+
+class FFmpegBackend:
+    """單一 ffmpeg 行程：解碼、濾鏡鏈變調/變速、編碼"""
+
+    name = 'ffmpeg'
+
+    def unsupported_reason(self, request, toolchain):
+        if not toolchain.ffmpeg:
+            return "ffmpeg not found"
+        if request.bpm is not None:
+            return "BPM mode needs soundstretch (beat detection)"
+        if request.needs_stretch and not toolchain.has_filter('rubberband') and not toolchain.has_filter('atempo'):
+            return "ffmpeg has neither the rubberband nor the atempo filter"
+        return None
+
+    def build_filters(self, request, toolchain):
+        """變調/變速的濾鏡鏈（不含響度）"""
+        filters = []
+        samplerate = request.samplerate or PROCESSING_RATE
+        if request.samplerate or request.channels:
+            # 在濾鏡鏈最前面降低取樣率/聲道，之後的濾鏡都以較少的資料處理
+            formats = []
+            if request.samplerate:
+                formats.append(f"sample_rates={request.samplerate}")
+            if request.channels:
+                formats.append(f"channel_layouts={'mono' if request.channels == 1 else 'stereo'}")
+            filters.append(f"aformat={':'.join(formats)}")
+        pitch = 2 ** (request.semitones / 12.0)
+        tempo = 1.0
+        if request.rate is not None and request.rate != 0.0:
+            # Rate 模式：以重新取樣同時改變速度與音調，不需時間伸縮
+            factor = 1 + request.rate / 100.0
+            filters += [f"aresample={samplerate}", f"asetrate={samplerate * factor:.0f}",
+                        f"aresample={samplerate}"]
+        elif request.tempo is not None and request.tempo != 0.0:
+            tempo = 1 + request.tempo / 100.0
+
+        if pitch == 1.0 and tempo == 1.0:
+            return filters
+        if toolchain.has_filter('rubberband'):
+            options = {'pitch': f"{pitch:.6f}", 'tempo': f"{tempo:.6f}"}
+            if request.preset is not None:
+                options.update(request.preset.rubberband_options)
+            filters.append("rubberband=" + ":".join(f"{key}={value}" for key, value in options.items()))
+        else:
+            # asetrate 以取樣率改變音調（同時改變速度），再以 atempo 把速度拉回目標
+            if pitch != 1.0:
+                if not filters or not filters[-1].startswith("aresample"):
+                    filters.append(f"aresample={samplerate}")
+                filters += [f"asetrate={samplerate * pitch:.0f}", f"aresample={samplerate}"]
+            filters += [f"atempo={factor:.6f}" for factor in split_atempo(tempo / pitch)]
+        return filters
+
+    def plan(self, source_path, output_path, work_dir, request, toolchain):
+        ff = toolchain.ffmpeg
+        filters = self.build_filters(request, toolchain)
+        decoded = request.decoded
+        if decoded is not None:
+            # 從 PCM 快取讀取，不需解碼壓縮檔
+            source_path = decoded.path
+
+        if request.loudness is not None and decoded is not None and decoded.lufs is not None:
+            # 響度與真實峰值已在存入 PCM 快取時測量
+            loudness_gain = get_loudness_gain(decoded.lufs, request.loudness)
+            if loudness_gain > 0 and decoded.true_peak is not None:
+                loudness_gain = min(loudness_gain, LOUDNESS_PEAK_CEILING_DB - decoded.true_peak)
+            print(f"Cached loudness: {decoded.lufs:.1f} LUFS, gain: {loudness_gain:+.2f} dB")
+            if loudness_gain != 0.0:
+                filters.append(f"volume={loudness_gain:.2f}dB")
+        elif request.loudness is not None:
+            # 先以 ebur128 測量響度與真實峰值（只解碼、不寫檔），增益在同一次渲染中套用
+            measure_cmd = [ff, "-hide_banner", "-i", source_path,
+                           "-af", "ebur128=framelog=quiet:peak=true", "-f", "null", "-"]
+            result = yield RenderStep(measure_cmd, 72, "Measuring loudness...", duration=request.duration,
+                                      progress_end=78)
+            if result.returncode != 0:
+                raise Exception(f"Failed to measure loudness: {result.stderr}")
+            measured_lufs = parse_integrated_loudness(result.stderr)
+            loudness_gain = get_loudness_gain(measured_lufs, request.loudness)
+            peak_db = parse_true_peak(result.stderr)
+            if loudness_gain > 0 and peak_db is not None:
+                loudness_gain = min(loudness_gain, LOUDNESS_PEAK_CEILING_DB - peak_db)
+            if measured_lufs is not None:
+                print(f"Measured loudness: {measured_lufs:.1f} LUFS, gain: {loudness_gain:+.2f} dB")
+            if loudness_gain != 0.0:
+                filters.append(f"volume={loudness_gain:.2f}dB")
+
+        render_cmd = [ff]
+        if request.loop > 1:
+            render_cmd.extend(["-stream_loop", str(request.loop - 1)])
+        render_cmd.extend(["-i", source_path, "-vn"])
+        if filters:
+            render_cmd.extend(["-af", ",".join(filters)])
+        render_cmd.extend([*request.encoder_args, "-y", output_path])
+        result = yield RenderStep(render_cmd, 80, f"Rendering {request.output_format.upper()} with ffmpeg...",
+                                  duration=request.output_duration(), progress_end=95)
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg processing failed: {result.stderr}")
+
+
+BACKENDS = {
+    'ffmpeg': FFmpegBackend(),
+    'soundstretch': SoundStretchBackend(),
+}
+
+
+def get_backend_preference():
+    return os.environ.get('YT_TRANSPOSE_BACKEND', 'auto').strip().lower() or 'auto'
+
+
+def select_backend(name, request, toolchain=None):
+    """依名稱（或 auto）與工具能力選擇 backend，無法使用時拋出例外"""
+    toolchain = toolchain or probe_toolchain()
+    name = (name or get_backend_preference()).lower()
+    if name != 'auto':
+        if name not in BACKENDS:
+            raise Exception(f"Unknown backend: {name} (available: auto, {', '.join(BACKENDS)})")
+        backend = BACKENDS[name]
+        reason = backend.unsupported_reason(request, toolchain)
+        if reason:
+            raise Exception(f"Backend '{name}' cannot process this job: {reason}")
+        return backend
+
+    # auto：有 rubberband（或不需變調/變速）時用單一 ffmpeg 行程；
+    # 否則優先 soundstretch 的音質，最後才用 atempo 串接
+    ffmpeg_backend = BACKENDS['ffmpeg']
+    soundstretch_backend = BACKENDS['soundstretch']
+    if not request.needs_stretch and request.loudness is not None:
+        # 只做響度正規化：解碼為 WAV 時同時測量、編碼時套用增益，來源只解碼一次
+        # （ffmpeg 引擎需要先多一次完整解碼測量響度）；不需要 soundstretch 執行檔
+        reason = soundstretch_backend.unsupported_reason(request, toolchain)
+        if reason is None:
+            return soundstretch_backend
+    ffmpeg_ok = ffmpeg_backend.unsupported_reason(request, toolchain) is None
+    if ffmpeg_ok and (toolchain.has_filter('rubberband') or not request.needs_stretch):
+        return ffmpeg_backend
+    reason = soundstretch_backend.unsupported_reason(request, toolchain)
+    if reason is None:
+        return soundstretch_backend
+    if ffmpeg_ok:
+        return ffmpeg_backend
+    raise Exception(reason)
+
+
+def resolve_backend_name(name, request):
+    """回傳會被選用的 backend 名稱（用於快取鍵），無法選擇時回傳指定的名稱"""
+    try:
+        return select_backend(name, request).name
+    except Exception:
+        return (name or get_backend_preference()).lower()
+
+
+def run_plan(plan, progress_callback=None):
+    """同步執行命令計畫，回傳計畫的回傳值"""
+    result = None
+    try:
+        while True:
+            try:
+                step = plan.send(result)
+            except StopIteration as stop:
+                return stop.value
+            if isinstance(step, WaitStep):
+                # 在目前執行緒等待
+                result = step.pending.wait()
+                continue
+            if progress_callback and step.message:
+                progress_callback(step.progress, step.message)
+            # 同時記錄子行程實際的 CPU 與記憶體用量，回饋給排程器（scheduler.py）
+            result = run_with_usage(step.cmd, **get_subprocess_kwargs())
+    finally:
+        plan.close()
+
+
+def render(backend, source_path, output_path, work_dir, request, progress_callback=None, toolchain=None):
+    toolchain = toolchain or probe_toolchain()
+    run_plan(backend.plan(source_path, output_path, work_dir, request, toolchain), progress_callback)
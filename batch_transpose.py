@@ -1,24 +1,72 @@
 from transposer_core import download_and_transpose
+from job_spec import iter_job_specs, validate_job_file, iter_prioritized
+from profiling import profiled
+from metadata_cache import prefetch_metadata
+from scheduler import set_background_priority
+from ytdlp_batch import prefetch_sources
+import metrics
+import argparse
 import sys
 
-try:
-    with open("urls.txt", "r", encoding="utf-8") as f:
-        for line in f:
-            if not line.strip(): 
-                continue
-            
-            parts = line.strip().split()
-            if len(parts) < 2:
-                print(f"Skipping invalid line: {line.strip()}")
-                continue
-            
-            url, semi = parts[0], int(parts[1])
-            print(f"\nProcessing: {url} ({semi:+} semitones)")
-            download_and_transpose(url, semi)
-except FileNotFoundError:
-    print("Error: urls.txt not found")
-    sys.exit(1)
-except Exception as e:
-    print(f"Error: {e}")
-    sys.exit(1)
+# 用法：python batch_transpose.py [工作檔] [--profile]
+#   工作檔預設為 urls.txt（每行 "網址 半音數"）
+#   .jsonl 檔每行一個 JSON 工作，可設定所有處理參數、priority 與輸出格式
+#   --profile（或 YT_TRANSPOSE_PROFILE=1）：每個工作的分析報告寫在輸出檔旁
+#   --normal-priority：不降低 CPU 與 I/O 優先順序（預設會降低，讓互動使用保持流暢）
 
+def report_invalid(line_no, error):
+    print(f"Skipping invalid line {line_no}: {error}")
+
+def iter_valid_jobs(path):
+    for line_no, job, error in iter_job_specs(path):
+        if job is not None:
+            yield job
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch download and transpose")
+    parser.add_argument("path", nargs="?", default="urls.txt", help="job file (urls.txt or .jsonl)")
+    parser.add_argument("--profile", action="store_true", default=None, help="profile each job")
+    parser.add_argument("--normal-priority", action="store_true",
+                        help="do not lower CPU/I-O priority (batch runs yield to interactive use by default)")
+    args = parser.parse_args()
+    path = args.path
+    if not args.normal_priority:
+        set_background_priority()
+
+    try:
+        # 先完整驗證工作檔（串流讀取，不會將整個檔案載入記憶體），再開始處理
+        valid, invalid = validate_job_file(path, report=report_invalid)
+    except FileNotFoundError:
+        print(f"Error: {path} not found")
+        sys.exit(1)
+
+    print(f"{valid} valid job(s), {invalid} invalid line(s) in {path}")
+    if valid == 0:
+        sys.exit(1 if invalid else 0)
+
+    failed = 0
+    remaining = metrics.queue_depth()
+    remaining.set(valid, queue='batch')
+    # 第二次串流讀取並依 priority 排程；無效的行已在驗證階段回報過
+    # 處理目前工作的同時，在背景預先解析後面幾個工作的影片資訊；
+    # 命令列模式（無法導入 yt_dlp）則以每個視窗一個 yt-dlp 行程，在背景下載後面工作的來源
+    jobs = prefetch_sources(prefetch_metadata(iter_prioritized(iter_valid_jobs(path))))
+    try:
+        for job in jobs:
+            remaining.dec(queue='batch')
+            print(f"\nProcessing: {job.describe()}")
+            try:
+                profiled(download_and_transpose, enabled=args.profile, **job.to_kwargs())
+            except Exception as e:
+                failed += 1
+                print(f"Error (line {job.line_no}): {e}")
+    finally:
+        # 中斷時結束背景的 yt-dlp 行程
+        jobs.close()
+
+    if failed:
+        print(f"\n{failed} job(s) failed")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""處理速度基準測試（不需網路）
+
+以 ffmpeg 產生合成的立體聲來源檔，對每個可用的處理引擎分別以
+全取樣率立體聲、單聲道、降低取樣率等模式處理，回報耗時與相對於
+全取樣率立體聲的加速倍數：
+
+    python benchmark.py
+    python benchmark.py --duration 300 --repeat 3 --output bench_output.txt
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from backends import BACKENDS, RenderRequest, Toolchain, probe_toolchain, render
+from scratch import estimate_scratch_bytes
+from transposer_core import OUTPUT_FORMATS, get_encoder_args, get_ffmpeg, get_subprocess_kwargs
+
+# (名稱, 聲道數, 取樣率)；第一個為比較基準
+MODES = [
+    ("stereo 48k", None, None),
+    ("mono 48k", 1, None),
+    ("stereo 24k", None, 24000),
+    ("mono 22.05k", 1, 22050),
+]
+
+
+def make_source(path, duration):
+    """產生有左右聲道差異的合成音訊（和弦 + 粉紅噪音），編碼為 MP3"""
+    ff = get_ffmpeg()
+    cmd = [
+        ff, "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"sine=frequency=220:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=277:duration={duration}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.05:duration={duration}",
+        "-filter_complex", "[0][2]amix=inputs=2[l];[1][2]amix=inputs=2[r];[l][r]join=inputs=2:channel_layout=stereo",
+        "-ar", "48000", "-codec:a", "libmp3lame", "-q:a", "2", "-y", path,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, **get_subprocess_kwargs())
+    if result.returncode != 0:
+        raise Exception(f"Failed to create benchmark source: {result.stderr}")
+
+
+def get_backend_variants(toolchain):
+    """可測試的 (名稱, backend, toolchain) 組合"""
+    variants = []
+    if toolchain.has_filter('rubberband'):
+        variants.append(("ffmpeg (rubberband)", BACKENDS['ffmpeg'], toolchain))
+    if toolchain.has_filter('atempo'):
+        no_rubberband = Toolchain(toolchain.ffmpeg, toolchain.soundstretch, toolchain.filters - {'rubberband'})
+        variants.append(("ffmpeg (atempo)", BACKENDS['ffmpeg'], no_rubberband))
+    if toolchain.soundstretch:
+        variants.append(("soundstretch", BACKENDS['soundstretch'], toolchain))
+    return variants
+
+
+def time_render(backend, toolchain, source, work_dir, request, repeat):
+    """執行 repeat 次，回傳最短耗時（秒）"""
+    output = os.path.join(work_dir, f"out.{request.output_format}")
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(backend, source, output, work_dir, request, toolchain=toolchain)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmark(duration=120, repeat=1, semitones=-3.0, tempo=None, output_format='mp3'):
+    toolchain = probe_toolchain()
+    if not toolchain.ffmpeg:
+        raise Exception("ffmpeg not found")
+    lines = [f"Source: {duration:g}s synthetic stereo, transpose {semitones:+g}"
+             + (f", tempo {tempo:+g}%" if tempo else "") + f", output {output_format}"]
+    work_dir = tempfile.mkdtemp(prefix="yt_transpose_bench_")
+    try:
+        source = os.path.join(work_dir, "source.mp3")
+        make_source(source, duration)
+        for variant_name, backend, variant_toolchain in get_backend_variants(toolchain):
+            lines.append("")
+            lines.append(f"{variant_name}:")
+            lines.append(f"  {'mode':<12} {'time':>8} {'speedup':>8} {'x realtime':>11} {'scratch':>9}")
+            baseline = None
+            for mode_name, channels, samplerate in MODES:
+                request = RenderRequest(semitones, tempo, output_format=output_format,
+                                        encoder_args=get_encoder_args(output_format),
+                                        channels=channels, samplerate=samplerate)
+                elapsed = time_render(backend, variant_toolchain, source, work_dir, request, repeat)
+                baseline = baseline or elapsed
+                scratch = estimate_scratch_bytes(duration, samplerate=samplerate or 48000, channels=channels or 2,
+                                                 needs_processing=backend.name == 'soundstretch')
+                lines.append(f"  {mode_name:<12} {elapsed:>7.2f}s {baseline / elapsed:>7.2f}x "
+                             f"{duration / elapsed:>10.1f}x {scratch / 1024 ** 2:>7.0f}MB")
+                print(lines[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark processing modes and backends")
+    parser.add_argument("--duration", type=float, default=120, help="source length in seconds")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per mode (best time is reported)")
+    parser.add_argument("--semitones", type=float, default=-3.0)
+    parser.add_argument("--tempo", type=float)
+    parser.add_argument("--format", dest="output_format", default="mp3", choices=list(OUTPUT_FORMATS))
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    lines = run_benchmark(args.duration, max(1, args.repeat), args.semitones, args.tempo, args.output_format)
+    report = "\n".join(lines)
+    print("\n" + report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
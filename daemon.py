@@ -0,0 +1,374 @@
+"""常駐服務與命令列客戶端
+
+每次執行 python transposer.py 都要重新啟動直譯器、匯入 yt-dlp、偵測 ffmpeg 濾鏡與
+soundstretch，並重建 YoutubeDL 連線與解密快取。常駐服務讓這些狀態在多次呼叫之間保持：
+
+    python daemon.py start     在背景啟動（python daemon.py run 則在前景執行）
+    python daemon.py status
+    python daemon.py stop
+
+服務啟動後，transposer.py 會自動把工作透過 Unix socket 交給服務執行並即時顯示進度；
+沒有服務在執行（或平台不支援 Unix socket）時照常在本行程執行。
+
+協定為每行一個 JSON：客戶端送出一個請求，服務回傳多個 {"progress", "message"} 事件，
+最後以 {"result"} 或 {"error"} 結束。socket 檔的權限為 0600，只有同一個使用者可以連線。
+
+請求同時帶有客戶端的工作設定（REQUEST_ENV 中的環境變數，例如處理引擎、預設、快取開關、
+工作類別），服務以這些設定執行該工作，結果與在客戶端行程執行時相同。環境變數是整個行程共用的，
+設定不同的工作會等到服務中其他設定的工作結束後才開始；設定相同的工作照常同時執行。
+快取位置與容量、資源上限等服務本身的設定仍以啟動服務時的環境變數為準。
+
+可用環境變數設定：
+    YT_TRANSPOSE_DAEMON_SOCKET=path   socket 路徑（預設在快取目錄中）
+    YT_TRANSPOSE_DAEMON_JOBS=2        服務同時執行的工作數
+    YT_TRANSPOSE_DAEMON=0             客戶端不使用服務，一律在本行程執行
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_JOBS = 2
+
+# 客戶端連線逾時（秒）：服務無回應時改在本行程執行
+CONNECT_TIMEOUT = 2.0
+
+# 每個工作各自的設定：客戶端隨請求送出，服務執行該工作時套用
+REQUEST_ENV = (
+    'YT_TRANSPOSE_BACKEND',
+    'YT_TRANSPOSE_PRESET',
+    'YT_TRANSPOSE_PROGRESSIVE',
+    'YT_TRANSPOSE_DEDUPE',
+    'YT_TRANSPOSE_DEDUPE_MAX_BER',
+    'YT_TRANSPOSE_JOB_CLASS',
+    'YT_TRANSPOSE_SOURCE_CACHE',
+    'YT_TRANSPOSE_RENDER_CACHE',
+    'YT_TRANSPOSE_METADATA_CACHE',
+    'YT_TRANSPOSE_PCM_CACHE',
+    'YT_TRANSPOSE_PCM_PROMOTE_AFTER',
+    'YT_TRANSPOSE_LOCAL_WORKERS',
+    'YT_TRANSPOSE_PROFILE',
+)
+
+
+def is_supported():
+    return hasattr(socket, 'AF_UNIX')
+
+
+def get_socket_path():
+    path = os.environ.get('YT_TRANSPOSE_DAEMON_SOCKET')
+    if path:
+        return path
+    from transposer_core import get_cache_dir
+    return os.path.join(get_cache_dir(), 'daemon.sock')
+
+
+def is_client_enabled():
+    return os.environ.get('YT_TRANSPOSE_DAEMON', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def _send(stream, lock, message):
+    data = (json.dumps(message) + "\n").encode('utf-8')
+    with lock:
+        stream.write(data)
+        stream.flush()
+
+
+def _get_job_limit():
+    try:
+        return max(1, int(os.environ.get('YT_TRANSPOSE_DAEMON_JOBS', DEFAULT_JOBS)))
+    except ValueError:
+        return DEFAULT_JOBS
+
+
+def warm_up():
+    """預先載入 yt-dlp、偵測工具能力並建立共用的連線池與快取"""
+    started = time.perf_counter()
+    try:
+        import yt_dlp  # noqa: F401
+        from ytdl_pool import get_ytdl_pool
+        get_ytdl_pool()
+    except ImportError:
+        pass
+    from backends import probe_toolchain
+    toolchain = probe_toolchain()
+    from metadata_cache import is_metadata_cache_enabled, get_metadata_cache
+    if is_metadata_cache_enabled():
+        get_metadata_cache()
+    from render_cache import is_render_cache_enabled, get_render_cache
+    if is_render_cache_enabled():
+        get_render_cache()
+    import metrics
+    metrics.get_registry()
+    print(f"Warmed up in {time.perf_counter() - started:.2f}s "
+          f"(ffmpeg: {toolchain.ffmpeg or 'missing'}, soundstretch: {toolchain.soundstretch or 'missing'})")
+
+
+def get_request_env():
+    """客戶端：隨請求送出的工作設定（未設定的變數為 None）"""
+    return {name: os.environ.get(name) for name in REQUEST_ENV}
+
+
+class RequestEnv:
+    """在服務中套用請求的工作設定
+
+    設定相同的工作可同時執行；設定不同時等到執行中的工作都結束，再改寫環境變數。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._current = None
+
+    def _apply(self, env):
+        for name in REQUEST_ENV:
+            value = env.get(name)
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self._current = env
+
+    def enter(self, env, progress_callback=None):
+        with self._cond:
+            if self._active and env != self._current:
+                if progress_callback:
+                    progress_callback(0, "Waiting for jobs with different settings to finish...")
+                self._cond.wait_for(lambda: self._active == 0 or env == self._current)
+            if env != self._current:
+                self._apply(env)
+            self._active += 1
+
+    def exit(self):
+        with self._cond:
+            self._active -= 1
+            if self._active == 0:
+                self._cond.notify_all()
+
+
+def run_request(request, progress_callback, request_env=None):
+    """在服務中執行一個工作請求，回傳結果"""
+    op = request.get('op')
+    kwargs = dict(request.get('kwargs') or {})
+    if op == 'transpose':
+        from transposer_core import download_and_transpose as func
+    elif op == 'local':
+        from local_input import process_local_inputs as func
+    else:
+        raise Exception(f"Unknown request: {op}")
+    env = request.get('env')
+    if request_env is None or env is None:
+        return _run_profiled(func, progress_callback, kwargs)
+    env = {name: env.get(name) for name in REQUEST_ENV}
+    request_env.enter(env, progress_callback)
+    try:
+        return _run_profiled(func, progress_callback, kwargs)
+    finally:
+        request_env.exit()
+
+
+def _run_profiled(func, progress_callback, kwargs):
+    # 客戶端設定 YT_TRANSPOSE_PROFILE=1 時與在本行程執行時一樣寫出分析報告
+    from profiling import profiled
+    return profiled(func, progress_callback=progress_callback, **kwargs)
+
+
+def serve(path=None):
+    """在前景執行服務，直到收到 stop 請求或中斷"""
+    import socketserver
+    if not is_supported():
+        raise Exception("Unix sockets are not supported on this platform")
+    path = path or get_socket_path()
+    if ping(path) is not None:
+        raise Exception(f"Daemon already running on {path}")
+    if os.path.exists(path):
+        # 上次未正常結束留下的 socket 檔
+        os.remove(path)
+
+    warm_up()
+    job_slots = threading.BoundedSemaphore(_get_job_limit())
+    request_env = RequestEnv()
+    state = {'active': 0, 'completed': 0, 'started': time.time()}
+    state_lock = threading.Lock()
+
+    class DaemonHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            send_lock = threading.Lock()
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                _send(self.wfile, send_lock, {'error': f"Invalid request: {e}"})
+                return
+            op = request.get('op')
+            if op == 'ping':
+                with state_lock:
+                    _send(self.wfile, send_lock, {'result': dict(state, pid=os.getpid())})
+                return
+            if op == 'stop':
+                _send(self.wfile, send_lock, {'result': 'stopping'})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+            def on_progress(progress, message):
+                # 客戶端中途離開時工作照常完成，只是不再回報進度
+                try:
+                    _send(self.wfile, send_lock, {'progress': progress, 'message': message})
+                except OSError:
+                    pass
+
+            if not job_slots.acquire(blocking=False):
+                on_progress(0, "Waiting for a free daemon slot...")
+                job_slots.acquire()
+            with state_lock:
+                state['active'] += 1
+            try:
+                result = run_request(request, on_progress, request_env)
+                reply = {'result': result}
+            except Exception as e:
+                reply = {'error': str(e)}
+            finally:
+                job_slots.release()
+                with state_lock:
+                    state['active'] -= 1
+                    state['completed'] += 1
+            try:
+                _send(self.wfile, send_lock, reply)
+            except OSError:
+                pass
+
+    class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    old_umask = os.umask(0o077)
+    try:
+        server = DaemonServer(path, DaemonHandler)
+    finally:
+        os.umask(old_umask)
+    os.chmod(path, 0o600)
+    print(f"Daemon listening on {path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    print("Daemon stopped")
+
+
+def _connect(path=None):
+    """連線到服務，沒有服務時回傳 None"""
+    if not is_supported():
+        return None
+    path = path or get_socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def request(message, progress_callback=None, path=None):
+    """送出請求並等待結果；沒有服務時回傳 (False, None)，否則回傳 (True, 結果)
+
+    工作失敗時拋出 Exception（與在本行程執行時相同）。
+    """
+    sock = _connect(path)
+    if sock is None:
+        return False, None
+    with sock:
+        try:
+            sock.sendall((json.dumps(message) + "\n").encode('utf-8'))
+        except OSError:
+            return False, None
+        # 工作可能執行很久，送出後不設逾時
+        sock.settimeout(None)
+        with sock.makefile('rb') as stream:
+            for line in stream:
+                event = json.loads(line)
+                if 'error' in event:
+                    raise Exception(event['error'])
+                if 'result' in event:
+                    return True, event['result']
+                if progress_callback:
+                    progress_callback(event.get('progress'), event.get('message'))
+    raise Exception("Daemon closed the connection before the job finished")
+
+
+def ping(path=None):
+    """回傳服務狀態，沒有服務時回傳 None"""
+    try:
+        handled, status = request({'op': 'ping'}, path=path)
+    except Exception:
+        return None
+    return status if handled else None
+
+
+def submit(op, kwargs, progress_callback=None):
+    """客戶端：交給服務執行（transposer.py 使用），沒有服務或已停用時回傳 (False, None)"""
+    if not is_client_enabled():
+        return False, None
+    return request({'op': op, 'kwargs': kwargs, 'env': get_request_env()}, progress_callback)
+
+
+def start_background(path=None):
+    """以獨立行程在背景啟動服務，等到可以連線為止"""
+    path = path or get_socket_path()
+    if ping(path) is not None:
+        print(f"Daemon already running on {path}")
+        return True
+    log_path = os.path.splitext(path)[0] + '.log'
+    with open(log_path, 'ab') as log:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'run'],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True, env=dict(os.environ, YT_TRANSPOSE_DAEMON_SOCKET=path),
+        )
+    for _ in range(300):
+        time.sleep(0.1)
+        if ping(path) is not None:
+            print(f"Daemon started on {path} (log: {log_path})")
+            return True
+    print(f"Daemon did not start, see {log_path}")
+    return False
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Warm background service for transposer.py")
+    parser.add_argument("command", choices=["start", "run", "stop", "status"])
+    parser.add_argument("--socket", help="socket path (default: YT_TRANSPOSE_DAEMON_SOCKET or the cache dir)")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        serve(args.socket)
+    elif args.command == 'start':
+        sys.exit(0 if start_background(args.socket) else 1)
+    elif args.command == 'status':
+        status = ping(args.socket)
+        if status is None:
+            print("Daemon not running")
+            sys.exit(1)
+        print(f"Daemon running (pid {status['pid']}, up {time.time() - status['started']:.0f}s, "
+              f"{status['active']} active, {status['completed']} completed)")
+    else:
+        handled, _ = request({'op': 'stop'}, path=args.socket)
+        print("Daemon stopping" if handled else "Daemon not running")
+
+
+if __name__ == "__main__":
+    main()
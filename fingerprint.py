@@ -0,0 +1,250 @@
+"""音訊指紋與重複來源偵測
+
+同一首歌常以不同影片 ID 重複上傳（重新上傳、歌詞影片），各自下載與快取會浪費流量與空間。
+這裡以開頭數十秒的解碼音訊計算精簡的指紋：每個音框在 300～2000 Hz 的 33 個對數頻帶中，
+以相鄰頻帶能量差的時間變化取 32 個位元（Haitsma & Kalker 式的頻帶能量雜湊），
+整段以 numpy 向量化計算。指紋以來源 ID 為鍵存在 SQLite 索引中，比對時以 Hamming
+距離（位元錯誤率）計算，並容許開頭有數秒的偏移。
+
+處理新網址時（啟用 dedupe 時）：
+1. 先以影片資訊中的長度在索引中找長度相近的已快取來源，沒有候選時不做任何額外動作
+2. 有候選時只下載開頭一小段（download_ranges）計算指紋並比對
+3. 足夠相似時直接使用來源快取中的檔案（以及它的波形等衍生資料），不下載完整音訊
+
+可用環境變數設定：
+    YT_TRANSPOSE_DEDUPE=1             啟用重複來源偵測（或命令列 --dedupe）
+    YT_TRANSPOSE_DEDUPE_MAX_BER=0.25  視為相同來源的最大位元錯誤率
+"""
+import os
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from transposer_core import get_ffmpeg, get_subprocess_kwargs
+
+# 指紋計算的取樣率、音框與頻帶設定
+FINGERPRINT_SAMPLERATE = 11025
+FRAME_SIZE = 2048
+HOP_SIZE = 1024
+BAND_EDGES_HZ = np.geomspace(300, 2000, 34)
+# 取開頭多少秒計算指紋
+FINGERPRINT_SECONDS = 30
+# 比對時容許的開頭偏移（秒）與最少重疊的音框數
+MAX_OFFSET_SECONDS = 5
+MIN_OVERLAP_FRAMES = 64
+# 候選來源的長度容許差距：相差 3 秒或 3% 以內
+DURATION_TOLERANCE_SECONDS = 3
+DURATION_TOLERANCE_RATIO = 0.03
+# 不相關的音訊位元錯誤率約為 0.45～0.5，相同音訊的不同編碼或數秒偏移約為 0.1～0.2
+DEFAULT_MAX_BER = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    source_id TEXT PRIMARY KEY,
+    fingerprint BLOB NOT NULL,
+    duration REAL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprints_duration ON fingerprints (duration);
+"""
+
+
+def is_dedupe_enabled(dedupe=None):
+    if dedupe is not None:
+        return dedupe
+    return os.environ.get('YT_TRANSPOSE_DEDUPE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_max_ber():
+    try:
+        return float(os.environ.get('YT_TRANSPOSE_DEDUPE_MAX_BER', DEFAULT_MAX_BER))
+    except ValueError:
+        return DEFAULT_MAX_BER
+
+
+def decode_head(path, seconds=FINGERPRINT_SECONDS, samplerate=FINGERPRINT_SAMPLERATE):
+    """解碼開頭 seconds 秒為單聲道 float32"""
+    ff = get_ffmpeg()
+    if not ff:
+        raise Exception("ffmpeg not found")
+    cmd = [ff, "-v", "error", "-i", path, "-t", str(seconds), "-vn", "-ac", "1", "-ar", str(samplerate),
+           "-f", "s16le", "-"]
+    result = subprocess.run(cmd, capture_output=True, **get_subprocess_kwargs())
+    if result.returncode != 0:
+        raise Exception(f"Failed to decode audio for fingerprint: {result.stderr.decode('utf-8', errors='ignore')}")
+    return np.frombuffer(result.stdout, dtype='<i2').astype(np.float32) / 32768.0
+
+
+def compute_fingerprint(samples, samplerate=FINGERPRINT_SAMPLERATE):
+    """由 PCM 計算指紋：每個音框一個 uint32"""
+    if len(samples) < FRAME_SIZE * 2:
+        return np.zeros(0, dtype=np.uint32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1)) ** 2
+    # 各頻帶能量（以 reduceat 加總頻帶內的 FFT bin）
+    bins = np.round(BAND_EDGES_HZ * FRAME_SIZE / samplerate).astype(np.int64)
+    energy = np.add.reduceat(spectrum, bins[:-1], axis=1)[:, :len(bins) - 1]
+    energy = np.log1p(energy)
+    # 位元 = 相鄰頻帶能量差在時間上的變化是否為正
+    band_diff = energy[:, :-1] - energy[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    weights = (1 << np.arange(bits.shape[1], dtype=np.uint64)).astype(np.uint64)
+    return (bits.astype(np.uint64) @ weights).astype(np.uint32)
+
+
+def fingerprint_file(path, seconds=FINGERPRINT_SECONDS):
+    return compute_fingerprint(decode_head(path, seconds))
+
+
+def _popcount32(values):
+    return np.unpackbits(values.view(np.uint8)).reshape(len(values), 32).sum(axis=1)
+
+
+def bit_error_rate(a, b, max_offset=None):
+    """兩個指紋在容許偏移內的最低位元錯誤率（0～1），重疊不足時回傳 1.0"""
+    if max_offset is None:
+        max_offset = int(MAX_OFFSET_SECONDS * FINGERPRINT_SAMPLERATE / HOP_SIZE)
+    best = 1.0
+    for offset in range(-max_offset, max_offset + 1):
+        if offset >= 0:
+            x, y = a[offset:], b
+        else:
+            x, y = a, b[-offset:]
+        n = min(len(x), len(y))
+        if n < MIN_OVERLAP_FRAMES:
+            continue
+        errors = _popcount32(np.bitwise_xor(x[:n], y[:n])).sum()
+        best = min(best, errors / (n * 32.0))
+    return best
+
+
+class FingerprintIndex:
+    """以來源 ID 為鍵的指紋索引"""
+
+    def __init__(self, path=None):
+        if path is None:
+            from transposer_core import get_cache_dir
+            path = os.path.join(get_cache_dir('fingerprints'), 'index.db')
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add(self, source_id, fingerprint, duration=None):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO fingerprints (source_id, fingerprint, duration, created) VALUES (?, ?, ?, ?)",
+                        (source_id, np.ascontiguousarray(fingerprint, dtype='<u4').tobytes(), duration, time.time()),
+                    )
+            finally:
+                conn.close()
+
+    def remove(self, source_id):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM fingerprints WHERE source_id = ?", (source_id,))
+            finally:
+                conn.close()
+
+    def candidates(self, duration, exclude=None):
+        """長度相近的已索引來源（沒有長度時不比對）"""
+        if not duration:
+            return []
+        tolerance = max(DURATION_TOLERANCE_SECONDS, duration * DURATION_TOLERANCE_RATIO)
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT source_id, fingerprint FROM fingerprints WHERE duration BETWEEN ? AND ? AND source_id != ?",
+                    (duration - tolerance, duration + tolerance, exclude or ''),
+                ).fetchall()
+            finally:
+                conn.close()
+        return [(row['source_id'], np.frombuffer(row['fingerprint'], dtype='<u4')) for row in rows]
+
+    def find_match(self, fingerprint, duration, exclude=None, max_ber=None):
+        """回傳 (來源 ID, 位元錯誤率)，沒有足夠相似的來源時回傳 None"""
+        max_ber = get_max_ber() if max_ber is None else max_ber
+        best = None
+        for source_id, candidate in self.candidates(duration, exclude):
+            ber = bit_error_rate(fingerprint, candidate)
+            if ber <= max_ber and (best is None or ber < best[1]):
+                best = (source_id, ber)
+        return best
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_fingerprint_index():
+    """取得行程內共用的指紋索引"""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = FingerprintIndex()
+        return _default_index
+
+
+def index_source(source_id, path, duration=None):
+    """為加入來源快取的檔案計算並記錄指紋"""
+    get_fingerprint_index().add(source_id, fingerprint_file(path), duration)
+
+
+def probe_fingerprint(info, seconds=FINGERPRINT_SECONDS):
+    """只下載開頭一段（以 yt-dlp 的 download_ranges）計算指紋"""
+    import yt_dlp
+    from ytdl_pool import get_ytdl_pool
+    ff = get_ffmpeg()
+    probe_dir = tempfile.mkdtemp(prefix='yt_transpose_probe_')
+    try:
+        ydl_opts = {
+            # 開頭一段只用來比對，取最小的音訊格式即可
+            'format': 'worstaudio/bestaudio/best',
+            'outtmpl': os.path.join(probe_dir, 'probe.%(ext)s'),
+            'download_ranges': yt_dlp.utils.download_range_func(None, [(0, seconds + MAX_OFFSET_SECONDS)]),
+            'postprocessors': [],
+        }
+        if ff:
+            ydl_opts['ffmpeg_location'] = os.path.dirname(os.path.abspath(ff))
+        with get_ytdl_pool().session(**ydl_opts) as ydl:
+            ydl.process_ie_result(dict(info), download=True)
+        files = [os.path.join(probe_dir, name) for name in os.listdir(probe_dir) if not name.endswith('.part')]
+        if not files:
+            raise Exception("Fingerprint probe download produced no file")
+        return fingerprint_file(files[0], seconds + MAX_OFFSET_SECONDS)
+    finally:
+        import shutil
+        shutil.rmtree(probe_dir, ignore_errors=True)
+
+
+def find_duplicate_source(source_id, info, source_cache, min_kbps=0):
+    """找出與這部影片內容相同、已在來源快取中的來源，回傳 (快取檔路徑, 來源 ID, 位元錯誤率) 或 None"""
+    index = get_fingerprint_index()
+    duration = info.get('duration')
+    if not index.candidates(duration, exclude=source_id):
+        # 沒有長度相近的候選，不需下載開頭比對
+        return None
+    fingerprint = probe_fingerprint(info)
+    match = index.find_match(fingerprint, duration, exclude=source_id)
+    if match is None:
+        return None
+    matched_id, ber = match
+    cached_path = source_cache.lookup(matched_id, min_kbps)
+    if cached_path is None:
+        return None
+    return cached_path, matched_id, ber
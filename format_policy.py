@@ -0,0 +1,158 @@
+"""依頻寬選擇音訊格式
+
+以往固定使用 'bestaudio/best'：總是下載位元率最高的音訊，找不到純音訊時
+甚至會下載整個影片檔，但最後仍會轉成 192k 左右的 MP3。這裡改為挑選
+「足以達到目標輸出品質的最小純音訊串流」，並估算相對於 bestaudio 省下的位元組數。
+
+不同編碼的壓縮效率不同（例如 Opus 128k 的音質約等於 MP3 192k），
+比較時以等效 MP3 位元率計算。
+"""
+import math
+
+# 各音訊編碼相對於 MP3 的壓縮效率（等效 MP3 位元率 = 位元率 × 係數）
+CODEC_EFFICIENCY = {
+    'opus': 1.5,
+    'vorbis': 1.25,
+    'mp4a': 1.3,
+    'aac': 1.3,
+    'mp3': 1.0,
+    'ac-3': 0.9,
+    'ec-3': 1.1,
+}
+
+# 無損格式：任何位元率都視為足夠
+LOSSLESS_CODECS = ('flac', 'alac', 'pcm', 'wav')
+
+# 各輸出格式的目標品質（等效 MP3 kbps）；None 表示無損輸出，直接選最好的音訊
+TARGET_KBPS = {
+    'mp3': 192,
+    'm4a': 192,
+    'ogg': 192,
+    'opus': 160,
+    'flac': None,
+    'wav': None,
+}
+
+
+def get_target_kbps(output_format):
+    return TARGET_KBPS.get((output_format or 'mp3').lower(), 192)
+
+
+def get_codec_efficiency(acodec):
+    acodec = (acodec or '').lower()
+    for prefix, factor in CODEC_EFFICIENCY.items():
+        if acodec.startswith(prefix):
+            return factor
+    return 1.0
+
+
+def is_audio_only(fmt):
+    acodec = fmt.get('acodec')
+    vcodec = fmt.get('vcodec')
+    return acodec not in (None, 'none') and vcodec == 'none'
+
+
+def has_audio(fmt):
+    return fmt.get('acodec') not in (None, 'none')
+
+
+def get_bitrate(fmt):
+    """音訊位元率（kbps），未知時回傳 None"""
+    return fmt.get('abr') or (fmt.get('tbr') if is_audio_only(fmt) else None)
+
+
+def get_effective_kbps(fmt):
+    """等效 MP3 位元率（kbps）"""
+    acodec = (fmt.get('acodec') or '').lower()
+    if acodec.startswith(LOSSLESS_CODECS):
+        return float('inf')
+    bitrate = get_bitrate(fmt)
+    if not bitrate:
+        return None
+    return bitrate * get_codec_efficiency(acodec)
+
+
+def estimate_size(fmt, duration=None):
+    """估算格式的檔案大小（位元組），未知時回傳 None"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    bitrate = fmt.get('tbr') or get_bitrate(fmt)
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
+
+
+def _best_audio(candidates):
+    """模擬 bestaudio：位元率最高的純音訊格式"""
+    return max(candidates, key=lambda f: get_bitrate(f) or 0)
+
+
+def select_audio_format(formats, target_kbps=192, allow_video=False, duration=None):
+    """選擇達到目標品質的最小純音訊格式
+
+    回傳 (選擇的格式, bestaudio 會選擇的格式)；沒有可用格式時拋出例外。
+    target_kbps 為 None 時（無損輸出）直接選擇最好的音訊。
+    """
+    audio_only = [f for f in formats or [] if is_audio_only(f) and f.get('format_id')]
+    if not audio_only:
+        if not allow_video:
+            raise Exception("No audio-only format available (video fallback is disabled)")
+        with_audio = [f for f in formats or [] if has_audio(f) and f.get('format_id')]
+        if not with_audio:
+            raise Exception("No format with audio available")
+        # 允許影片時，選擇最小的含音訊格式
+        chosen = min(with_audio, key=lambda f: estimate_size(f, duration) or float('inf'))
+        return chosen, chosen
+
+    baseline = _best_audio(audio_only)
+    if target_kbps is None:
+        return baseline, baseline
+
+    meets = [f for f in audio_only if (get_effective_kbps(f) or 0) >= target_kbps]
+    if not meets:
+        # 沒有任何格式達到目標，選擇品質最好的
+        return baseline, baseline
+
+    def sort_key(f):
+        size = estimate_size(f, duration)
+        # 大小未知時以位元率比較
+        return (size if size is not None else float('inf'), get_bitrate(f) or 0)
+
+    return min(meets, key=sort_key), baseline
+
+
+def get_min_bitrate(target_kbps, acodec):
+    """某個編碼達到目標品質所需的最低位元率（與 select_audio_format 的門檻相同）"""
+    # 無條件進位到小數第二位，避免浮點誤差讓命令列選到 Python API 會排除的格式
+    return math.ceil(target_kbps / get_codec_efficiency(acodec) * 100) / 100
+
+
+def build_format_spec(target_kbps=192, allow_video=False):
+    """命令列模式使用的格式字串：達到目標品質的最小音訊，否則最好的音訊
+
+    yt-dlp 的格式字串無法在不同條件間比較大小，因此依壓縮效率由高到低排列各編碼：
+    每個編碼的位元率下限與 select_audio_format 相同（等效 MP3 位元率 >= 目標），
+    同樣品質下效率高的編碼檔案較小；未列出的編碼以效率 1.0 計算。
+    """
+    if target_kbps is None:
+        spec = "bestaudio"
+    else:
+        codecs = sorted(CODEC_EFFICIENCY, key=lambda codec: -CODEC_EFFICIENCY[codec])
+        alternatives = [f"worstaudio[acodec^={codec}][abr>={get_min_bitrate(target_kbps, codec):g}]"
+                        for codec in codecs]
+        # 其他編碼：效率低於 MP3 的已知編碼（例如 ac-3）不能以 MP3 的門檻放行
+        excluded = "".join(f"[acodec!^={codec}]" for codec in codecs if CODEC_EFFICIENCY[codec] < 1.0)
+        alternatives.append(f"worstaudio{excluded}[abr>={get_min_bitrate(target_kbps, None):g}]")
+        spec = "/".join(alternatives) + "/bestaudio"
+    if allow_video:
+        spec += "/best"
+    return spec
+
+
+def describe_format(fmt, duration=None):
+    size = estimate_size(fmt, duration)
+    size_text = f", ~{size / 1024 ** 2:.1f} MB" if size else ""
+    bitrate = get_bitrate(fmt)
+    bitrate_text = f", {bitrate:.0f} kbps" if bitrate else ""
+    return f"{fmt.get('format_id')} ({fmt.get('acodec')}{bitrate_text}{size_text})"
@@ -0,0 +1,221 @@
+"""以 SQLite 實作、可跨機器共用的租約式工作佇列
+
+佇列檔放在共用儲存空間上，多台主機的 worker 各自從中領取工作：
+
+- 領取工作時取得有期限的租約（lease），處理期間定期以 heartbeat 延長；
+  worker 當機時租約到期，工作會自動回到待處理狀態由其他 worker 接手。
+- 完成時在持有資料庫寫入鎖的情況下確認租約仍屬於自己，才把結果以
+  os.replace 原子地移入輸出目錄並標記完成，因此每個工作只會由一個 worker 發布。
+
+注意：SQLite 依賴檔案鎖；放在網路檔案系統上時，該檔案系統必須正確支援 POSIX 檔案鎖。
+"""
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+# 工作狀態
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    spec TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result_path TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority DESC, id);
+"""
+
+
+class Lease:
+    """worker 目前持有的一個工作租約"""
+
+    def __init__(self, job_id, spec, attempt, worker_id):
+        self.job_id = job_id
+        self.spec = spec
+        self.attempt = attempt
+        self.worker_id = worker_id
+
+
+class JobQueue:
+    """共用的租約式工作佇列"""
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # isolation_level=None：由程式自行以 BEGIN IMMEDIATE 控制交易
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _ClosingConnection(conn)
+
+    def enqueue(self, spec, priority=0):
+        """加入一個工作（spec 為 JobSpec.to_dict() 格式的 dict），回傳工作 ID"""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (spec, priority, state, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (json.dumps(spec, ensure_ascii=False), priority, PENDING, now, now),
+            )
+            return cur.lastrowid
+
+    def enqueue_many(self, specs, batch_size=1000):
+        """批次加入工作（specs 為 (spec, priority) 的可迭代物件，以串流方式寫入）"""
+        count = 0
+        batch = []
+        with self._connect() as conn:
+            for spec, priority in specs:
+                now = time.time()
+                batch.append((json.dumps(spec, ensure_ascii=False), priority, PENDING, now, now))
+                if len(batch) >= batch_size:
+                    count += self._insert_batch(conn, batch)
+                    batch = []
+            if batch:
+                count += self._insert_batch(conn, batch)
+        return count
+
+    def _insert_batch(self, conn, batch):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO jobs (spec, priority, state, created, updated) VALUES (?, ?, ?, ?, ?)", batch)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(batch)
+
+    def _requeue_expired(self, conn, now):
+        """將租約已過期的工作放回佇列（超過重試次數的標記為失敗）"""
+        conn.execute(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, "
+            "error = 'lease expired', updated = ? "
+            "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, now, RUNNING, now, self.max_attempts),
+        )
+        conn.execute(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, updated = ? "
+            "WHERE state = ? AND lease_expires < ?",
+            (PENDING, now, RUNNING, now),
+        )
+
+    def claim(self, worker_id):
+        """領取優先順序最高的待處理工作，沒有工作時回傳 None"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._requeue_expired(conn, now)
+                row = conn.execute(
+                    "SELECT id, spec, attempts FROM jobs WHERE state = ? "
+                    "ORDER BY priority DESC, id LIMIT 1",
+                    (PENDING,),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET state = ?, lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated = ? WHERE id = ?",
+                    (RUNNING, worker_id, now + self.lease_seconds, now, row['id']),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return Lease(row['id'], json.loads(row['spec']), row['attempts'] + 1, worker_id)
+
+    def heartbeat(self, lease):
+        """延長租約，回傳 False 表示租約已失效（已過期並被其他 worker 接手）"""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? "
+                "WHERE id = ? AND lease_owner = ? AND state = ? AND lease_expires >= ?",
+                (now + self.lease_seconds, now, lease.job_id, lease.worker_id, RUNNING, now),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, lease, publish):
+        """確認租約仍有效後呼叫 publish() 發布結果並標記完成
+
+        publish() 在持有資料庫寫入鎖時執行，回傳最終結果路徑；
+        租約已失效時不會呼叫 publish()，並回傳 None。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT 1 FROM jobs WHERE id = ? AND lease_owner = ? AND state = ? AND lease_expires >= ?",
+                    (lease.job_id, lease.worker_id, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("ROLLBACK")
+                    return None
+                result_path = publish()
+                conn.execute(
+                    "UPDATE jobs SET state = ?, result_path = ?, error = NULL, lease_owner = NULL, "
+                    "lease_expires = NULL, updated = ? WHERE id = ?",
+                    (DONE, result_path, time.time(), lease.job_id),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return result_path
+
+    def fail(self, lease, error):
+        """回報工作失敗：未達重試上限時放回佇列，否則標記為失敗"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "error = ?, lease_owner = NULL, lease_expires = NULL, updated = ? "
+                "WHERE id = ? AND lease_owner = ? AND state = ?",
+                (self.max_attempts, FAILED, PENDING, str(error), now, lease.job_id, lease.worker_id, RUNNING),
+            )
+
+    def counts(self):
+        """各狀態的工作數量（可作為佇列深度）"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update({row['state']: row['n'] for row in rows})
+        return counts
+
+
+class _ClosingConnection:
+    """with 區塊結束時關閉連線（sqlite3 預設的 context manager 只處理交易）"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.close()
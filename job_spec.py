@@ -0,0 +1,345 @@
+"""批次工作規格（JSONL）
+
+每行一個 JSON 物件，對應一次 download_and_transpose 呼叫，例如：
+
+    {"url": "https://youtu.be/abc123", "semitones": -2.5, "tempo": 10, "format": "m4a"}
+    {"url": "https://youtu.be/xyz789", "bpm": 128, "priority": 5, "output_dir": "out/fast"}
+
+檔案以串流方式逐行讀取，數百萬行的工作檔也只使用固定記憶體。
+舊的 urls.txt 格式（每行 "網址 半音數"）也會轉成相同的工作規格。
+"""
+import heapq
+import json
+import math
+
+# 欄位名稱 -> 說明（也用於檢查未知欄位，避免拼字錯誤被默默忽略）
+JOB_FIELDS = {
+    'url': 'YouTube 連結（必填）',
+    'semitones': '半音數，可為小數（預設 0）',
+    'tempo': '速度調整百分比（不影響音調）',
+    'rate': '速度與音調同步調整百分比',
+    'bpm': '目標 BPM',
+    'loudness': '目標整合響度（LUFS）',
+    'start': '片段開始時間（秒數或 "mm:ss"）',
+    'end': '片段結束時間（秒數或 "mm:ss"）',
+    'loop': '循環次數（預設 1）',
+    'output_dir': '輸出目錄',
+    'format': '輸出格式（預設 mp3）',
+    'preset': '速度/品質預設（draft、standard、archival）',
+    'mono': '降混為單聲道處理（true/false）',
+    'samplerate': '處理取樣率（Hz），例如 22050',
+    'backend': '處理引擎（auto、ffmpeg、soundstretch）',
+    'allow_video_fallback': '沒有純音訊格式時允許下載含影像的格式（true/false）',
+    'use_cache': '使用處理結果快取（true/false，預設 true）',
+    'dedupe': '以音訊指紋重用內容相同的已快取來源（true/false）',
+    'progressive': '編碼時直接寫入輸出目錄，可邊處理邊播放（true/false）',
+    'priority': '優先順序，數字越大越先處理（預設 0）',
+    'id': '自訂工作識別碼（僅用於報告）',
+}
+
+# 數值欄位的合理範圍（與 GUI 的範圍一致）
+NUMBER_RANGES = {
+    'semitones': (-24.0, 24.0),
+    'tempo': (-95.0, 5000.0),
+    'rate': (-95.0, 5000.0),
+    'bpm': (1.0, 1000.0),
+    'loudness': (-70.0, 0.0),
+}
+
+# 串流排程時，依優先順序重新排序的視窗大小
+DEFAULT_PRIORITY_WINDOW = 1000
+
+
+class JobSpec:
+    """一個已驗證的批次工作"""
+
+    def __init__(self, url, semitones=0.0, tempo=None, rate=None, bpm=None, loudness=None,
+                 output_dir=None, output_format='mp3', priority=0, job_id=None, line_no=None,
+                 start=None, end=None, loop=1, preset=None, channels=None, samplerate=None,
+                 backend=None, allow_video_fallback=False, use_cache=True, dedupe=None, progressive=None):
+        self.url = url
+        self.semitones = semitones
+        self.tempo = tempo
+        self.rate = rate
+        self.bpm = bpm
+        self.loudness = loudness
+        self.output_dir = output_dir
+        self.start = start
+        self.end = end
+        self.loop = loop
+        self.output_format = output_format
+        self.preset = preset
+        self.channels = channels
+        self.samplerate = samplerate
+        self.backend = backend
+        self.allow_video_fallback = allow_video_fallback
+        self.use_cache = use_cache
+        self.dedupe = dedupe
+        self.progressive = progressive
+        self.priority = priority
+        self.job_id = job_id
+        self.line_no = line_no
+
+    def to_kwargs(self):
+        """轉為 download_and_transpose 的關鍵字參數"""
+        return {
+            'url': self.url,
+            'semitones': self.semitones,
+            'output_dir': self.output_dir,
+            'tempo': self.tempo,
+            'rate': self.rate,
+            'bpm': self.bpm,
+            'loudness': self.loudness,
+            'output_format': self.output_format,
+            'start': self.start,
+            'end': self.end,
+            'loop': self.loop,
+            'preset': self.preset,
+            'channels': self.channels,
+            'samplerate': self.samplerate,
+            'backend': self.backend,
+            'allow_video_fallback': self.allow_video_fallback,
+            'use_cache': self.use_cache,
+            'dedupe': self.dedupe,
+            'progressive': self.progressive,
+        }
+
+    def to_dict(self):
+        """轉為可序列化的 dict（與 JSONL 欄位相同）"""
+        data = {'url': self.url, 'semitones': self.semitones, 'format': self.output_format, 'priority': self.priority}
+        if self.loop != 1:
+            data['loop'] = self.loop
+        if self.channels == 1:
+            data['mono'] = True
+        if self.allow_video_fallback:
+            data['allow_video_fallback'] = True
+        if not self.use_cache:
+            data['use_cache'] = False
+        for key in ('tempo', 'rate', 'bpm', 'loudness', 'output_dir', 'start', 'end', 'preset', 'samplerate',
+                    'backend', 'dedupe', 'progressive'):
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+        if self.job_id is not None:
+            data['id'] = self.job_id
+        return data
+
+    def describe(self):
+        """簡短描述，用於進度輸出"""
+        if self.bpm is not None:
+            mode = f"bpm {self.bpm:g}"
+        elif self.rate is not None:
+            mode = f"rate {self.rate:+g}%"
+        else:
+            mode = f"{self.semitones:+g} semitones"
+            if self.tempo is not None:
+                mode += f", tempo {self.tempo:+g}%"
+        if self.start is not None or self.end is not None:
+            mode += f", {self.start or 0:g}s-{'end' if self.end is None else format(self.end, 'g') + 's'}"
+        if self.loop > 1:
+            mode += f", loop x{self.loop}"
+        if self.preset is not None:
+            mode += f", {self.preset}"
+        if self.channels == 1:
+            mode += ", mono"
+        if self.samplerate:
+            mode += f", {self.samplerate} Hz"
+        if self.backend is not None:
+            mode += f", {self.backend}"
+        return f"{self.url} ({mode})"
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def validate_job_dict(data):
+    """驗證一個工作 dict，回傳 (JobSpec, None) 或 (None, 錯誤訊息)"""
+    from transposer_core import OUTPUT_FORMATS, parse_time
+    from presets import PRESETS
+    from backends import BACKENDS
+
+    if not isinstance(data, dict):
+        return None, "job must be a JSON object"
+    errors = []
+    unknown = sorted(set(data) - set(JOB_FIELDS))
+    if unknown:
+        errors.append(f"unknown field(s): {', '.join(unknown)}")
+
+    url = data.get('url')
+    if not isinstance(url, str) or not url.strip():
+        errors.append("'url' is required and must be a non-empty string")
+
+    numbers = {}
+    for key, (low, high) in NUMBER_RANGES.items():
+        value = data.get(key)
+        if value is None:
+            continue
+        if not _is_number(value):
+            errors.append(f"'{key}' must be a number")
+        elif not low <= value <= high:
+            errors.append(f"'{key}' must be between {low:g} and {high:g}")
+        else:
+            numbers[key] = float(value)
+
+    times = {}
+    for key in ('start', 'end'):
+        value = data.get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            errors.append(f"'{key}' must be seconds or a \"mm:ss\" string")
+            continue
+        try:
+            times[key] = parse_time(value)
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        if times[key] is not None and times[key] < 0:
+            errors.append(f"'{key}' must not be negative")
+    if times.get('start') is not None and times.get('end') is not None and times['end'] <= times['start']:
+        errors.append("'end' must be after 'start'")
+
+    loop = data.get('loop', 1)
+    if not isinstance(loop, int) or isinstance(loop, bool) or not 1 <= loop <= 100:
+        errors.append("'loop' must be an integer between 1 and 100")
+
+    output_format = data.get('format', 'mp3')
+    if not isinstance(output_format, str) or output_format.lower() not in OUTPUT_FORMATS:
+        errors.append(f"'format' must be one of: {', '.join(OUTPUT_FORMATS)}")
+
+    preset = data.get('preset')
+    if preset is not None and (not isinstance(preset, str) or preset.lower() not in PRESETS):
+        errors.append(f"'preset' must be one of: {', '.join(PRESETS)}")
+
+    mono = data.get('mono', False)
+    if not isinstance(mono, bool):
+        errors.append("'mono' must be true or false")
+
+    samplerate = data.get('samplerate')
+    if samplerate is not None and (not isinstance(samplerate, int) or isinstance(samplerate, bool)
+                                   or not 8000 <= samplerate <= 192000):
+        errors.append("'samplerate' must be an integer between 8000 and 192000")
+
+    backend_choices = ['auto', *BACKENDS]
+    backend = data.get('backend')
+    if backend is not None and (not isinstance(backend, str) or backend.lower() not in backend_choices):
+        errors.append(f"'backend' must be one of: {', '.join(backend_choices)}")
+
+    flags = {}
+    for key in ('allow_video_fallback', 'use_cache', 'dedupe', 'progressive'):
+        value = data.get(key)
+        if value is None:
+            continue
+        if not isinstance(value, bool):
+            errors.append(f"'{key}' must be true or false")
+        else:
+            flags[key] = value
+
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        errors.append("'priority' must be an integer")
+
+    output_dir = data.get('output_dir')
+    if output_dir is not None and (not isinstance(output_dir, str) or not output_dir.strip()):
+        errors.append("'output_dir' must be a non-empty string")
+
+    if errors:
+        return None, "; ".join(errors)
+    return JobSpec(
+        url=url.strip(),
+        semitones=numbers.get('semitones', 0.0),
+        tempo=numbers.get('tempo'),
+        rate=numbers.get('rate'),
+        bpm=numbers.get('bpm'),
+        loudness=numbers.get('loudness'),
+        output_dir=output_dir,
+        output_format=output_format.lower(),
+        priority=priority,
+        job_id=data.get('id'),
+        start=times.get('start'),
+        end=times.get('end'),
+        loop=loop,
+        preset=preset.lower() if preset is not None else None,
+        channels=1 if mono is True else None,
+        samplerate=samplerate,
+        backend=backend.lower() if backend is not None else None,
+        allow_video_fallback=flags.get('allow_video_fallback', False),
+        use_cache=flags.get('use_cache', True),
+        dedupe=flags.get('dedupe'),
+        progressive=flags.get('progressive'),
+    ), None
+
+
+def parse_legacy_line(line):
+    """解析舊格式的一行（"網址 半音數"），回傳 dict 或錯誤訊息"""
+    parts = line.split()
+    if len(parts) < 2:
+        return None, "expected '<url> <semitones>'"
+    try:
+        semitones = float(parts[1])
+    except ValueError:
+        return None, f"invalid semitones: {parts[1]}"
+    return {'url': parts[0], 'semitones': semitones}, None
+
+
+def iter_job_specs(path, legacy=None):
+    """串流讀取工作檔，逐行產生 (行號, JobSpec 或 None, 錯誤訊息或 None)
+
+    空行與 # 開頭的註解行會被略過。legacy 為 None 時依副檔名判斷格式
+    （.jsonl/.json 為 JSONL，其他為舊的 "網址 半音數" 格式）。
+    """
+    if legacy is None:
+        legacy = not path.lower().endswith(('.jsonl', '.json'))
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if legacy:
+                data, error = parse_legacy_line(line)
+            else:
+                try:
+                    data, error = json.loads(line), None
+                except ValueError as e:
+                    data, error = None, f"invalid JSON: {e}"
+            if error is None:
+                job, error = validate_job_dict(data)
+            else:
+                job = None
+            if job is not None:
+                job.line_no = line_no
+            yield line_no, job, error
+
+
+def validate_job_file(path, report=None, legacy=None):
+    """在排程前完整驗證工作檔，回傳 (有效工作數, 無效行數)
+
+    無效的行會透過 report(行號, 錯誤訊息) 回報，不會中止驗證。
+    """
+    valid = invalid = 0
+    for line_no, job, error in iter_job_specs(path, legacy):
+        if job is None:
+            invalid += 1
+            if report:
+                report(line_no, error)
+        else:
+            valid += 1
+    return valid, invalid
+
+
+def iter_prioritized(jobs, window=DEFAULT_PRIORITY_WINDOW):
+    """在固定大小的視窗內依 priority 排序（大者優先，同優先順序維持原順序）
+
+    只保留 window 個工作在記憶體中，因此排序是局部的：
+    優先順序較高的工作最多會提前 window 個位置。
+    """
+    heap = []
+    counter = 0
+    for job in jobs:
+        heapq.heappush(heap, (-job.priority, counter, job))
+        counter += 1
+        if len(heap) >= window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
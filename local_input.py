@@ -0,0 +1,240 @@
+"""本機檔案與資料夾輸入
+
+    python transposer.py ~/Music/recordings -2 --tempo -10 --output-dir ~/practice
+
+以與網址來源相同的處理引擎與輸出檔名規則處理本機音訊檔，不經過下載階段：
+
+- 資料夾以遞迴方式逐層走訪（不先列出整棵目錄樹），子資料夾結構保留在輸出目錄中
+- 多個檔案以執行緒池平行處理，同時送出的工作數有上限，走訪與處理同步進行
+- 增量處理：輸出目錄中的狀態索引記錄每個來源檔的大小、修改時間與處理參數，
+  再次執行時跳過未變更且輸出仍存在的檔案；verify='hash' 時修改時間不同但大小相同的檔案
+  會再比對內容雜湊（例如檔案被複製或 touch 過）
+
+可用環境變數 YT_TRANSPOSE_LOCAL_WORKERS 設定平行處理數（預設為 CPU 核心數）。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from transposer_core import transpose_file, get_default_output_dir, ENGINE_VERSION
+
+# 視為音訊來源的副檔名（含只取音軌的影片容器）
+AUDIO_EXTENSIONS = {
+    '.mp3', '.m4a', '.aac', '.wav', '.flac', '.ogg', '.oga', '.opus', '.wma',
+    '.aif', '.aiff', '.alac', '.ape', '.wv', '.mka', '.webm', '.mp4', '.mkv', '.mov',
+}
+
+STATE_FILENAME = '.yt_transpose_state.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inputs (
+    source TEXT NOT NULL,
+    params TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT,
+    output TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (source, params)
+);
+"""
+
+HASH_CHUNK = 1024 * 1024
+
+
+def is_local_input(value):
+    """命令列參數是否為本機檔案或資料夾（而非網址）"""
+    return bool(value) and '://' not in value and os.path.exists(value)
+
+
+def is_audio_file(path):
+    return os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS
+
+
+def iter_input_files(paths, exclude=None):
+    """逐一產生 (檔案路徑, 相對子目錄)；資料夾逐層以 os.scandir 走訪，略過隱藏檔與 exclude 目錄"""
+    excluded = {os.path.realpath(p) for p in (exclude or []) if p}
+    for path in paths:
+        if os.path.isfile(path):
+            yield path, ''
+            continue
+        if not os.path.isdir(path):
+            raise Exception(f"Input not found: {path}")
+        stack = [(path, '')]
+        while stack:
+            directory, relative = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as e:
+                print(f"Warning: cannot read {directory}: {e}")
+                continue
+            subdirs = []
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    # 輸出目錄位於輸入資料夾內時不處理上次的輸出
+                    if os.path.realpath(entry.path) not in excluded:
+                        subdirs.append((entry.path, os.path.join(relative, entry.name)))
+                elif entry.is_file() and is_audio_file(entry.name):
+                    yield entry.path, relative
+            # 反向放入堆疊，依名稱順序走訪子資料夾
+            stack.extend(reversed(subdirs))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_params_key(semitones=0, tempo=None, rate=None, bpm=None, loudness=None, output_format='mp3', loop=1,
+                    backend=None, preset=None, channels=None, samplerate=None):
+    """影響輸出結果的參數（與結果快取相同的正規化方式）"""
+    from render_cache import normalize_render_params
+    params = normalize_render_params(semitones, tempo, rate, bpm, loudness, output_format)
+    params.update({'loop': int(loop or 1), 'backend': backend or '', 'preset': preset or '',
+                   'channels': channels, 'samplerate': samplerate, 'engine': ENGINE_VERSION})
+    return json.dumps(params, sort_keys=True)
+
+
+class InputState:
+    """增量處理的狀態索引（SQLite，放在輸出目錄中）"""
+
+    def __init__(self, path, verify='mtime'):
+        if verify not in ('mtime', 'hash'):
+            raise Exception(f"Unknown verify mode: {verify} (use mtime or hash)")
+        self.path = path
+        self.verify = verify
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _get(self, source, params):
+        with self._lock:
+            conn = self._connect()
+            try:
+                return conn.execute("SELECT * FROM inputs WHERE source = ? AND params = ?", (source, params)).fetchone()
+            finally:
+                conn.close()
+
+    def is_output(self, path):
+        """path 是否為先前處理產生的輸出檔（輸出目錄與輸入資料夾相同時避免重複處理）"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                return conn.execute("SELECT 1 FROM inputs WHERE output = ? LIMIT 1", (path,)).fetchone() is not None
+            finally:
+                conn.close()
+
+    def is_unchanged(self, source, params):
+        """來源未變更且上次的輸出仍存在時回傳輸出檔路徑，否則回傳 None"""
+        row = self._get(source, params)
+        if row is None or not os.path.exists(row['output']):
+            return None
+        st = os.stat(source)
+        if st.st_size != row['size']:
+            return None
+        if st.st_mtime_ns == row['mtime_ns']:
+            return row['output']
+        if self.verify != 'hash' or not row['sha256'] or file_sha256(source) != row['sha256']:
+            return None
+        # 內容相同只是修改時間不同：更新記錄，下次不必再計算雜湊
+        self.record(source, params, row['output'], row['sha256'])
+        return row['output']
+
+    def record(self, source, params, output, sha256=None):
+        st = os.stat(source)
+        if sha256 is None and self.verify == 'hash':
+            sha256 = file_sha256(source)
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO inputs (source, params, size, mtime_ns, sha256, output, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (source, params, st.st_size, st.st_mtime_ns, sha256, output, time.time()),
+                    )
+            finally:
+                conn.close()
+
+
+def get_default_workers():
+    try:
+        return max(1, int(os.environ.get('YT_TRANSPOSE_LOCAL_WORKERS', os.cpu_count() or 2)))
+    except ValueError:
+        return os.cpu_count() or 2
+
+
+def process_local_inputs(paths, semitones, output_dir=None, workers=None, incremental=True, verify='mtime',
+                         progress_callback=None, **kwargs):
+    """處理本機檔案與資料夾，回傳 (已處理, 已跳過, 失敗) 的檔案數
+
+    kwargs 為 transpose_file 的處理參數（tempo、rate、bpm、loudness、output_format、
+    loop、backend、preset、channels、samplerate）。
+    progress_callback(done, message) 在每個檔案完成時呼叫。
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if output_dir is None:
+        output_dir = get_default_output_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or get_default_workers()
+    state = InputState(os.path.join(output_dir, STATE_FILENAME), verify) if incremental else None
+    params = make_params_key(semitones, **kwargs)
+
+    counts = {'processed': 0, 'skipped': 0, 'failed': 0}
+
+    def run_one(source, relative):
+        source = os.path.abspath(source)
+        if state is not None:
+            if state.is_output(source):
+                return 'skipped', source, source
+            previous = state.is_unchanged(source, params)
+            if previous:
+                return 'skipped', source, previous
+        result = transpose_file(source, semitones, output_dir=os.path.join(output_dir, relative), **kwargs)
+        if state is not None:
+            state.record(source, params, os.path.abspath(result))
+        return 'processed', source, result
+
+    def collect(futures):
+        for future in futures:
+            try:
+                status, source, result = future.result()
+            except Exception as e:
+                counts['failed'] += 1
+                print(f"Error ({futures[future]}): {e}")
+                continue
+            counts[status] += 1
+            if status == 'skipped' and result != source:
+                print(f"Skipped (unchanged): {source}")
+            if progress_callback:
+                progress_callback(sum(counts.values()), f"{status}: {result}")
+
+    # 走訪是延遲的：同時送出的工作最多 workers * 2 個，處理完才繼續走訪
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='yt_transpose_local') as executor:
+        for source, relative in iter_input_files(paths, exclude=[output_dir]):
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect({f: pending.pop(f) for f in done})
+            pending[executor.submit(run_one, source, relative)] = source
+        collect(dict(pending))
+
+    print(f"\nLocal input: {counts['processed']} processed, {counts['skipped']} skipped (unchanged), "
+          f"{counts['failed']} failed")
+    return counts['processed'], counts['skipped'], counts['failed']
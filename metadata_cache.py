@@ -0,0 +1,230 @@
+"""影片資訊快取與預先解析
+
+每個工作開始下載前都要先以 yt-dlp 解析影片資訊（標題、長度、可用格式、章節），
+需要一次以上的網路往返。解析結果以影片 ID 為鍵存在 SQLite 中，在有效期限內
+直接使用，不再連線；批次處理時以 prefetch_metadata() 在背景同時解析後面幾個工作的資訊，
+輪到該工作時標題、長度（暫存空間估算）與格式清單都已就緒。
+
+快取的格式清單中包含有期限的串流網址，因此有效期限預設為 1 小時；
+以快取資訊下載失敗時會重新解析一次再試。
+
+可用環境變數設定：
+    YT_TRANSPOSE_METADATA_CACHE=0      停用快取
+    YT_TRANSPOSE_METADATA_TTL=3600     有效期限（秒）
+    YT_TRANSPOSE_METADATA_PREFETCH=4   批次預先解析的執行緒數（0 停用）
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_TTL = 3600
+DEFAULT_PREFETCH_WORKERS = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    title TEXT,
+    duration REAL,
+    info BLOB NOT NULL,
+    fetched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_fetched ON videos (fetched);
+"""
+
+
+def is_metadata_cache_enabled():
+    return os.environ.get('YT_TRANSPOSE_METADATA_CACHE', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def _env_number(name, default):
+    try:
+        return max(0, float(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def _to_json(value):
+    """只保留可序列化的部分（yt-dlp 的資訊中可能有函數等內部物件）"""
+    if isinstance(value, dict):
+        return {k: _to_json(v) for k, v in value.items()
+                if isinstance(k, str) and not k.startswith('__') and _is_serializable(v)}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value if _is_serializable(v)]
+    return value
+
+
+def _is_serializable(value):
+    return value is None or isinstance(value, (str, int, float, bool, dict, list, tuple))
+
+
+def fetch_video_info(url, session):
+    """以 yt-dlp 解析影片資訊（process=False：只解析一次，下載時直接以這份資訊處理）"""
+    with session() as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        # 短網址等轉址結果需要再解析一次才有標題
+        for _ in range(3):
+            if info.get('_type') not in ('url', 'url_transparent'):
+                break
+            info = ydl.extract_info(info['url'], download=False, process=False)
+    return info
+
+
+class MetadataCache:
+    """以影片 ID 為鍵、有有效期限的影片資訊快取"""
+
+    def __init__(self, path=None, ttl=None):
+        if path is None:
+            from transposer_core import get_cache_dir
+            path = os.path.join(get_cache_dir('metadata'), 'metadata.db')
+        self.path = path
+        self.ttl = _env_number('YT_TRANSPOSE_METADATA_TTL', DEFAULT_TTL) if ttl is None else ttl
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def lookup(self, video_id):
+        """回傳有效期限內的影片資訊，沒有或已過期時回傳 None"""
+        if not video_id:
+            return None
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT info, fetched FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+            finally:
+                conn.close()
+        if row is None or time.time() - row['fetched'] > self.ttl:
+            return None
+        try:
+            return json.loads(zlib.decompress(row['info']))
+        except (zlib.error, ValueError):
+            return None
+
+    def store(self, info, video_id=None):
+        video_id = video_id or info.get('id')
+        if not video_id:
+            return
+        payload = zlib.compress(json.dumps(_to_json(info), separators=(',', ':')).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO videos (video_id, title, duration, info, fetched) VALUES (?, ?, ?, ?, ?)",
+                        (video_id, info.get('title'), info.get('duration'), payload, now),
+                    )
+                    # 順便清除已過期的項目
+                    conn.execute("DELETE FROM videos WHERE fetched < ?", (now - self.ttl,))
+            finally:
+                conn.close()
+
+    def invalidate(self, video_id):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+            finally:
+                conn.close()
+
+    def get_info(self, url, session=None, refresh=False):
+        """取得影片資訊，回傳 (info, 是否來自快取)；session 預設為共用的 YoutubeDL 連線池"""
+        from transposer_core import extract_video_id
+        import metrics
+        video_id = extract_video_id(url)
+        if not refresh:
+            info = self.lookup(video_id)
+            metrics.metadata_lookups().inc(result='hit' if info else 'miss')
+            if info is not None:
+                return info, True
+        if session is None:
+            from ytdl_pool import get_ytdl_pool
+            session = get_ytdl_pool().session
+        info = fetch_video_info(url, session)
+        try:
+            self.store(info, info.get('id') or video_id)
+        except Exception as e:
+            # 快取失敗不影響本次工作
+            print(f"Warning: failed to store metadata cache: {e}")
+        return info, False
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """取得行程內共用的影片資訊快取"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = MetadataCache()
+        return _default_cache
+
+
+def get_video_info(url, refresh=False):
+    """取得影片資訊，回傳 (info, 是否來自快取)；停用快取時一律重新解析"""
+    if is_metadata_cache_enabled():
+        return get_metadata_cache().get_info(url, refresh=refresh)
+    from ytdl_pool import get_ytdl_pool
+    return fetch_video_info(url, get_ytdl_pool().session), False
+
+
+def prefetch_metadata(jobs, key=lambda job: job.url, workers=None, lookahead=None):
+    """依序產生 jobs，同時在背景預先解析後面 lookahead 個工作的影片資訊
+
+    預先解析使用獨立的 YoutubeDL 連線池，不會與正在下載的工作搶用連線；
+    解析失敗只印出警告，該工作輪到時會照常自行解析並回報錯誤。
+    """
+    if workers is None:
+        workers = int(_env_number('YT_TRANSPOSE_METADATA_PREFETCH', DEFAULT_PREFETCH_WORKERS))
+    if workers <= 0 or not is_metadata_cache_enabled():
+        yield from jobs
+        return
+    try:
+        import yt_dlp  # noqa: F401
+    except ImportError:
+        # 命令列模式無法共用解析結果
+        yield from jobs
+        return
+    from ytdl_pool import YoutubeDLPool
+    lookahead = lookahead or workers * 2
+    cache = get_metadata_cache()
+    pool = YoutubeDLPool(size=workers)
+
+    def prefetch(url):
+        try:
+            cache.get_info(url, session=pool.session)
+        except Exception as e:
+            print(f"Warning: metadata prefetch failed for {url}: {e}")
+
+    window = []
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='yt_transpose_prefetch')
+    try:
+        for job in jobs:
+            window.append((job, executor.submit(prefetch, key(job))))
+            if len(window) > lookahead:
+                yield _next_ready(window)
+        while window:
+            yield _next_ready(window)
+    finally:
+        for _, future in window:
+            future.cancel()
+        executor.shutdown(wait=False)
+        pool.close()
+
+
+def _next_ready(window):
+    # 等待最前面的工作解析完成（通常早已完成），維持原本的工作順序
+    job, future = window.pop(0)
+    future.exception()
+    return job
@@ -0,0 +1,336 @@
+"""行程內的統計指標
+
+download_and_transpose 的每個階段都會回報到共用的指標登錄（計數器、量測值與延遲直方圖），
+可用 Prometheus 文字格式讀取：
+
+    YT_TRANSPOSE_METRICS_PORT=9464        在 127.0.0.1:9464/metrics 提供 HTTP 端點
+    YT_TRANSPOSE_METRICS_FILE=metrics.prom 定期寫出到檔案（可供 node_exporter textfile collector 讀取）
+    YT_TRANSPOSE_METRICS_INTERVAL=15      寫出檔案的間隔（秒）
+
+都未設定時只在記憶體中累計，不會啟動任何執行緒。
+"""
+import atexit
+import functools
+import math
+import os
+import threading
+import time
+
+# 延遲直方圖的預設上界（秒）：涵蓋毫秒級的快取命中到數分鐘的長曲處理
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+DEFAULT_DUMP_INTERVAL = 15.0
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """可增可減的量測值（例如進行中的工作數、佇列長度）"""
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """延遲直方圖（累積 bucket，百分位數可由 histogram_quantile 計算）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['counts']):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """指標登錄：同名指標只建立一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.type_name}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Prometheus 文字格式（0.0.4）"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """依序記錄各處理階段的耗時：start() 會結束前一個階段"""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._stage = None
+        self._started = None
+
+    def start(self, stage):
+        self.finish()
+        self._stage = stage
+        self._started = time.perf_counter()
+
+    def finish(self):
+        if self._stage is not None:
+            self.histogram.observe(time.perf_counter() - self._started, stage=self._stage)
+            self._stage = None
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """取得行程內共用的指標登錄（第一次取得時依環境變數啟動匯出）"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+            _start_exporters(_registry)
+        return _registry
+
+
+# download_and_transpose 使用的指標
+def jobs_total():
+    return get_registry().counter("yt_transpose_jobs_total", "Finished jobs by status", ("status",))
+
+
+def jobs_in_progress():
+    return get_registry().gauge("yt_transpose_jobs_in_progress", "Jobs currently running")
+
+
+def job_duration():
+    return get_registry().histogram("yt_transpose_job_duration_seconds", "End-to-end job latency")
+
+
+def stage_duration():
+    return get_registry().histogram("yt_transpose_stage_duration_seconds", "Latency of each job stage", ("stage",))
+
+
+def download_bytes():
+    return get_registry().counter("yt_transpose_download_bytes_total", "Bytes downloaded", ("kind",))
+
+
+def download_retries():
+    return get_registry().counter("yt_transpose_download_retries_total", "Download retries after transient errors")
+
+
+def cache_lookups():
+    return get_registry().counter("yt_transpose_render_cache_lookups_total", "Render cache lookups by result", ("result",))
+
+
+def metadata_lookups():
+    return get_registry().counter("yt_transpose_metadata_cache_lookups_total", "Video metadata cache lookups by result", ("result",))
+
+
+def queue_depth():
+    return get_registry().gauge("yt_transpose_queue_depth", "Jobs waiting in a queue", ("queue",))
+
+
+def scheduler_usage():
+    return get_registry().gauge("yt_transpose_scheduler_usage", "Resources held by admitted job stages", ("resource",))
+
+
+def track_job(func):
+    """裝飾器：記錄工作數、成功/失敗與整體延遲"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        in_progress = jobs_in_progress()
+        in_progress.inc()
+        started = time.perf_counter()
+        status = "failure"
+        try:
+            result = func(*args, **kwargs)
+            status = "success"
+            return result
+        finally:
+            in_progress.dec()
+            job_duration().observe(time.perf_counter() - started)
+            jobs_total().inc(status=status)
+    return wrapper
+
+
+def start_http_server(registry, port, host="127.0.0.1"):
+    """在背景執行緒提供 /metrics（只綁定本機）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 不在主控台輸出每次抓取的紀錄
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    print(f"Metrics available at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def dump_to_file(registry, path):
+    """原子地寫出指標檔（先寫暫存檔再 os.replace，讀取端不會看到寫到一半的內容）"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+def start_file_dump(registry, path, interval=DEFAULT_DUMP_INTERVAL):
+    """在背景執行緒定期寫出指標檔，行程結束時再寫一次"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                dump_to_file(registry, path)
+            except OSError as e:
+                print(f"Warning: failed to write metrics file: {e}")
+
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+    atexit.register(lambda: dump_to_file(registry, path))
+
+
+def _start_exporters(registry):
+    port = os.environ.get('YT_TRANSPOSE_METRICS_PORT')
+    if port:
+        try:
+            start_http_server(registry, int(port))
+        except (OSError, ValueError) as e:
+            print(f"Warning: failed to start metrics endpoint on port {port}: {e}")
+    path = os.environ.get('YT_TRANSPOSE_METRICS_FILE')
+    if path:
+        try:
+            interval = float(os.environ.get('YT_TRANSPOSE_METRICS_INTERVAL', DEFAULT_DUMP_INTERVAL))
+        except ValueError:
+            interval = DEFAULT_DUMP_INTERVAL
+        start_file_dump(registry, path, max(1.0, interval))
@@ -0,0 +1,293 @@
+"""解碼後 PCM 快取（第二層來源快取）
+
+來源快取（source_cache.py）保存壓縮音訊，空間小，但每次處理都要以 ffmpeg 重新解碼，
+長音檔的解碼本身就要花不少 CPU。這一層保存解碼後的 PCM，讓同一個來源被反覆處理
+（例如練習時嘗試不同的移調與速度）時不必再解碼：
+
+    soundstretch 引擎  16-bit PCM（處理用的聲道/取樣率），取代原本的解碼步驟
+    ffmpeg 引擎        32-bit float PCM（來源原始格式），與從壓縮檔解碼的結果相同
+
+檔案為一般的 WAV（長音檔為 RF64），標頭很小，soundstretch 可直接讀取，
+程式內的處理以 pcm_io 對 data chunk 做記憶體映射（不複製資料）。
+存入時同時測量整合響度與真實峰值並記在索引中，之後的響度正規化不需再測量。
+
+PCM 比壓縮檔大十倍以上，因此只保存常被重新處理的來源：每次處理都記錄該來源的處理次數，
+達到 YT_TRANSPOSE_PCM_PROMOTE_AFTER 次時才解碼存入。容量上限與淘汰（LRU）
+和壓縮檔那一層分開計算。
+
+可用環境變數設定：
+    YT_TRANSPOSE_PCM_CACHE=1             啟用（預設停用）
+    YT_TRANSPOSE_PCM_CACHE_MB=8192       容量上限（MB）
+    YT_TRANSPOSE_PCM_PROMOTE_AFTER=2     同一來源第幾次處理時存入
+"""
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_MB = 8192
+DEFAULT_PROMOTE_AFTER = 2
+# 單一項目最多佔容量上限的比例，避免一個超長音檔把其他項目全部擠掉
+MAX_ENTRY_RATIO = 0.5
+# 處理次數的記錄保留天數
+RENDER_HISTORY_DAYS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pcm (
+    source_id TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    lufs REAL,
+    true_peak REAL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source_id, variant)
+);
+CREATE INDEX IF NOT EXISTS pcm_lru ON pcm (last_used);
+CREATE TABLE IF NOT EXISTS renders (
+    source_id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    last_render REAL NOT NULL
+);
+"""
+
+
+def is_pcm_cache_enabled():
+    return os.environ.get('YT_TRANSPOSE_PCM_CACHE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_promote_after():
+    try:
+        return max(1, int(os.environ.get('YT_TRANSPOSE_PCM_PROMOTE_AFTER', DEFAULT_PROMOTE_AFTER)))
+    except ValueError:
+        return DEFAULT_PROMOTE_AFTER
+
+
+def get_local_source_id(path):
+    """本機檔案的來源 ID（檔案內容改變時 ID 也會改變）"""
+    st = os.stat(path)
+    return f"file:{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+class PcmVariant:
+    """PCM 的格式：取樣格式與聲道/取樣率（None 表示沿用來源）"""
+
+    def __init__(self, sample_format, channels=None, samplerate=None):
+        self.sample_format = sample_format
+        self.channels = channels
+        self.samplerate = samplerate
+
+    @property
+    def key(self):
+        return f"{self.sample_format}-{self.channels or 'src'}ch-{self.samplerate or 'src'}hz"
+
+    @property
+    def codec(self):
+        return 'pcm_f32le' if self.sample_format == 'f32' else 'pcm_s16le'
+
+    def estimate_bytes(self, duration):
+        bytes_per_sample = 4 if self.sample_format == 'f32' else 2
+        return int(duration * (self.samplerate or 48000) * (self.channels or 2) * bytes_per_sample)
+
+
+def get_variant(backend_name, request):
+    """處理引擎使用的 PCM 格式"""
+    if backend_name == 'soundstretch':
+        # soundstretch 讀取的就是這個格式的 WAV
+        return PcmVariant('s16', request.channels, request.samplerate)
+    # ffmpeg 引擎內部以 float 處理，聲道/取樣率在濾鏡鏈中轉換
+    return PcmVariant('f32')
+
+
+class DecodedSource:
+    """快取中的 PCM 與存入時測量的響度"""
+
+    def __init__(self, path, lufs=None, true_peak=None):
+        self.path = path
+        self.lufs = lufs
+        self.true_peak = true_peak
+
+    def wav_info(self):
+        import pcm_io
+        return pcm_io.read_wav_header(self.path)
+
+    def map(self, start_frame=0, frame_count=None):
+        """以記憶體映射取得 (frames, channels) 的唯讀 PCM（不複製資料）"""
+        import pcm_io
+        info = self.wav_info()
+        if frame_count is None:
+            frame_count = info.frames - start_frame
+        return pcm_io.map_wav_block(info, start_frame, frame_count)
+
+
+class PcmCache:
+    """以 SQLite 為索引的 PCM 快取"""
+
+    def __init__(self, root=None, max_bytes=None):
+        if root is None:
+            from transposer_core import get_cache_dir
+            root = get_cache_dir('pcm')
+        if max_bytes is None:
+            try:
+                max_bytes = int(float(os.environ.get('YT_TRANSPOSE_PCM_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+            except ValueError:
+                max_bytes = DEFAULT_MAX_MB * 1024 * 1024
+        self.root = root
+        self.store_dir = os.path.join(root, 'store')
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, 'index.db')
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get_path(self, source_id, variant):
+        from render_cache import make_cache_key
+        key = make_cache_key(source_id, {'variant': variant.key}, 'pcm')
+        return os.path.join(self.store_dir, key[:2], key + '.wav')
+
+    def record_render(self, source_id):
+        """記錄來源被處理一次，回傳累計的處理次數"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT INTO renders (source_id, count, last_render) VALUES (?, 1, ?) "
+                        "ON CONFLICT(source_id) DO UPDATE SET count = count + 1, last_render = excluded.last_render",
+                        (source_id, now),
+                    )
+                    row = conn.execute("SELECT count FROM renders WHERE source_id = ?", (source_id,)).fetchone()
+                return row['count']
+            finally:
+                conn.close()
+
+    def lookup(self, source_id, variant):
+        """查詢快取，命中時回傳 DecodedSource，否則回傳 None"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT path, size, lufs, true_peak FROM pcm WHERE source_id = ? AND variant = ?",
+                                   (source_id, variant.key)).fetchone()
+                if row is None:
+                    return None
+                try:
+                    valid = os.path.getsize(row['path']) == row['size']
+                except OSError:
+                    valid = False
+                with conn:
+                    if not valid:
+                        conn.execute("DELETE FROM pcm WHERE source_id = ? AND variant = ?", (source_id, variant.key))
+                        return None
+                    conn.execute("UPDATE pcm SET last_used = ?, hits = hits + 1 WHERE source_id = ? AND variant = ?",
+                                 (time.time(), source_id, variant.key))
+                return DecodedSource(row['path'], row['lufs'], row['true_peak'])
+            finally:
+                conn.close()
+
+    def store(self, source_id, variant, path, lufs=None, true_peak=None):
+        """登記已寫在 get_path() 位置的 PCM，回傳 DecodedSource"""
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO pcm (source_id, variant, path, size, lufs, true_peak, created, last_used, hits) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                        (source_id, variant.key, path, size, lufs, true_peak, now, now),
+                    )
+                    conn.execute("DELETE FROM renders WHERE last_render < ?", (now - RENDER_HISTORY_DAYS * 86400,))
+                self._evict(conn, keep=(source_id, variant.key))
+            finally:
+                conn.close()
+        return DecodedSource(path, lufs, true_peak)
+
+    def _evict(self, conn, keep=None):
+        """超過容量上限時，依最久未使用的順序淘汰（剛存入的項目除外）"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pcm").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT source_id, variant, path, size FROM pcm ORDER BY last_used").fetchall()
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            if (row['source_id'], row['variant']) == keep:
+                continue
+            try:
+                os.remove(row['path'])
+            except OSError:
+                pass
+            with conn:
+                conn.execute("DELETE FROM pcm WHERE source_id = ? AND variant = ?", (row['source_id'], row['variant']))
+            total -= row['size']
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_pcm_cache():
+    """取得行程內共用的 PCM 快取"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = PcmCache()
+        return _default_cache
+
+
+def iter_decoded_source(source_id, source_path, backend_name, request):
+    """命令計畫：取得處理用的 PCM，回傳 DecodedSource 或 None（照常從壓縮檔解碼）
+
+    快取命中時直接回傳；未命中但這個來源的處理次數已達門檻時，解碼存入快取後回傳。
+    """
+    if source_id is None or not is_pcm_cache_enabled():
+        return None
+    from transposer_core import get_ffmpeg, get_format_args, parse_integrated_loudness
+    from backends import RenderStep, parse_true_peak
+    cache = get_pcm_cache()
+    variant = get_variant(backend_name, request)
+    renders = cache.record_render(source_id)
+    decoded = cache.lookup(source_id, variant)
+    if decoded is not None:
+        print(f"Using cached PCM ({variant.key})")
+        return decoded
+    if renders < get_promote_after():
+        return None
+    if request.duration and variant.estimate_bytes(request.duration) > cache.max_bytes * MAX_ENTRY_RATIO:
+        return None
+
+    # 解碼存入：先寫到同目錄的暫存檔，完成後才改名，其他工作不會讀到寫到一半的檔案
+    path = cache.get_path(source_id, variant)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.wav"
+    # 同時測量響度（float 版本供 ffmpeg 引擎使用，需要真實峰值）
+    measure = "ebur128=framelog=quiet:peak=true" if variant.sample_format == 'f32' else "ebur128=framelog=quiet"
+    decode_cmd = [get_ffmpeg(), "-i", source_path, "-vn", "-acodec", variant.codec,
+                  *get_format_args(variant.channels, variant.samplerate),
+                  "-af", measure, "-rf64", "auto", "-y", tmp_path]
+    try:
+        result = yield RenderStep(decode_cmd, 72, f"Decoding to PCM cache (render #{renders})...",
+                                  duration=request.duration, progress_end=78)
+        if result.returncode != 0:
+            print(f"Warning: failed to decode PCM cache: {result.stderr[-500:]}")
+            return None
+        os.replace(tmp_path, path)
+    finally:
+        for leftover in glob.glob(glob.escape(tmp_path)):
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+    return cache.store(source_id, variant, path, parse_integrated_loudness(result.stderr),
+                       parse_true_peak(result.stderr))
@@ -0,0 +1,147 @@
+"""WAV PCM 的記憶體映射讀取工具
+
+所有處理都以固定大小的區塊進行：每個區塊各自建立並釋放一個 numpy.memmap 映射，
+因此常駐記憶體只取決於區塊大小，與音檔長度無關（多小時的直播錄音也適用）。
+"""
+import os
+import struct
+
+import numpy as np
+
+# 預設區塊大小（frame 數）：48kHz 立體聲 16-bit 約 256KB
+DEFAULT_BLOCK_FRAMES = 65536
+
+# WAVE_FORMAT_EXTENSIBLE 的子格式 GUID 前兩個位元組即為實際格式代碼
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavInfo:
+    """WAV 檔案的格式資訊與 data chunk 位置"""
+
+    def __init__(self, path, format_tag, channels, samplerate, bits, data_offset, data_size):
+        self.path = path
+        self.format_tag = format_tag
+        self.channels = channels
+        self.samplerate = samplerate
+        self.bits = bits
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+    @property
+    def frame_size(self):
+        return self.channels * (self.bits // 8)
+
+    @property
+    def frames(self):
+        return self.data_size // self.frame_size
+
+    @property
+    def duration(self):
+        return self.frames / float(self.samplerate) if self.samplerate else 0.0
+
+    @property
+    def dtype(self):
+        if self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            if self.bits == 32:
+                return np.dtype('<f4')
+            if self.bits == 64:
+                return np.dtype('<f8')
+        elif self.format_tag == WAVE_FORMAT_PCM:
+            if self.bits == 16:
+                return np.dtype('<i2')
+            if self.bits == 32:
+                return np.dtype('<i4')
+            if self.bits == 8:
+                return np.dtype('u1')
+        raise Exception(f"不支援的 WAV 格式：format={self.format_tag}, bits={self.bits}")
+
+
+def read_wav_header(path):
+    """解析 WAV（RIFF/RF64）標頭，回傳 WavInfo，不讀取音訊資料"""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[8:12] != b'WAVE' or riff[0:4] not in (b'RIFF', b'RF64'):
+            raise Exception(f"不是有效的 WAV 檔案：{path}")
+        is_rf64 = riff[0:4] == b'RF64'
+        rf64_data_size = None
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            chunk_start = f.tell()
+            if chunk_id == b'ds64' and is_rf64:
+                ds64 = f.read(chunk_size)
+                # ds64：riffSize(8) + dataSize(8) + sampleCount(8)
+                rf64_data_size = struct.unpack('<Q', ds64[8:16])[0]
+            elif chunk_id == b'fmt ':
+                raw = f.read(chunk_size)
+                format_tag, channels, samplerate, _, _, bits = struct.unpack('<HHIIHH', raw[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(raw) >= 26:
+                    format_tag = struct.unpack('<H', raw[24:26])[0]
+                fmt = (format_tag, channels, samplerate, bits)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise Exception(f"WAV 檔案缺少 fmt chunk：{path}")
+                data_size = chunk_size
+                if is_rf64 and chunk_size == 0xFFFFFFFF and rf64_data_size is not None:
+                    data_size = rf64_data_size
+                # 未完成或串流寫出的檔案，大小欄位可能不正確，以實際檔案大小為準
+                data_size = min(data_size, file_size - chunk_start)
+                return WavInfo(path, fmt[0], fmt[1], fmt[2], fmt[3], chunk_start, data_size)
+            # chunk 以偶數位元組對齊
+            f.seek(chunk_start + chunk_size + (chunk_size & 1))
+    raise Exception(f"WAV 檔案缺少 data chunk：{path}")
+
+
+def map_wav_block(info, start_frame, frame_count):
+    """將指定範圍的 frame 映射為 (frames, channels) 的唯讀 memmap"""
+    frame_count = max(0, min(frame_count, info.frames - start_frame))
+    if frame_count == 0:
+        return np.zeros((0, info.channels), dtype=info.dtype)
+    return np.memmap(
+        info.path,
+        dtype=info.dtype,
+        mode='r',
+        offset=info.data_offset + start_frame * info.frame_size,
+        shape=(frame_count, info.channels),
+    )
+
+
+def iter_wav_blocks(path, block_frames=DEFAULT_BLOCK_FRAMES, info=None):
+    """逐區塊產生 (start_frame, block)，每個區塊使用獨立的映射，用完即釋放"""
+    if info is None:
+        info = read_wav_header(path)
+    start = 0
+    while start < info.frames:
+        block = map_wav_block(info, start, block_frames)
+        yield start, block
+        start += len(block)
+        # 釋放映射，讓已讀取的頁面不再計入常駐記憶體
+        # （呼叫端取得下一個區塊後，上一個區塊的映射即不再被參考）
+        del block
+
+
+def to_float(block, dtype):
+    """將 PCM 區塊轉為 [-1, 1] 範圍的 float32"""
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return np.asarray(block, dtype=np.float32)
+    if dtype == np.dtype('u1'):
+        return (np.asarray(block, dtype=np.float32) - 128.0) / 128.0
+    scale = float(2 ** (dtype.itemsize * 8 - 1))
+    return np.asarray(block, dtype=np.float32) / scale
+
+
+def measure_peak(path, block_frames=DEFAULT_BLOCK_FRAMES):
+    """逐區塊計算取樣峰值（0.0 ~ 1.0）"""
+    info = read_wav_header(path)
+    peak = 0.0
+    for _, block in iter_wav_blocks(path, block_frames, info):
+        if len(block):
+            peak = max(peak, float(np.max(np.abs(to_float(block, info.dtype)))))
+    return peak
@@ -0,0 +1,187 @@
+"""波形峰值（GUI 波形總覽用）
+
+以 ffmpeg 將音訊解碼為單聲道 16-bit PCM 串流，逐區塊以 numpy 向量化計算每個 bucket 的
+最小/最大值，並由最細的一層逐層合併出多個縮放層級。結果寫成精簡的二進位峰值檔
+（每個 bucket 兩個 int8），放在來源檔旁邊（<來源檔>.peaks）；之後顯示同一首歌的波形
+只需讀取這個檔案，3 小時的音檔也只要數毫秒。
+
+峰值檔格式（little-endian）：
+    header  4s magic "YTPK", H version, I samplerate, H level 數, d 長度（秒）
+    每層    I 每個 bucket 的取樣數, I bucket 數
+    資料    依層級順序，每層為 bucket 數 x 2 的 int8（min, max）
+"""
+import collections
+import os
+import struct
+import subprocess
+import threading
+
+import numpy as np
+
+from transposer_core import get_ffmpeg, get_subprocess_kwargs
+
+MAGIC = b'YTPK'
+VERSION = 1
+HEADER = struct.Struct('<4sHIHd')
+LEVEL_HEADER = struct.Struct('<II')
+
+# 解碼取樣率：波形顯示不需要完整頻寬
+PEAKS_SAMPLERATE = 22050
+# 最細層級每個 bucket 的取樣數（22050 Hz 時約每秒 86 個 bucket），之後每層放大 4 倍
+BASE_BUCKET = 256
+ZOOM_FACTOR = 4
+LEVELS = 6
+# 每次從 ffmpeg 讀取的 bucket 數（常駐記憶體與音檔長度無關）
+READ_BUCKETS = 4096
+
+
+class Peaks:
+    """多層級的最小/最大峰值"""
+
+    def __init__(self, samplerate, duration, levels):
+        self.samplerate = samplerate
+        self.duration = duration
+        # [(每個 bucket 的取樣數, ndarray 形狀 (n, 2) 的 int8)]，由細到粗
+        self.levels = levels
+
+    def level_for_width(self, width):
+        """bucket 數不少於 width 的最粗層級（顯示時需要合併的資料最少）"""
+        for samples_per_bucket, data in reversed(self.levels):
+            if len(data) >= width:
+                return samples_per_bucket, data
+        return self.levels[0]
+
+    def overview(self, width, start=None, end=None):
+        """回傳 width 欄的 (min, max) 浮點數陣列（-1.0～1.0），可只取 start～end 秒"""
+        samples_per_bucket, data = self.level_for_width(width)
+        if start is not None or end is not None:
+            # 放大顯示一段時改用最細層級
+            samples_per_bucket, data = self.levels[0]
+            first = int((start or 0) * self.samplerate / samples_per_bucket)
+            last = int(end * self.samplerate / samples_per_bucket) + 1 if end is not None else len(data)
+            data = data[first:last]
+        if len(data) == 0:
+            return np.zeros((width, 2), dtype=np.float32)
+        # 每欄以 reduceat 合併相鄰的 bucket
+        edges = np.linspace(0, len(data), width + 1).astype(np.int64)[:-1]
+        edges = np.minimum(edges, len(data) - 1)
+        mins = np.minimum.reduceat(data[:, 0], edges)
+        maxs = np.maximum.reduceat(data[:, 1], edges)
+        return np.stack([mins, maxs], axis=1).astype(np.float32) / 127.0
+
+
+def _reduce(data, factor):
+    """把 factor 個相鄰 bucket 合併成一個（最後不足的部分也保留）"""
+    n = len(data)
+    full = n // factor * factor
+    mins = data[:full, 0].reshape(-1, factor).min(axis=1)
+    maxs = data[:full, 1].reshape(-1, factor).max(axis=1)
+    if full < n:
+        mins = np.append(mins, data[full:, 0].min())
+        maxs = np.append(maxs, data[full:, 1].max())
+    return np.stack([mins, maxs], axis=1)
+
+
+def compute_peaks(path, samplerate=PEAKS_SAMPLERATE):
+    """解碼音訊並計算所有層級的峰值"""
+    ff = get_ffmpeg()
+    if not ff:
+        raise Exception("ffmpeg not found")
+    cmd = [ff, "-v", "error", "-i", path, "-vn", "-ac", "1", "-ar", str(samplerate), "-f", "s16le", "-"]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **get_subprocess_kwargs())
+    # 另以執行緒持續讀取 stderr（只保留最後幾行供錯誤訊息），避免管線寫滿使 ffmpeg 卡住
+    errors = collections.deque(maxlen=20)
+    reader = threading.Thread(target=lambda: errors.extend(process.stderr), name='yt_transpose_peaks_stderr',
+                              daemon=True)
+    reader.start()
+    chunk_bytes = BASE_BUCKET * READ_BUCKETS * 2
+    blocks = []
+    total_samples = 0
+    remainder = b''
+    try:
+        while True:
+            chunk = process.stdout.read(chunk_bytes)
+            if not chunk:
+                break
+            chunk = remainder + chunk
+            usable = len(chunk) // (BASE_BUCKET * 2) * BASE_BUCKET * 2
+            remainder = chunk[usable:]
+            if usable:
+                samples = np.frombuffer(chunk[:usable], dtype='<i2').reshape(-1, BASE_BUCKET)
+                blocks.append(np.stack([samples.min(axis=1), samples.max(axis=1)], axis=1))
+                total_samples += usable // 2
+        if len(remainder) >= 2:
+            samples = np.frombuffer(remainder[:len(remainder) // 2 * 2], dtype='<i2')
+            blocks.append(np.array([[samples.min(), samples.max()]]))
+            total_samples += len(samples)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+        reader.join()
+        process.stderr.close()
+    if returncode != 0:
+        stderr = b''.join(errors).decode('utf-8', errors='ignore')
+        raise Exception(f"Failed to decode audio for waveform: {stderr}")
+
+    # 16-bit 縮為 8-bit：顯示用精度已足夠，峰值檔大小減半
+    base = np.concatenate(blocks) if blocks else np.zeros((0, 2), dtype=np.int16)
+    base = (base >> 8).astype(np.int8)
+    levels = [(BASE_BUCKET, base)]
+    for _ in range(LEVELS - 1):
+        if len(levels[-1][1]) <= 1:
+            break
+        levels.append((levels[-1][0] * ZOOM_FACTOR, _reduce(levels[-1][1], ZOOM_FACTOR)))
+    return Peaks(samplerate, total_samples / samplerate, levels)
+
+
+def write_peaks(peaks, path):
+    """原子地寫出峰值檔"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, peaks.samplerate, len(peaks.levels), peaks.duration))
+        for samples_per_bucket, data in peaks.levels:
+            f.write(LEVEL_HEADER.pack(samples_per_bucket, len(data)))
+        for _, data in peaks.levels:
+            f.write(np.ascontiguousarray(data, dtype=np.int8).tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_peaks(path):
+    """讀取峰值檔（以記憶體映射，不會複製資料）"""
+    with open(path, 'rb') as f:
+        magic, version, samplerate, level_count, duration = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise Exception(f"Not a peaks file: {path}")
+        shapes = [LEVEL_HEADER.unpack(f.read(LEVEL_HEADER.size)) for _ in range(level_count)]
+        offset = f.tell()
+    levels = []
+    for samples_per_bucket, count in shapes:
+        if count:
+            data = np.memmap(path, dtype=np.int8, mode='r', offset=offset, shape=(count, 2))
+        else:
+            data = np.zeros((0, 2), dtype=np.int8)
+        levels.append((samples_per_bucket, data))
+        offset += count * 2
+    return Peaks(samplerate, duration, levels)
+
+
+def get_peaks_path(source_path):
+    return source_path + '.peaks'
+
+
+def get_peaks(source_path):
+    """取得來源檔的峰值：峰值檔存在且比來源新時直接讀取，否則計算並寫在來源檔旁邊"""
+    peaks_path = get_peaks_path(source_path)
+    try:
+        if os.path.getmtime(peaks_path) >= os.path.getmtime(source_path):
+            return read_peaks(peaks_path)
+    except Exception:
+        # 沒有峰值檔或檔案損壞時重新計算
+        pass
+    peaks = compute_peaks(source_path)
+    try:
+        write_peaks(peaks, peaks_path)
+    except OSError as e:
+        # 來源所在目錄不可寫時只是不快取
+        print(f"Warning: failed to write peaks file: {e}")
+    return peaks
@@ -0,0 +1,83 @@
+"""速度/品質預設組合
+
+一個預設同時決定 SoundTouch 的快速搜尋與抗混疊選項、處理取樣率與聲道數、
+rubberband 濾鏡的品質選項以及輸出編碼品質：
+
+    draft     排練用草稿：單聲道 22.05 kHz、soundstretch -quick -naa、低位元率編碼
+    standard  預設：保留來源取樣率與聲道，與以往的設定相同
+    archival  保存用：最高編碼品質，rubberband 以聲道連動處理保持立體聲像
+
+使用的預設會寫入輸出檔的 comment 中繼資料。
+可用環境變數 YT_TRANSPOSE_PRESET 指定預設值。
+"""
+import os
+
+DEFAULT_PRESET = 'standard'
+
+
+class Preset:
+    """一組處理與編碼設定"""
+
+    def __init__(self, name, description, quick_seek=False, anti_alias=True, samplerate=None, channels=None,
+                 rubberband_options=None, encoder_args=None):
+        self.name = name
+        self.description = description
+        # soundstretch -quick：以較快但較粗略的搜尋演算法處理
+        self.quick_seek = quick_seek
+        # soundstretch -naa：關閉抗混疊濾波器
+        self.anti_alias = anti_alias
+        # 處理取樣率與聲道數，None 表示沿用來源
+        self.samplerate = samplerate
+        self.channels = channels
+        # ffmpeg rubberband 濾鏡的額外選項
+        self.rubberband_options = dict(rubberband_options or {})
+        # 輸出格式 -> ffmpeg 編碼參數（覆蓋 OUTPUT_FORMATS 的預設值）
+        self.encoder_args = dict(encoder_args or {})
+
+    def soundstretch_options(self):
+        options = []
+        if self.quick_seek:
+            options.append("-quick")
+        if not self.anti_alias:
+            options.append("-naa")
+        return options
+
+    def metadata_comment(self):
+        return f"yt-transpose preset={self.name}"
+
+
+PRESETS = {
+    'draft': Preset(
+        'draft', 'fast rehearsal render (mono, 22.05 kHz, quick SoundTouch settings)',
+        quick_seek=True, anti_alias=False, samplerate=22050, channels=1,
+        rubberband_options={'pitchq': 'speed', 'window': 'short'},
+        encoder_args={
+            'mp3': ["-codec:a", "libmp3lame", "-q:a", "7"],
+            'm4a': ["-codec:a", "aac", "-b:a", "96k"],
+            'opus': ["-codec:a", "libopus", "-b:a", "48k"],
+            'ogg': ["-codec:a", "libvorbis", "-q:a", "2"],
+        },
+    ),
+    'standard': Preset('standard', 'default quality (source sample rate and channels)'),
+    'archival': Preset(
+        'archival', 'highest quality for keeping',
+        rubberband_options={'pitchq': 'quality', 'channels': 'together'},
+        encoder_args={
+            'mp3': ["-codec:a", "libmp3lame", "-q:a", "0"],
+            'm4a': ["-codec:a", "aac", "-b:a", "256k"],
+            'opus': ["-codec:a", "libopus", "-b:a", "192k"],
+            'ogg': ["-codec:a", "libvorbis", "-q:a", "9"],
+            'flac': ["-codec:a", "flac", "-compression_level", "8"],
+        },
+    ),
+}
+
+
+def get_preset(name=None):
+    """依名稱取得預設，None 時使用環境變數 YT_TRANSPOSE_PRESET（預設 standard）"""
+    if isinstance(name, Preset):
+        return name
+    name = (name or os.environ.get('YT_TRANSPOSE_PRESET') or DEFAULT_PRESET).strip().lower()
+    if name not in PRESETS:
+        raise Exception(f"Unknown preset: {name} (available: {', '.join(PRESETS)})")
+    return PRESETS[name]
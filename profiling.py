@@ -0,0 +1,147 @@
+"""選用的效能分析
+
+以環境變數 YT_TRANSPOSE_PROFILE=1（或 transposer.py / batch_transpose.py 的 --profile）
+啟用後，每個 download_and_transpose 工作都會以 cProfile 與 tracemalloc 執行，
+並在輸出檔旁寫出：
+
+    <輸出檔名>.pstats        cProfile 統計（可用 python -m pstats 或 snakeviz 開啟）
+    <輸出檔名>.profile.txt   耗時、本行程與子行程（ffmpeg、soundstretch）CPU 時間、
+                             記憶體峰值、配置最多的位置與累計耗時最多的函數
+
+工作失敗時報告寫在輸出目錄（或目前目錄）。未啟用時直接呼叫，沒有任何額外成本。
+
+cProfile 與 tracemalloc 都是整個行程共用的，同一時間只分析一個工作；
+其他同時執行的工作（例如 GUI 連續送出的工作）照常執行但不分析。
+"""
+import io
+import os
+import threading
+import time
+
+# 報告中列出的配置位置與函數數量
+TOP_ALLOCATIONS = 25
+TOP_FUNCTIONS = 30
+
+_profile_lock = threading.Lock()
+
+
+def is_profiling_enabled(enabled=None):
+    if enabled is not None:
+        return enabled
+    return os.environ.get('YT_TRANSPOSE_PROFILE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_rusage():
+    """回傳 (本行程 CPU 秒數, 子行程 CPU 秒數, 子行程 user 秒數, 子行程 sys 秒數)
+
+    子行程只計入已結束並被回收的行程。不支援的平台回傳 None。
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows 沒有 resource 模組
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime,
+            children.ru_utime, children.ru_stime)
+
+
+class JobProfiler:
+    """以 cProfile 與 tracemalloc 分析一個工作，結束時寫出報告"""
+
+    def __init__(self, label, output_dir=None):
+        self.label = label
+        self.output_dir = output_dir
+        # 工作回傳的輸出檔路徑，報告寫在它旁邊
+        self.result = None
+        self.report_paths = []
+
+    def __enter__(self):
+        import cProfile
+        import tracemalloc
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        self._snapshot_before = tracemalloc.take_snapshot()
+        self._rusage_before = get_rusage()
+        self._wall_start = time.perf_counter()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        import tracemalloc
+        self._profile.disable()
+        wall = time.perf_counter() - self._wall_start
+        rusage_after = get_rusage()
+        snapshot_after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if self._started_tracing:
+            tracemalloc.stop()
+        try:
+            self._write_reports(wall, rusage_after, snapshot_after, peak, exc)
+        except Exception as e:
+            # 報告失敗不影響工作結果
+            print(f"Warning: failed to write profile report: {e}")
+        return False
+
+    def _report_base(self):
+        if isinstance(self.result, str) and self.result:
+            return self.result
+        directory = self.output_dir or os.getcwd()
+        return os.path.join(directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+    def _write_reports(self, wall, rusage_after, snapshot_after, peak, exc):
+        import pstats
+        base = self._report_base()
+        stats_path = base + ".pstats"
+        report_path = base + ".profile.txt"
+        self._profile.dump_stats(stats_path)
+
+        lines = [f"Job: {self.label}"]
+        lines.append(f"Result: {self.result if exc is None else f'failed: {exc}'}")
+        lines.append(f"Wall time: {wall:.2f}s")
+        if self._rusage_before and rusage_after:
+            own_cpu = rusage_after[0] - self._rusage_before[0]
+            child_user = rusage_after[2] - self._rusage_before[2]
+            child_sys = rusage_after[3] - self._rusage_before[3]
+            lines.append(f"Python CPU time (all threads): {own_cpu:.2f}s")
+            lines.append(f"Child process CPU time (ffmpeg, soundstretch, ...): "
+                         f"{child_user + child_sys:.2f}s (user {child_user:.2f}s, sys {child_sys:.2f}s)")
+        lines.append(f"Traced memory peak: {peak / 1024 ** 2:.1f} MB")
+
+        lines.append("")
+        lines.append(f"Top {TOP_ALLOCATIONS} allocation sites still alive at the end of the job:")
+        for stat in snapshot_after.compare_to(self._snapshot_before, 'lineno')[:TOP_ALLOCATIONS]:
+            lines.append(f"  {stat}")
+
+        lines.append("")
+        lines.append(f"Top {TOP_FUNCTIONS} functions by cumulative time:")
+        buffer = io.StringIO()
+        pstats.Stats(stats_path, stream=buffer).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        lines.append(buffer.getvalue())
+
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+        self.report_paths = [stats_path, report_path]
+        print(f"Profile written: {report_path}")
+
+
+def profiled(func, *args, enabled=None, **kwargs):
+    """執行 func(*args, **kwargs)；啟用分析時以 JobProfiler 包裝"""
+    if not is_profiling_enabled(enabled):
+        return func(*args, **kwargs)
+    if not _profile_lock.acquire(blocking=False):
+        print("Profiling skipped: another job is already being profiled")
+        return func(*args, **kwargs)
+    try:
+        label = kwargs.get('url') or (args[0] if args else getattr(func, '__name__', 'job'))
+        # download_and_transpose 的第 4 個位置參數為 output_dir
+        output_dir = kwargs.get('output_dir') or (args[3] if len(args) > 3 else None)
+        with JobProfiler(label, output_dir) as profiler:
+            profiler.result = func(*args, **kwargs)
+        return profiler.result
+    finally:
+        _profile_lock.release()
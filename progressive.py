@@ -0,0 +1,137 @@
+"""漸進式輸出
+
+長音檔的處理可能要數分鐘，一般流程在暫存目錄完成整個檔案後才複製到輸出資料夾。
+啟用漸進式輸出時，編碼器直接寫入輸出資料夾中的最終檔案，旁邊放一個完成標記
+<輸出檔>.rendering；標記存在表示檔案仍在增長，處理完成後移除，失敗時連同不完整的
+檔案一起刪除。播放器或客戶端可以在處理開始幾秒後就開始讀取：
+
+    python progressive.py "<輸出檔>" | ffplay -nodisp -
+
+只有可串流的格式（mp3、ogg、opus、flac，以及以 fragmented MP4 寫出的 m4a）支援漸進式輸出，
+wav 等格式照常在完成後才複製。ffmpeg 引擎從渲染一開始就寫出；soundstretch 引擎
+需先處理完整個 WAV，只有最後的編碼階段是漸進的。
+
+可用環境變數設定：
+    YT_TRANSPOSE_PROGRESSIVE=1   啟用漸進式輸出（或命令列 --progressive）
+"""
+import os
+import sys
+import time
+
+MARKER_SUFFIX = '.rendering'
+
+# 可串流的格式與需要額外加上的封裝參數
+PROGRESSIVE_FORMATS = {
+    'mp3': [],
+    'ogg': [],
+    'opus': [],
+    'flac': [],
+    # MP4 的索引（moov）預設寫在檔尾，改為開頭的空索引與分段寫出
+    'm4a': ["-movflags", "+frag_keyframe+empty_moov"],
+}
+
+# 追蹤增長中的檔案時，每次讀取的大小與沒有新資料時的等待間隔
+FOLLOW_CHUNK_SIZE = 64 * 1024
+FOLLOW_POLL_INTERVAL = 0.25
+
+
+def is_progressive_enabled(progressive=None):
+    if progressive is not None:
+        return progressive
+    return os.environ.get('YT_TRANSPOSE_PROGRESSIVE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def supports_progressive(output_format):
+    return output_format in PROGRESSIVE_FORMATS
+
+
+def get_progressive_args(output_format):
+    """漸進式輸出需要的額外編碼參數"""
+    # 每個封包立即寫出，不等 ffmpeg 的輸出緩衝區填滿
+    return ["-flush_packets", "1", *PROGRESSIVE_FORMATS.get(output_format, [])]
+
+
+def get_marker_path(path):
+    return path + MARKER_SUFFIX
+
+
+def is_rendering(path):
+    return os.path.exists(get_marker_path(path))
+
+
+def begin(path):
+    """開始漸進式輸出：移除舊的輸出檔並建立完成標記"""
+    if os.path.exists(path):
+        os.remove(path)
+    with open(get_marker_path(path), 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def finish(path):
+    """輸出完成：移除完成標記"""
+    try:
+        os.remove(get_marker_path(path))
+    except OSError:
+        pass
+
+
+def abort(path):
+    """處理失敗：刪除不完整的輸出檔與完成標記"""
+    for p in (path, get_marker_path(path)):
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+
+def follow(path, chunk_size=FOLLOW_CHUNK_SIZE, poll_interval=FOLLOW_POLL_INTERVAL, timeout=None):
+    """逐段產生檔案內容，直到完成標記消失且已讀到檔尾
+
+    完成標記存在但檔案尚未出現時（響度測量或 soundstretch 處理中）一直等待；
+    開始寫出後 timeout 秒內都沒有新資料時拋出 Exception。
+    處理失敗（標記與檔案都被刪除）時也拋出 Exception。
+    """
+    while not os.path.exists(path):
+        if not is_rendering(path):
+            raise Exception(f"Output not found: {path}")
+        time.sleep(poll_interval)
+    last_data = time.monotonic()
+    with open(path, 'rb') as f:
+        while True:
+            # 先檢查標記再讀取，避免在最後一次寫入與移除標記之間漏掉資料
+            rendering = is_rendering(path)
+            chunk = f.read(chunk_size)
+            if chunk:
+                last_data = time.monotonic()
+                yield chunk
+                continue
+            if not rendering:
+                if not os.path.exists(path):
+                    raise Exception(f"Rendering failed: {path}")
+                return
+            if timeout is not None and time.monotonic() - last_data > timeout:
+                raise Exception(f"Timed out waiting for output: {path}")
+            time.sleep(poll_interval)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Write a progressively rendered output to stdout as it grows")
+    parser.add_argument("path", help="output file being rendered (or already complete)")
+    parser.add_argument("--timeout", type=float, default=60, help="give up after this many seconds without new data")
+    args = parser.parse_args()
+    out = sys.stdout.buffer
+    try:
+        for chunk in follow(args.path, timeout=args.timeout):
+            out.write(chunk)
+            out.flush()
+    except BrokenPipeError:
+        # 播放器提前結束
+        pass
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
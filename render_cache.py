@@ -0,0 +1,222 @@
+"""轉調結果快取
+
+相同的請求（同一個影片、相同的正規化參數、相同的輸出格式與處理引擎版本）
+直接回傳先前的結果，不再重新下載與處理。索引存在 SQLite 中，
+快取檔案以硬連結（或 reflink）交付到各個輸出目錄，不會重複複製內容。
+
+可用環境變數設定：
+    YT_TRANSPOSE_RENDER_CACHE=0       停用快取
+    YT_TRANSPOSE_RENDER_CACHE_MB=5120 快取容量上限（MB），超過時淘汰最久未使用的項目
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+DEFAULT_MAX_MB = 5120
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    key TEXT PRIMARY KEY,
+    source_id TEXT NOT NULL,
+    params TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS renders_lru ON renders (last_used);
+"""
+
+# Linux 的 FICLONE ioctl（btrfs、xfs 等支援 reflink 的檔案系統）
+FICLONE = 0x40049409
+
+
+def is_render_cache_enabled():
+    return os.environ.get('YT_TRANSPOSE_RENDER_CACHE', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def get_source_id(url):
+    """來源識別：YouTube 影片 ID，無法解析時使用正規化後的網址"""
+    from transposer_core import extract_video_id
+    video_id = extract_video_id(url)
+    if video_id:
+        return f"youtube:{video_id}"
+    return f"url:{(url or '').strip()}"
+
+
+def normalize_render_params(semitones=0, tempo=None, rate=None, bpm=None, loudness=None, output_format='mp3'):
+    """正規化處理參數，只保留實際會影響結果的值（優先級與 download_and_transpose 相同）"""
+    normalized_semitones = round(float(semitones), 2) if semitones else 0.0
+    if abs(normalized_semitones) < 0.01:
+        normalized_semitones = 0.0
+    params = {'semitones': normalized_semitones, 'format': (output_format or 'mp3').lower()}
+    if bpm is not None:
+        params['bpm'] = round(float(bpm), 2)
+    elif rate is not None and rate != 0.0:
+        params['rate'] = round(float(rate), 2)
+    elif tempo is not None and tempo != 0.0:
+        params['tempo'] = round(float(tempo), 2)
+    if loudness is not None:
+        params['loudness'] = round(float(loudness), 2)
+    return params
+
+
+def make_cache_key(source_id, params, engine_version):
+    payload = json.dumps({'source': source_id, 'params': params, 'engine': engine_version}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _reflink(src, dst):
+    """嘗試以 reflink（寫入時複製）建立檔案，不支援時拋出 OSError"""
+    if not sys.platform.startswith('linux'):
+        raise OSError("reflink not supported on this platform")
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def link_or_copy(src, dst):
+    """以硬連結建立 dst；跨檔案系統時改用 reflink，最後才複製"""
+    if os.path.exists(dst):
+        try:
+            if os.path.samefile(src, dst):
+                return 'existing'
+        except OSError:
+            pass
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        shutil.copystat(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+class RenderCache:
+    """以 SQLite 為索引的轉調結果快取"""
+
+    def __init__(self, root=None, max_bytes=None):
+        if root is None:
+            from transposer_core import get_cache_dir
+            root = get_cache_dir('renders')
+        if max_bytes is None:
+            try:
+                max_bytes = int(float(os.environ.get('YT_TRANSPOSE_RENDER_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+            except ValueError:
+                max_bytes = DEFAULT_MAX_MB * 1024 * 1024
+        self.root = root
+        self.store_dir = os.path.join(root, 'store')
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, 'index.db')
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def lookup(self, key):
+        """查詢快取，命中時回傳 (快取檔路徑, 輸出檔名)，否則回傳 None"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT path, filename, size FROM renders WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                try:
+                    valid = os.path.getsize(row['path']) == row['size']
+                except OSError:
+                    valid = False
+                if not valid:
+                    # 快取檔已遺失或損壞，移除索引
+                    with conn:
+                        conn.execute("DELETE FROM renders WHERE key = ?", (key,))
+                    return None
+                with conn:
+                    conn.execute("UPDATE renders SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+                return row['path'], row['filename']
+            finally:
+                conn.close()
+
+    def deliver(self, cached_path, filename, output_dir):
+        """將快取結果交付到輸出目錄（硬連結 / reflink，不複製內容）"""
+        os.makedirs(output_dir, exist_ok=True)
+        final_path = os.path.join(output_dir, filename)
+        link_or_copy(cached_path, final_path)
+        return final_path
+
+    def store(self, key, source_id, params, output_path):
+        """將剛產生的結果加入快取（以硬連結保存，不額外佔用空間直到輸出檔被刪除）"""
+        ext = os.path.splitext(output_path)[1]
+        shard = os.path.join(self.store_dir, key[:2])
+        os.makedirs(shard, exist_ok=True)
+        cached_path = os.path.join(shard, key + ext)
+        link_or_copy(output_path, cached_path)
+        size = os.path.getsize(cached_path)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO renders (key, source_id, params, filename, path, size, created, last_used, hits) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                        (key, source_id, json.dumps(params, sort_keys=True), os.path.basename(output_path),
+                         cached_path, size, now, now),
+                    )
+                self._evict(conn)
+            finally:
+                conn.close()
+        return cached_path
+
+    def _evict(self, conn):
+        """超過容量上限時，依最久未使用的順序淘汰"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM renders").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT key, path, size FROM renders ORDER BY last_used").fetchall()
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(row['path'])
+            except OSError:
+                pass
+            with conn:
+                conn.execute("DELETE FROM renders WHERE key = ?", (row['key'],))
+            total -= row['size']
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """取得行程內共用的結果快取"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = RenderCache()
+        return _default_cache
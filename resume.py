@@ -0,0 +1,275 @@
+"""下載重試與續傳
+
+暫時性的網路錯誤會以指數退避（加上隨機抖動）重試。下載中的 .part 檔放在
+以影片 ID 與格式區分的持久目錄中，失敗時不會隨臨時工作目錄一起刪除，
+之後的重試或下一次執行都能透過 HTTP Range 請求從中斷處續傳。
+
+同一個續傳目錄同一時間只由一個工作使用（以檔案鎖保護，跨行程也有效）；
+目錄已被佔用時（例如同時處理同一部影片），該工作改用自己的臨時續傳目錄。
+"""
+import hashlib
+import inspect
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+# 預設重試參數
+DEFAULT_RETRIES = 4
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 30.0
+
+# 錯誤訊息中代表暫時性網路問題的關鍵字
+TRANSIENT_MARKERS = (
+    'timed out',
+    'timeout',
+    'connection reset',
+    'connection aborted',
+    'connection refused',
+    'remote end closed',
+    'temporary failure in name resolution',
+    'network is unreachable',
+    'incompleteread',
+    'incomplete read',
+    'content too short',
+    'http error 429',
+    'http error 500',
+    'http error 502',
+    'http error 503',
+    'http error 504',
+)
+
+# 下載中、尚未完成的檔案副檔名
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+
+def get_partial_key(video_id, format_id=None):
+    """續傳目錄名稱：影片 ID 加上格式（不同格式的 .part 檔不能互相續傳）"""
+    key = str(video_id) if format_id is None else f"{video_id}_{format_id}"
+    safe_key = ''.join(c if c.isalnum() or c in '-_' else '_' for c in key)
+    if len(safe_key) > 80:
+        # 命令列模式的格式字串可能很長
+        safe_key = f"{safe_key[:48]}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+    return safe_key
+
+
+def remove_partial_dir(path):
+    """下載成功後移除續傳目錄"""
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def _try_lock(path):
+    """以非阻塞方式取得檔案的獨佔鎖，已被其他工作持有時回傳 None"""
+    f = open(path, 'a+b')
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _unlock(f):
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    except OSError:
+        pass
+    finally:
+        f.close()
+
+
+class PartialDir:
+    """取得的續傳目錄；release() 前其他工作不會使用同一個目錄"""
+
+    def __init__(self, path, lock_file=None):
+        self.path = path
+        self._lock_file = lock_file
+        self._released = False
+
+    @property
+    def is_private(self):
+        """是否為目錄被佔用時改用的臨時續傳目錄（不會保留給之後續傳）"""
+        return self._lock_file is None
+
+    def release(self, remove=False):
+        """釋放目錄；remove=True（下載完成）或臨時目錄時一併刪除"""
+        if self._released:
+            return
+        self._released = True
+        if remove or self.is_private:
+            remove_partial_dir(self.path)
+        if self._lock_file is not None:
+            _unlock(self._lock_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def acquire_partial_dir(video_id, format_id=None):
+    """取得續傳目錄的使用權，已被其他工作使用時回傳臨時續傳目錄
+
+    鎖檔放在續傳目錄之外（partial/.locks），刪除續傳目錄時不會影響其他正在等待的工作。
+    """
+    from transposer_core import get_cache_dir
+    root = get_cache_dir('partial')
+    key = get_partial_key(video_id, format_id)
+    lock_dir = os.path.join(root, '.locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_file = _try_lock(os.path.join(lock_dir, key + '.lock'))
+    if lock_file is None:
+        print(f"Partial download for {video_id} is in use by another job, downloading separately")
+        return PartialDir(tempfile.mkdtemp(prefix=f"{key}.", dir=root))
+    path = os.path.join(root, key)
+    os.makedirs(path, exist_ok=True)
+    return PartialDir(path, lock_file)
+
+
+def iter_completed_files(path):
+    """列出續傳目錄中已完成（非 .part）的檔案"""
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return
+    for name in names:
+        full = os.path.join(path, name)
+        if os.path.isfile(full) and not name.endswith(PARTIAL_SUFFIXES):
+            yield full
+
+
+def _iter_exception_chain(exc):
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        # yt_dlp 的 DownloadError 將原始例外放在 exc_info
+        exc_info = getattr(exc, 'exc_info', None)
+        if isinstance(exc_info, tuple) and len(exc_info) > 1 and exc_info[1] is not None and exc_info[1] is not exc:
+            yield from _iter_exception_chain(exc_info[1])
+        exc = exc.__cause__ or exc.__context__
+
+
+def is_transient_error(exc):
+    """判斷是否為值得重試的暫時性網路錯誤"""
+    for err in _iter_exception_chain(exc):
+        if isinstance(err, (socket.timeout, TimeoutError, ConnectionError)):
+            return True
+        status = getattr(err, 'status', None) or getattr(err, 'code', None)
+        if isinstance(status, int) and (status == 429 or 500 <= status < 600):
+            return True
+        if type(err).__name__ in ('TransportError', 'IncompleteRead', 'ContentTooShortError'):
+            return True
+        message = str(err).lower()
+        if any(marker in message for marker in TRANSIENT_MARKERS):
+            return True
+    return False
+
+
+def get_backoff_delay(attempt, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """指數退避加完全抖動（full jitter）：0 ~ min(max_delay, base * 2^attempt)"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def retry_with_backoff(func, retries=DEFAULT_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+                       max_delay=DEFAULT_MAX_DELAY, on_retry=None):
+    """執行 func()，遇到暫時性錯誤時以指數退避重試，其他錯誤直接拋出"""
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= retries or not is_transient_error(e):
+                raise
+            delay = get_backoff_delay(attempt, base_delay, max_delay)
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+            time.sleep(delay)
+            attempt += 1
+
+
+def iter_retry_with_backoff(plan, retries=DEFAULT_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+                            max_delay=DEFAULT_MAX_DELAY, on_retry=None):
+    """命令計畫版的 retry_with_backoff：plan() 回傳一次嘗試的命令計畫（產生器），
+    也可以是直接執行並回傳結果的一般函式（例如以 Python API 下載）
+
+    退避期間 yield WaitStep，由執行端等待（非同步執行端等待時不佔用執行緒）。
+    """
+    from backends import Delay, iter_wait
+    attempt = 0
+    while True:
+        try:
+            result = plan()
+            if inspect.isgenerator(result):
+                result = yield from result
+            return result
+        except Exception as e:
+            if attempt >= retries or not is_transient_error(e):
+                raise
+            delay = get_backoff_delay(attempt, base_delay, max_delay)
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+            yield from iter_wait(Delay(delay))
+            attempt += 1
+
+
+class TransferStats:
+    """統計實際傳輸的位元組數（扣除續傳時已存在的部分）"""
+
+    def __init__(self):
+        self.bytes_transferred = 0
+        self.bytes_resumed = 0
+        self.attempts = 0
+        self._start_sizes = {}
+        self._last_bytes = {}
+
+    def begin_attempt(self, partial_dir):
+        """記錄本次嘗試開始時各 .part 檔的大小（即續傳起點）"""
+        self.attempts += 1
+        self._start_sizes = {}
+        self._last_bytes = {}
+        try:
+            names = os.listdir(partial_dir)
+        except OSError:
+            names = []
+        for name in names:
+            if name.endswith('.part'):
+                full = os.path.join(partial_dir, name)
+                self._start_sizes[os.path.abspath(full)] = os.path.getsize(full)
+
+    def progress_hook(self, d):
+        """yt-dlp progress hook：downloaded_bytes 包含續傳起點之前的部分"""
+        filename = d.get('tmpfilename') or d.get('filename')
+        downloaded = d.get('downloaded_bytes')
+        if filename and downloaded is not None:
+            self._last_bytes[os.path.abspath(filename)] = downloaded
+
+    def end_attempt(self):
+        for filename, downloaded in self._last_bytes.items():
+            start = self._start_sizes.get(filename, 0)
+            self.bytes_transferred += max(0, downloaded - start)
+            self.bytes_resumed += min(start, downloaded)
+        self._last_bytes = {}
+
+    def as_dict(self):
+        return {
+            'bytes_transferred': self.bytes_transferred,
+            'bytes_resumed': self.bytes_resumed,
+            'download_attempts': self.attempts,
+        }
@@ -0,0 +1,476 @@
+"""資源感知的工作准入控制（admission control）
+
+同時執行的工作太多時，多個 soundstretch 行程與 WAV 中間檔會耗盡記憶體或磁碟，
+同時下載太多則會塞滿網路。每個工作的兩個主要階段在開始前都要先向排程器取得資源：
+
+    下載  預估頻寬（以實際量測的下載速率學習）與下載數上限
+    處理  預估 CPU 核心數與記憶體（依處理引擎，以實際量測的子行程用量學習）
+
+暫存磁碟空間由 scratch.py 依影片長度與取樣率預約。資源不足時工作排隊等待，
+目前沒有同類工作在執行時一律放行（單一工作超過上限也不會永遠等待）。
+
+同步執行端（backends.run_plan）在 POSIX 上以 os.wait4 取得每個子行程實際的 CPU 時間與
+最大常駐記憶體，完成後回饋給排程器，之後的預估就以實際用量為準。
+
+互動工作（GUI、單次命令列）優先於批次工作：有互動工作在等待時批次工作不會被放行，
+批次工作也不會用掉保留給互動工作的 CPU。批次工具（batch_transpose.py、worker.py）
+啟動時以 set_background_priority() 降低自身與子行程的 CPU（nice）與 I/O（ionice）優先順序。
+
+可用環境變數設定：
+    YT_TRANSPOSE_MAX_CPU=8              同時處理使用的 CPU 核心數上限（預設為 CPU 數）
+    YT_TRANSPOSE_MAX_MEMORY_MB=4096     同時處理使用的記憶體上限（預設為實體記憶體的一半）
+    YT_TRANSPOSE_MAX_BANDWIDTH_MBPS=100 同時下載使用的頻寬上限（Mbit/s，預設不限）
+    YT_TRANSPOSE_MAX_DOWNLOADS=4        同時下載數上限
+    YT_TRANSPOSE_INTERACTIVE_CPU=1      保留給互動工作的 CPU 核心數
+    YT_TRANSPOSE_JOB_CLASS=batch        本行程工作的預設類別（interactive 或 batch）
+"""
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import metrics
+
+DEFAULT_MAX_DOWNLOADS = 4
+DEFAULT_INTERACTIVE_CPU = 1
+
+# 尚未量測到實際用量時的預估值
+DEFAULT_DOWNLOAD_RATE = 2 * 1024 * 1024  # bytes/s
+DEFAULT_RENDER_CPU = 1.0
+DEFAULT_RENDER_MEMORY = {
+    # 串流處理，記憶體用量與音檔長度無關
+    'ffmpeg': 96 * 1024 * 1024,
+    'soundstretch': 128 * 1024 * 1024,
+    'transcode': 64 * 1024 * 1024,
+}
+# 記憶體預估保留的誤差比例
+MEMORY_MARGIN = 1.25
+# 實際用量回饋的指數移動平均權重
+EWMA_ALPHA = 0.3
+# 等待資源時重新檢查的間隔（秒）
+WAIT_INTERVAL = 1.0
+
+# 批次工作降低的 nice 值
+BACKGROUND_NICE = 10
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+
+def _env_float(name, default=None):
+    value = os.environ.get(name, '').strip()
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return default
+
+
+def get_total_memory():
+    """實體記憶體大小（位元組），無法取得時回傳 None"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+_job_class = None
+
+
+def get_job_class():
+    """本行程工作的預設類別"""
+    if _job_class is not None:
+        return _job_class
+    value = os.environ.get('YT_TRANSPOSE_JOB_CLASS', '').strip().lower()
+    return BATCH if value == BATCH else INTERACTIVE
+
+
+def set_background_priority():
+    """批次工具使用：降低本行程（與之後啟動的子行程）的 CPU 與 I/O 優先順序，工作類別改為批次"""
+    global _job_class
+    _job_class = BATCH
+    if sys.platform == 'win32':
+        try:
+            import ctypes
+            BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+        except Exception as e:
+            print(f"Warning: failed to lower process priority: {e}")
+        return
+    try:
+        os.nice(BACKGROUND_NICE)
+    except OSError as e:
+        print(f"Warning: failed to lower process priority: {e}")
+    ionice = shutil.which('ionice')
+    if ionice:
+        # best-effort 類別中最低的 I/O 優先順序（idle 類別在磁碟忙碌時可能完全停住）
+        subprocess.run([ionice, '-c', '2', '-n', '7', '-p', str(os.getpid())],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class Resources:
+    """一個階段需要的資源"""
+
+    def __init__(self, cpu=0.0, memory=0, bandwidth=0.0, downloads=0):
+        self.cpu = cpu
+        self.memory = memory
+        self.bandwidth = bandwidth
+        self.downloads = downloads
+
+    def describe(self):
+        parts = []
+        if self.cpu:
+            parts.append(f"{self.cpu:.1f} CPU")
+        if self.memory:
+            parts.append(f"{self.memory / 1024 ** 2:.0f} MB RAM")
+        if self.bandwidth:
+            parts.append(f"{self.bandwidth * 8 / 1000 ** 2:.0f} Mbit/s")
+        return ", ".join(parts) or "no resources"
+
+
+class StepUsage:
+    """一個子行程實際使用的資源"""
+
+    def __init__(self, wall_seconds, cpu_seconds=None, max_rss=None):
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.max_rss = max_rss
+
+
+def run_with_usage(cmd, **kwargs):
+    """執行命令並回傳 CompletedProcess（文字輸出），附加 .usage（StepUsage）
+
+    POSIX 上以 os.wait4 回收子行程，取得該行程本身的 CPU 時間與最大常駐記憶體；
+    其他平台只記錄經過時間。
+    """
+    started = time.monotonic()
+    if not hasattr(os, 'wait4'):
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', **kwargs)
+        result.usage = StepUsage(time.monotonic() - started)
+        return result
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+    try:
+        stdout_chunks = []
+        reader = threading.Thread(target=lambda: stdout_chunks.append(process.stdout.read()), daemon=True)
+        reader.start()
+        stderr = process.stderr.read()
+        reader.join()
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            process.wait()
+        raise
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+    # Linux 的 ru_maxrss 單位為 KB，macOS 為位元組
+    max_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+    usage = StepUsage(time.monotonic() - started, rusage.ru_utime + rusage.ru_stime, max_rss)
+    result = subprocess.CompletedProcess(
+        cmd, process.returncode,
+        b"".join(stdout_chunks).decode('utf-8', errors='ignore'), stderr.decode('utf-8', errors='ignore'),
+    )
+    result.usage = usage
+    return result
+
+
+class Admission:
+    """已放行的一個階段；結束時（或 with 區塊結束時）釋放資源"""
+
+    def __init__(self, scheduler, kind, resources, key=None):
+        self.scheduler = scheduler
+        self.kind = kind
+        self.resources = resources
+        # 學習用的分類鍵（例如處理引擎名稱）
+        self.key = key
+        self.started = time.monotonic()
+        self.released = False
+        self._cpu_seconds = 0.0
+        self._max_rss = 0
+        self._measured = False
+
+    def track(self, plan):
+        """轉送命令計畫，並收集各步驟的實際用量"""
+        result = None
+        try:
+            while True:
+                try:
+                    step = plan.send(result)
+                except StopIteration as stop:
+                    return stop.value
+                result = yield step
+                self.observe(result)
+        finally:
+            plan.close()
+
+    def observe(self, result):
+        """記錄一個步驟的實際用量（執行端有提供時）"""
+        usage = getattr(result, 'usage', None)
+        if usage is not None and usage.cpu_seconds is not None:
+            self._measured = True
+            self._cpu_seconds += usage.cpu_seconds
+            self._max_rss = max(self._max_rss, usage.max_rss or 0)
+
+    def record_download(self, size):
+        """回報實際下載的位元組數，用於學習下載速率"""
+        self.scheduler._observe_download(size, time.monotonic() - self.started)
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        if self._measured:
+            self.scheduler._observe_render(self.key, self._cpu_seconds, time.monotonic() - self.started,
+                                           self._max_rss)
+        self.scheduler._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class PendingAdmission:
+    """排隊中的准入請求
+
+    poll() 不阻塞：資源足夠時放行並回傳 Admission，否則回傳 None（第一次未放行時開始計入排隊）；
+    wait() 在目前執行緒等待直到放行。非同步執行端（async_api.py）在事件迴圈中定期 poll()，
+    等待中的工作不佔用執行緒。放棄等待時呼叫 cancel()。
+    """
+
+    def __init__(self, scheduler, resources, kind, key, job_class, progress_callback=None, progress=0):
+        self.scheduler = scheduler
+        self.resources = resources
+        self.kind = kind
+        self.key = key
+        self.job_class = job_class
+        self.progress_callback = progress_callback
+        self.progress = progress
+        self._queued = False
+
+    def _try_admit(self):
+        # 呼叫端需持有 scheduler._cond
+        scheduler = self.scheduler
+        # 有互動工作在等待時，批次工作讓它先進
+        if ((self.job_class == INTERACTIVE or scheduler._waiting_interactive == 0) and
+                scheduler._fits(self.resources, self.job_class)):
+            self._dequeue()
+            admission = Admission(scheduler, self.kind, self.resources, self.key)
+            scheduler._active.append(admission)
+            scheduler._update_metrics()
+            return admission
+        if not self._queued:
+            self._queued = True
+            if self.job_class == INTERACTIVE:
+                scheduler._waiting_interactive += 1
+            metrics.queue_depth().inc(queue=f'scheduler_{self.kind}')
+            msg = f"Waiting for resources to {self.kind} ({self.resources.describe()})..."
+            if self.progress_callback:
+                self.progress_callback(self.progress, msg)
+            print(msg)
+        return None
+
+    def _dequeue(self):
+        # 呼叫端需持有 scheduler._cond
+        if not self._queued:
+            return
+        self._queued = False
+        if self.job_class == INTERACTIVE:
+            self.scheduler._waiting_interactive -= 1
+            self.scheduler._cond.notify_all()
+        metrics.queue_depth().dec(queue=f'scheduler_{self.kind}')
+
+    def poll(self):
+        with self.scheduler._cond:
+            return self._try_admit()
+
+    def wait(self):
+        with self.scheduler._cond:
+            try:
+                while True:
+                    admission = self._try_admit()
+                    if admission is not None:
+                        return admission
+                    self.scheduler._cond.wait(WAIT_INTERVAL)
+            finally:
+                self._dequeue()
+
+    def cancel(self):
+        with self.scheduler._cond:
+            self._dequeue()
+
+
+class Scheduler:
+    """追蹤行程內執行中的工作階段，依預估資源放行或排隊"""
+
+    def __init__(self, cpu=None, memory=None, bandwidth=None, max_downloads=None, interactive_cpu=None):
+        self.cpu = cpu or _env_float('YT_TRANSPOSE_MAX_CPU') or float(os.cpu_count() or 1)
+        if memory is None:
+            memory_mb = _env_float('YT_TRANSPOSE_MAX_MEMORY_MB')
+            total = get_total_memory()
+            memory = memory_mb * 1024 * 1024 if memory_mb else (total // 2 if total else None)
+        self.memory = memory
+        if bandwidth is None:
+            mbps = _env_float('YT_TRANSPOSE_MAX_BANDWIDTH_MBPS')
+            bandwidth = mbps * 1000 ** 2 / 8 if mbps else None
+        self.bandwidth = bandwidth
+        self.max_downloads = int(max_downloads or _env_float('YT_TRANSPOSE_MAX_DOWNLOADS') or DEFAULT_MAX_DOWNLOADS)
+        if interactive_cpu is None:
+            interactive_cpu = _env_float('YT_TRANSPOSE_INTERACTIVE_CPU', DEFAULT_INTERACTIVE_CPU)
+        # 只有一個核心時不保留，否則批次工作永遠無法執行
+        self.interactive_cpu = min(interactive_cpu, max(0.0, self.cpu - 1))
+        self._active = []
+        self._waiting_interactive = 0
+        self._cond = threading.Condition()
+        # 由實際用量學習的預估值
+        self.download_rate = DEFAULT_DOWNLOAD_RATE
+        self.render_cpu = {}
+        self.render_memory = dict(DEFAULT_RENDER_MEMORY)
+
+    def estimate_download(self, duration=None, kbps=None):
+        """下載階段的資源：以學習到的下載速率預估頻寬，但不超過下載量本身"""
+        bandwidth = self.download_rate
+        if duration and kbps:
+            # 很短的片段在一秒內就下載完，不需佔用整份頻寬
+            bandwidth = min(bandwidth, duration * kbps * 1000 / 8)
+        return Resources(bandwidth=bandwidth, downloads=1)
+
+    def estimate_render(self, key, channels=None, samplerate=None):
+        """處理階段的資源：每個外部命令單執行緒串流處理，依引擎預估 CPU 與記憶體
+
+        單聲道/降低取樣率時處理量等比例降低，CPU 預估隨之縮小。
+        """
+        cpu = self.render_cpu.get(key, DEFAULT_RENDER_CPU)
+        scale = (channels or 2) / 2 * (samplerate or 48000) / 48000
+        memory = self.render_memory.get(key, DEFAULT_RENDER_MEMORY['ffmpeg'])
+        return Resources(cpu=max(0.25, min(cpu, cpu * scale)), memory=int(memory * MEMORY_MARGIN))
+
+    def _totals(self):
+        totals = Resources()
+        for admission in self._active:
+            totals.cpu += admission.resources.cpu
+            totals.memory += admission.resources.memory
+            totals.bandwidth += admission.resources.bandwidth
+            totals.downloads += admission.resources.downloads
+        return totals
+
+    def _fits(self, resources, job_class):
+        totals = self._totals()
+        if resources.downloads:
+            if totals.downloads == 0:
+                return True
+            if totals.downloads + resources.downloads > self.max_downloads:
+                return False
+            if self.bandwidth and totals.bandwidth + resources.bandwidth > self.bandwidth:
+                return False
+            return True
+        if totals.cpu == 0 and totals.memory == 0:
+            return True
+        cpu_limit = self.cpu - (self.interactive_cpu if job_class == BATCH else 0)
+        if totals.cpu + resources.cpu > cpu_limit + 1e-6:
+            return False
+        if self.memory and totals.memory + resources.memory > self.memory:
+            return False
+        return True
+
+    def request(self, resources, kind, key=None, job_class=None, progress_callback=None, progress=0):
+        """建立准入請求（PendingAdmission），可 poll() 嘗試放行或 wait() 等待"""
+        return PendingAdmission(self, resources, kind, key, job_class or get_job_class(), progress_callback,
+                                progress)
+
+    def admit(self, resources, kind, key=None, job_class=None, progress_callback=None, progress=0):
+        """等待資源足夠後放行，回傳 Admission（用完需 release，或以 with 使用）"""
+        return self.request(resources, kind, key, job_class, progress_callback, progress).wait()
+
+    def _release(self, admission):
+        with self._cond:
+            if admission in self._active:
+                self._active.remove(admission)
+            self._update_metrics()
+            self._cond.notify_all()
+
+    def _observe_download(self, size, seconds):
+        if size <= 0 or seconds <= 0.5:
+            # 太短的下載量測不準（大多是續傳或快取命中）
+            return
+        with self._cond:
+            self.download_rate += EWMA_ALPHA * (size / seconds - self.download_rate)
+
+    def _observe_render(self, key, cpu_seconds, wall_seconds, max_rss):
+        if key is None or wall_seconds <= 0:
+            return
+        with self._cond:
+            utilization = max(0.1, cpu_seconds / wall_seconds)
+            current = self.render_cpu.get(key, DEFAULT_RENDER_CPU)
+            self.render_cpu[key] = current + EWMA_ALPHA * (utilization - current)
+            if max_rss:
+                # 記憶體取較大者緩慢下修，避免一次小檔讓預估過低
+                current = self.render_memory.get(key, DEFAULT_RENDER_MEMORY['ffmpeg'])
+                self.render_memory[key] = max(max_rss, current + EWMA_ALPHA * (max_rss - current))
+
+    def _update_metrics(self):
+        totals = self._totals()
+        usage = metrics.scheduler_usage()
+        usage.set(totals.cpu, resource='cpu')
+        usage.set(totals.memory, resource='memory_bytes')
+        usage.set(totals.bandwidth, resource='bandwidth_bytes_per_second')
+        usage.set(totals.downloads, resource='downloads')
+
+    def snapshot(self):
+        """目前的用量、上限與學習到的預估值"""
+        with self._cond:
+            totals = self._totals()
+            return {
+                'active': len(self._active),
+                'cpu': (totals.cpu, self.cpu),
+                'memory': (totals.memory, self.memory),
+                'bandwidth': (totals.bandwidth, self.bandwidth),
+                'downloads': (totals.downloads, self.max_downloads),
+                'download_rate': self.download_rate,
+                'render_cpu': dict(self.render_cpu),
+                'render_memory': dict(self.render_memory),
+            }
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """取得行程內共用的排程器"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = Scheduler()
+        return _default_scheduler
+
+
+def request_download(duration=None, kbps=None, progress_callback=None):
+    """下載階段的准入請求（以共用的排程器），在命令計畫中以 backends.iter_wait() 等待"""
+    scheduler = get_scheduler()
+    return scheduler.request(scheduler.estimate_download(duration, kbps), 'download',
+                             progress_callback=progress_callback, progress=30)
+
+
+def request_render(key, channels=None, samplerate=None, progress_callback=None):
+    """處理階段的准入請求（以共用的排程器）；key 為處理引擎名稱或 'transcode'"""
+    scheduler = get_scheduler()
+    return scheduler.request(scheduler.estimate_render(key, channels, samplerate), 'render', key=key,
+                             progress_callback=progress_callback, progress=70)
+
+
+def admit_download(duration=None, kbps=None, progress_callback=None):
+    """下載階段的准入（在目前執行緒等待）"""
+    return request_download(duration, kbps, progress_callback).wait()
+
+
+def admit_render(key, channels=None, samplerate=None, progress_callback=None):
+    """處理階段的准入（在目前執行緒等待）"""
+    return request_render(key, channels, samplerate, progress_callback).wait()
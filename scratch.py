@@ -0,0 +1,227 @@
+"""暫存（scratch）空間管理
+
+工作所需的暫存空間（下載的音檔與 WAV 中間檔）可放在可設定的位置，
+例如 tmpfs（/dev/shm）或高速 NVMe，而不是固定使用系統預設的暫存目錄。
+
+以環境變數 YT_TRANSPOSE_SCRATCH 指定候選目錄（以 os.pathsep 分隔，依優先順序），
+未設定時使用系統預設暫存目錄。工作開始前會依影片長度與取樣率估算所需空間，
+選擇第一個放得下的目錄；都放不下時則排隊等待其他工作釋放空間。
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import metrics
+
+SCRATCH_ENV = 'YT_TRANSPOSE_SCRATCH'
+
+# 每個目錄保留的最低剩餘空間，避免把系統磁碟完全寫滿
+MIN_FREE_BYTES = 256 * 1024 * 1024
+
+# 無法取得長度時假設的影片長度（秒）
+DEFAULT_DURATION = 600
+
+# 壓縮音訊的估算位元率（bit/s）：下載的原始音訊與轉出的 MP3
+SOURCE_BITRATE = 320000
+MP3_BITRATE = 192000
+
+# 等待空間釋放時重新檢查的間隔（秒），也涵蓋其他行程釋放的空間
+WAIT_INTERVAL = 2.0
+
+
+def get_scratch_dirs():
+    """取得候選暫存目錄（依優先順序）"""
+    value = os.environ.get(SCRATCH_ENV, '').strip()
+    dirs = [d for d in value.split(os.pathsep) if d.strip()] if value else []
+    if not dirs:
+        dirs = [tempfile.gettempdir()]
+    return dirs
+
+
+def estimate_scratch_bytes(duration=None, samplerate=48000, channels=2, needs_processing=True):
+    """估算單一工作所需的暫存空間（位元組）"""
+    if not duration or duration <= 0:
+        duration = DEFAULT_DURATION
+    # 下載的原始音訊與轉出的 MP3 可能同時存在
+    compressed = duration * (SOURCE_BITRATE + MP3_BITRATE) / 8
+    total = compressed
+    if needs_processing:
+        # soundstretch 的輸入與輸出 WAV（16-bit PCM）加上處理後的 MP3
+        wav = duration * samplerate * channels * 2
+        total += 2 * wav + duration * MP3_BITRATE / 8
+    # 預留 10% 與 16MB 的誤差空間
+    return int(total * 1.1) + 16 * 1024 * 1024
+
+
+def _dir_size(path):
+    """目錄中所有檔案的大小總和（讀取失敗的檔案略過）"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ScratchReservation:
+    """一個工作在某個暫存目錄中的空間預約"""
+
+    def __init__(self, manager, base_dir, size):
+        self.manager = manager
+        self.base_dir = base_dir
+        self.size = size
+        self.path = None
+        self.tracked = []
+
+    def create_dir(self, prefix='yt_transpose_'):
+        """在預約的位置建立工作目錄"""
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=self.base_dir)
+        return self.path
+
+    def track(self, path):
+        """登記工作寫入的其他目錄（不會在釋放時刪除），其中的檔案計入已寫入的空間"""
+        self.tracked.append(path)
+
+    def outstanding(self):
+        """預約中工作尚未寫入的部分；已寫入的檔案已經反映在磁碟剩餘空間中"""
+        written = sum(_dir_size(path) for path in [self.path, *self.tracked] if path)
+        return max(0, self.size - written)
+
+    def release(self):
+        """清理工作目錄並釋放預約的空間"""
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+        self.manager._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class PendingScratch:
+    """排隊中的暫存空間預約
+
+    poll() 不阻塞：空間足夠時回傳 ScratchReservation，否則回傳 None（逾時則拋出例外）；
+    wait() 在目前執行緒等待。非同步執行端在事件迴圈中定期 poll()，等待中不佔用執行緒。
+    """
+
+    def __init__(self, manager, size, progress_callback=None, timeout=None):
+        self.manager = manager
+        self.size = size
+        self.progress_callback = progress_callback
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self._queued = False
+
+    def poll(self):
+        reservation = self.manager.try_reserve(self.size)
+        if reservation is not None:
+            self.cancel()
+            return reservation
+        if not self._queued:
+            msg = f"Waiting for scratch space ({self.size / 1024 ** 2:.0f} MB)..."
+            if self.progress_callback:
+                self.progress_callback(0, msg)
+            print(msg)
+            self._queued = True
+            # 排隊等待暫存空間的工作數
+            metrics.queue_depth().inc(queue='scratch')
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel()
+            raise Exception(f"Timed out waiting for {self.size / 1024 ** 2:.0f} MB of scratch space")
+        return None
+
+    def wait(self):
+        try:
+            while True:
+                reservation = self.poll()
+                if reservation is not None:
+                    return reservation
+                wait = WAIT_INTERVAL
+                if self.deadline is not None:
+                    wait = max(0, min(wait, self.deadline - time.monotonic()))
+                with self.manager._cond:
+                    self.manager._cond.wait(wait)
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        if self._queued:
+            self._queued = False
+            metrics.queue_depth().dec(queue='scratch')
+
+
+class ScratchManager:
+    """追蹤行程內各暫存目錄已預約的空間，分配或排隊等待"""
+
+    def __init__(self, dirs=None, min_free=MIN_FREE_BYTES):
+        self.dirs = list(dirs) if dirs else get_scratch_dirs()
+        self.min_free = min_free
+        self._reservations = {d: [] for d in self.dirs}
+        self._cond = threading.Condition()
+
+    def _available(self, base_dir):
+        try:
+            os.makedirs(base_dir, exist_ok=True)
+            free = shutil.disk_usage(base_dir).free
+        except OSError:
+            return -1
+        # 只扣除各預約尚未寫入的部分，避免與已寫入（已佔用剩餘空間）的檔案重複計算
+        pending = sum(r.outstanding() for r in self._reservations.get(base_dir, []))
+        return free - pending - self.min_free
+
+    def _capacity(self, base_dir):
+        try:
+            return shutil.disk_usage(base_dir).total - self.min_free
+        except OSError:
+            return -1
+
+    def try_reserve(self, size):
+        """立即嘗試預約，沒有放得下的目錄時回傳 None"""
+        with self._cond:
+            for base_dir in self.dirs:
+                if self._available(base_dir) >= size:
+                    reservation = ScratchReservation(self, base_dir, size)
+                    self._reservations.setdefault(base_dir, []).append(reservation)
+                    return reservation
+        return None
+
+    def request(self, size, progress_callback=None, timeout=None):
+        """建立暫存空間的預約請求（PendingScratch），可 poll() 嘗試預約或 wait() 等待"""
+        if all(self._capacity(d) < size for d in self.dirs):
+            raise Exception(
+                f"Not enough scratch space: job needs {size / 1024 ** 2:.0f} MB, "
+                f"but no scratch directory is that large ({', '.join(self.dirs)}). "
+                f"Set {SCRATCH_ENV} to a larger location."
+            )
+        return PendingScratch(self, size, progress_callback, timeout)
+
+    def reserve(self, size, progress_callback=None, timeout=None):
+        """預約暫存空間，空間不足時排隊等待其他工作釋放"""
+        return self.request(size, progress_callback, timeout).wait()
+
+    def _release(self, reservation):
+        with self._cond:
+            reservations = self._reservations.get(reservation.base_dir, [])
+            if reservation in reservations:
+                reservations.remove(reservation)
+            self._cond.notify_all()
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_scratch_manager():
+    """取得行程內共用的暫存空間管理器"""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = ScratchManager()
+        return _default_manager
@@ -0,0 +1,261 @@
+"""來源音訊快取
+
+下載的原始音訊（壓縮格式）以影片 ID 為鍵保存，同一部影片以不同參數重新處理、
+或先在 GUI 載入波形再開始處理時都不必再下載。衍生資料（例如波形峰值檔）
+放在快取檔旁邊，隨來源一起淘汰。
+
+每個項目記錄下載時的目標品質（kbps）：較低品質的來源（例如草稿預設）
+不會被用在需要較高品質的輸出上。無損輸出（FLAC/WAV）的目標品質為 None，
+表示需要最佳來源：只有同樣以最佳品質下載（記錄為 BEST_KBPS）的來源才會被使用。
+
+啟用重複來源偵測（fingerprint.py）時，加入快取的來源同時計算音訊指紋，
+供辨識不同影片 ID 的相同內容；未啟用時不解碼、不建立指紋索引。
+
+可用環境變數設定：
+    YT_TRANSPOSE_SOURCE_CACHE=0        停用快取
+    YT_TRANSPOSE_SOURCE_CACHE_MB=2048  快取容量上限（MB），超過時淘汰最久未使用的項目
+"""
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_MB = 2048
+
+# 以最佳品質（bestaudio）下載的來源記錄的品質，可用於任何輸出
+BEST_KBPS = 1 << 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    kbps INTEGER NOT NULL,
+    title TEXT,
+    duration REAL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sources_lru ON sources (last_used);
+"""
+
+
+def is_source_cache_enabled():
+    return os.environ.get('YT_TRANSPOSE_SOURCE_CACHE', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+class SourceCache:
+    """以 SQLite 為索引的來源音訊快取"""
+
+    def __init__(self, root=None, max_bytes=None):
+        if root is None:
+            from transposer_core import get_cache_dir
+            root = get_cache_dir('sources')
+        if max_bytes is None:
+            try:
+                max_bytes = int(float(os.environ.get('YT_TRANSPOSE_SOURCE_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+            except ValueError:
+                max_bytes = DEFAULT_MAX_MB * 1024 * 1024
+        self.root = root
+        self.store_dir = os.path.join(root, 'store')
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, 'index.db')
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def lookup(self, source_id, min_kbps=0):
+        """查詢快取，命中且品質足夠時回傳快取檔路徑，否則回傳 None
+
+        min_kbps 為 None（無損輸出）時需要以最佳品質下載的來源。
+        """
+        if min_kbps is None:
+            min_kbps = BEST_KBPS
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT path, size, kbps FROM sources WHERE source_id = ?", (source_id,)).fetchone()
+                if row is None:
+                    return None
+                try:
+                    valid = os.path.getsize(row['path']) == row['size']
+                except OSError:
+                    valid = False
+                if not valid:
+                    self._forget(conn, source_id)
+                    return None
+                if row['kbps'] < min_kbps:
+                    return None
+                with conn:
+                    conn.execute("UPDATE sources SET last_used = ?, hits = hits + 1 WHERE source_id = ?",
+                                 (time.time(), source_id))
+                return row['path']
+            finally:
+                conn.close()
+
+    def lookup_info(self, source_id):
+        """已快取來源記錄的影片資訊（title、duration），沒有時回傳 None"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT title, duration FROM sources WHERE source_id = ?", (source_id,)).fetchone()
+            finally:
+                conn.close()
+        if row is None or not row['title']:
+            return None
+        return {'title': row['title'], 'duration': row['duration']}
+
+    def store(self, source_id, path, kbps=0, title=None, duration=None, dedupe=None):
+        """將下載的來源加入快取（硬連結，跨檔案系統時複製），回傳快取檔路徑
+
+        kbps 為下載時的目標品質，None 表示以最佳品質下載。
+        dedupe 為 None 時依環境變數 YT_TRANSPOSE_DEDUPE 決定是否計算指紋。
+        """
+        kbps = BEST_KBPS if kbps is None else int(kbps)
+        from render_cache import link_or_copy, make_cache_key
+        key = make_cache_key(source_id, {}, 'source')
+        shard = os.path.join(self.store_dir, key[:2])
+        os.makedirs(shard, exist_ok=True)
+        cached_path = os.path.join(shard, key + os.path.splitext(path)[1].lower())
+        # 取代舊項目時一併移除舊的衍生資料
+        self._remove_files(os.path.join(shard, key))
+        link_or_copy(path, cached_path)
+        size = os.path.getsize(cached_path)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO sources (source_id, path, size, kbps, title, duration, created, last_used, hits) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                        (source_id, cached_path, size, kbps, title, duration, now, now),
+                    )
+                self._evict(conn)
+            finally:
+                conn.close()
+        try:
+            import fingerprint
+            if fingerprint.is_dedupe_enabled(dedupe):
+                fingerprint.index_source(source_id, cached_path, duration)
+        except ImportError:
+            pass
+        except Exception as e:
+            # 指紋只用於辨識重複來源，失敗不影響快取
+            print(f"Warning: failed to fingerprint source: {e}")
+        return cached_path
+
+    def _forget(self, conn, source_id):
+        with conn:
+            conn.execute("DELETE FROM sources WHERE source_id = ?", (source_id,))
+        try:
+            import fingerprint
+            fingerprint.get_fingerprint_index().remove(source_id)
+        except ImportError:
+            pass
+
+    def _remove_files(self, base):
+        # 快取檔與放在旁邊的衍生資料（例如 .peaks）
+        for path in glob.glob(glob.escape(base) + '*'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self, conn):
+        """超過容量上限時，依最久未使用的順序淘汰"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM sources").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT source_id, path, size FROM sources ORDER BY last_used").fetchall()
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            self._remove_files(os.path.splitext(row['path'])[0])
+            self._forget(conn, row['source_id'])
+            total -= row['size']
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_source_cache():
+    """取得行程內共用的來源快取"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SourceCache()
+        return _default_cache
+
+
+def fetch_source(url, progress_callback=None, output_format='mp3'):
+    """取得影片的來源音訊（快取命中時不需下載），回傳快取檔路徑
+
+    供 GUI 載入波形等預覽使用；之後以相同或較低品質需求處理同一部影片時會直接使用這份來源。
+    """
+    from render_cache import get_source_id
+    from format_policy import get_target_kbps, select_audio_format, build_format_spec
+    from resume import acquire_partial_dir, iter_completed_files, retry_with_backoff
+    from metadata_cache import get_video_info
+    from ytdl_pool import get_ytdl_pool
+
+    cache = get_source_cache()
+    source_id = get_source_id(url)
+    target_kbps = get_target_kbps(output_format)
+    cached = cache.lookup(source_id, target_kbps)
+    if cached:
+        return cached
+
+    if progress_callback:
+        progress_callback(0, "Getting video title...")
+    info, _ = get_video_info(url)
+    from transposer_core import find_duplicate_cached_source
+    cached = find_duplicate_cached_source(cache, source_id, info, target_kbps, progress_callback=progress_callback)
+    if cached:
+        return cached
+    if info.get('formats'):
+        chosen_format, _ = select_audio_format(info['formats'], target_kbps, False, info.get('duration'))
+        format_spec = chosen_format['format_id']
+    else:
+        format_spec = build_format_spec(target_kbps)
+
+    def report(d):
+        if progress_callback and d.get('status') == 'downloading':
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                progress_callback(min(99.0, d.get('downloaded_bytes', 0) * 100.0 / total),
+                                  f"Downloading: {info.get('title', '')}")
+
+    partial = acquire_partial_dir(info.get('id') or source_id, format_spec)
+    ydl_opts = {
+        'format': format_spec,
+        'outtmpl': os.path.join(partial.path, 'source.%(ext)s'),
+        'continuedl': True,
+        'postprocessors': [],
+        'progress_hooks': [report],
+    }
+
+    def download_attempt():
+        with get_ytdl_pool().session(**ydl_opts) as ydl:
+            ydl.process_ie_result(info, download=True)
+
+    try:
+        retry_with_backoff(download_attempt)
+        completed = list(iter_completed_files(partial.path))
+        if not completed:
+            raise Exception(f"Download failed: no audio file for {url}")
+        cached = cache.store(source_id, completed[0], target_kbps, info.get('title'), info.get('duration'))
+        partial.release(remove=True)
+    finally:
+        # 失敗時保留續傳目錄中的 .part 檔
+        partial.release()
+    return cached
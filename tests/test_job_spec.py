@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_spec import iter_job_specs
+
+FULL_JOB = {
+    'url': 'https://youtu.be/dQw4w9WgXcQ', 'semitones': -2.5, 'tempo': 10, 'loudness': -14,
+    'start': '1:30', 'end': 120, 'loop': 2, 'output_dir': 'out', 'format': 'FLAC', 'preset': 'draft',
+    'mono': True, 'samplerate': 22050, 'backend': 'ffmpeg', 'allow_video_fallback': True,
+    'use_cache': False, 'dedupe': True, 'progressive': False, 'priority': 3, 'id': 'job-1',
+}
+
+
+def parse(tmp_path, *jobs):
+    path = tmp_path / 'jobs.jsonl'
+    path.write_text('\n'.join(json.dumps(job) for job in jobs) + '\n', encoding='utf-8')
+    return list(iter_job_specs(str(path)))
+
+
+def test_full_featured_line(tmp_path):
+    [(line_no, job, error)] = parse(tmp_path, FULL_JOB)
+    assert error is None
+    kwargs = job.to_kwargs()
+    assert kwargs['output_format'] == 'flac'
+    assert kwargs['start'] == 90 and kwargs['end'] == 120
+    assert kwargs['channels'] == 1 and kwargs['samplerate'] == 22050
+    assert kwargs['backend'] == 'ffmpeg'
+    assert kwargs['allow_video_fallback'] is True
+    assert kwargs['use_cache'] is False
+    assert kwargs['dedupe'] is True
+    assert kwargs['progressive'] is False
+    # to_dict 可再次解析為相同的工作（worker 佇列以此格式保存）
+    [(_, again, error)] = parse(tmp_path, job.to_dict())
+    assert error is None
+    assert again.to_kwargs() == kwargs
+
+
+def test_invalid_line(tmp_path):
+    invalid = dict(FULL_JOB, backend='sox', dedupe='yes', typo=1)
+    [(line_no, job, error)] = parse(tmp_path, invalid)
+    assert job is None
+    assert "'backend' must be one of" in error
+    assert "'dedupe' must be true or false" in error
+    assert 'unknown field(s): typo' in error
@@ -0,0 +1,61 @@
+import os
+import struct
+import subprocess
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+resource = pytest.importorskip('resource')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLERATE = 8000
+
+# 在獨立行程中執行峰值量測與逐區塊讀取，回傳該行程的最大常駐記憶體（KB）
+MEASURE_SCRIPT = """
+import resource, sys
+import numpy as np
+import pcm_io
+path = sys.argv[1]
+peak = pcm_io.measure_peak(path)
+total = 0.0
+for _, block in pcm_io.iter_wav_blocks(path):
+    total += float(np.sum(pcm_io.to_float(block, block.dtype)))
+print(peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def write_wav(path, seconds, chunk_frames=SAMPLERATE * 60):
+    """逐段寫出 16-bit 單聲道的正弦波 WAV，不在記憶體中保留整個檔案"""
+    frames = seconds * SAMPLERATE
+    data_size = frames * 2
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE',
+                            b'fmt ', 16, 1, 1, SAMPLERATE, SAMPLERATE * 2, 2, 16, b'data', data_size))
+        written = 0
+        while written < frames:
+            count = min(chunk_frames, frames - written)
+            t = np.arange(written, written + count) / SAMPLERATE
+            f.write((np.sin(2 * np.pi * 440 * t) * 16000).astype('<i2').tobytes())
+            written += count
+
+
+def measure(path):
+    result = subprocess.run([sys.executable, '-c', MEASURE_SCRIPT, path], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    peak, max_rss = result.stdout.split()
+    return float(peak), int(max_rss)
+
+
+def test_block_path_memory_does_not_grow_with_length(tmp_path):
+    short_path = str(tmp_path / 'short.wav')
+    long_path = str(tmp_path / 'long.wav')
+    write_wav(short_path, 60)
+    write_wav(long_path, 60 * 60)
+    short_peak, short_rss = measure(short_path)
+    long_peak, long_rss = measure(long_path)
+    assert short_peak == pytest.approx(16000 / 32768, abs=1e-3)
+    assert long_peak == pytest.approx(short_peak, abs=1e-3)
+    # 60 倍長的檔案（約 55 MB）：常駐記憶體只容許區塊大小等級的差距
+    assert long_rss - short_rss < 8 * 1024
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import peaks
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="uses an executable script as ffmpeg")
+
+# 假的 ffmpeg：先寫出遠超過管線緩衝區的 stderr，再輸出 PCM；結束碼由參數決定
+FAKE_FFMPEG = """#!{python}
+import sys
+sys.stderr.write("warning: corrupt frame\\n" * 50000)
+sys.stderr.flush()
+sys.stdout.buffer.write(b"\\x00\\x10" * {samples})
+sys.exit({code})
+"""
+
+
+def make_ffmpeg(tmp_path, monkeypatch, code=0, samples=8000 * 10):
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable, samples=samples, code=code))
+    path.chmod(0o755)
+    monkeypatch.setattr(peaks, 'get_ffmpeg', lambda: str(path))
+
+
+def test_noisy_stderr_does_not_block_decoding(tmp_path, monkeypatch):
+    make_ffmpeg(tmp_path, monkeypatch)
+    result = peaks.compute_peaks(str(tmp_path / 'song.webm'), samplerate=8000)
+    assert result.duration == pytest.approx(10.0)
+
+
+def test_decode_failure_reports_stderr_tail(tmp_path, monkeypatch):
+    make_ffmpeg(tmp_path, monkeypatch, code=1)
+    with pytest.raises(Exception, match='corrupt frame'):
+        peaks.compute_peaks(str(tmp_path / 'song.webm'), samplerate=8000)
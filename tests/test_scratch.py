@@ -0,0 +1,62 @@
+import collections
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import scratch
+from scratch import ScratchManager
+
+MB = 1024 * 1024
+DiskUsage = collections.namedtuple('DiskUsage', 'total used free')
+
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    """模擬 100 MB 的磁碟：已寫入的檔案會減少剩餘空間"""
+    base = tmp_path / 'scratch'
+    base.mkdir()
+
+    def disk_usage(path):
+        used = scratch._dir_size(str(base))
+        return DiskUsage(100 * MB, used, 100 * MB - used)
+
+    monkeypatch.setattr(scratch.shutil, 'disk_usage', disk_usage)
+    return str(base)
+
+
+def write(path, size):
+    with open(os.path.join(path, 'data.bin'), 'wb') as f:
+        f.write(b'\0' * size)
+
+
+def test_written_files_are_not_counted_twice(disk):
+    manager = ScratchManager(dirs=[disk], min_free=0)
+    first = manager.try_reserve(60 * MB)
+    assert first is not None
+    assert manager.try_reserve(60 * MB) is None
+    # 工作寫入 50 MB 後只剩 10 MB 尚未寫入：剩餘 50 MB 中有 40 MB 可再預約
+    write(first.create_dir(), 50 * MB)
+    assert first.outstanding() == 10 * MB
+    assert manager.try_reserve(50 * MB) is None
+    second = manager.try_reserve(40 * MB)
+    assert second is not None
+    second.release()
+    first.release()
+    assert manager.try_reserve(100 * MB) is not None
+
+
+def test_tracked_dir_counts_as_written(disk, tmp_path):
+    manager = ScratchManager(dirs=[disk], min_free=0)
+    reservation = manager.try_reserve(80 * MB)
+    partial = os.path.join(disk, 'partial')
+    os.makedirs(partial)
+    reservation.track(partial)
+    write(partial, 30 * MB)
+    assert reservation.outstanding() == 50 * MB
+    assert manager.try_reserve(20 * MB) is not None
+    # 登記的目錄不屬於預約，釋放時不會刪除
+    reservation.release()
+    assert os.path.exists(os.path.join(partial, 'data.bin'))
@@ -0,0 +1,59 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from format_policy import get_target_kbps
+from source_cache import SourceCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('YT_TRANSPOSE_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('YT_TRANSPOSE_DEDUPE', '0')
+    return SourceCache(root=str(tmp_path / 'sources'))
+
+
+def make_source(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'audio' * 100)
+    return str(path)
+
+
+def test_lossless_output_uses_best_quality_source(cache, tmp_path):
+    # 無損輸出的目標品質為 None：以最佳品質下載的來源可直接使用
+    assert get_target_kbps('flac') is None
+    cache.store('yt:best', make_source(tmp_path, 'best.webm'), get_target_kbps('flac'))
+    assert cache.lookup('yt:best', get_target_kbps('flac')) is not None
+    assert cache.lookup('yt:best', get_target_kbps('wav')) is not None
+    assert cache.lookup('yt:best', get_target_kbps('mp3')) is not None
+
+
+def test_lossless_output_skips_lower_quality_source(cache, tmp_path):
+    cache.store('yt:mp3', make_source(tmp_path, 'mp3.webm'), get_target_kbps('mp3'))
+    assert cache.lookup('yt:mp3', get_target_kbps('mp3')) is not None
+    assert cache.lookup('yt:mp3', get_target_kbps('flac')) is None
+
+
+def test_store_fingerprints_only_when_dedupe_enabled(cache, tmp_path, monkeypatch):
+    import fingerprint
+    indexed = []
+    monkeypatch.setattr(fingerprint, 'index_source', lambda source_id, path, duration=None: indexed.append(source_id))
+    cache.store('yt:a', make_source(tmp_path, 'a.webm'), 192)
+    assert indexed == []
+    cache.store('yt:b', make_source(tmp_path, 'b.webm'), 192, dedupe=True)
+    assert indexed == ['yt:b']
+
+
+def test_core_path_does_not_cache_mp3_intermediate_as_best(cache, tmp_path):
+    from transposer_core import store_cached_source
+    info = {'title': 'song', 'duration': 1.0}
+    # 不需處理的 FLAC 輸出：快取的是統一轉換的 MP3，不能再用於無損輸出
+    store_cached_source(cache, 'yt:mp3', make_source(tmp_path, 'song.mp3'), 'flac', info, transcoded=True)
+    assert cache.lookup('yt:mp3', get_target_kbps('flac')) is None
+    assert cache.lookup('yt:mp3', get_target_kbps('mp3')) is not None
+    # 需要處理時快取的是原始下載檔
+    store_cached_source(cache, 'yt:raw', make_source(tmp_path, 'song.webm'), 'flac', info)
+    assert cache.lookup('yt:raw', get_target_kbps('flac')) is not None
@@ -0,0 +1,134 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from job_queue import JobQueue
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="uses SIGKILL")
+
+# 以真正的 worker.run_worker 執行，只把 download_and_transpose 換成不需網路的快速版本：
+# 依網址最後的名稱寫出輸出檔；名稱含 slow 的工作第一次執行時會卡住（供測試中途 SIGKILL）
+WORKER_SCRIPT = """
+import os, sys, time
+import transposer_core, worker
+queue_path, markers, worker_id, lease = sys.argv[1:5]
+
+def fake_download_and_transpose(url, semitones, output_dir=None, **kwargs):
+    name = url.rsplit('=', 1)[-1]
+    marker = os.path.join(markers, name)
+    first = not os.path.exists(marker)
+    with open(marker, 'a') as f:
+        f.write(worker_id + '\\n')
+    if 'slow' in name and first:
+        time.sleep(600)
+    time.sleep(0.05)
+    path = os.path.join(output_dir, name + '.mp3')
+    with open(path, 'w') as f:
+        f.write(worker_id)
+    return path
+
+transposer_core.download_and_transpose = fake_download_and_transpose
+worker.POLL_INTERVAL = 0.2
+worker.run_worker(queue_path, worker_id, lease_seconds=float(lease), exit_when_empty=True)
+"""
+
+
+def start_workers(tmp_path, queue_path, count, lease=60):
+    markers = tmp_path / 'markers'
+    markers.mkdir(exist_ok=True)
+    workers = {}
+    for i in range(count):
+        worker_id = f"w{i}"
+        log = open(tmp_path / f"{worker_id}.log", 'w')
+        workers[worker_id] = subprocess.Popen(
+            [sys.executable, '-u', '-c', WORKER_SCRIPT, str(queue_path), str(markers), worker_id, str(lease)],
+            cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+    return workers
+
+
+def wait_all(workers, timeout=60):
+    deadline = time.monotonic() + timeout
+    for process in workers.values():
+        try:
+            process.wait(timeout=max(0.1, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            for p in workers.values():
+                p.kill()
+            pytest.fail("workers did not finish")
+
+
+def published(tmp_path, worker_ids):
+    lines = []
+    for worker_id in worker_ids:
+        with open(tmp_path / f"{worker_id}.log") as f:
+            lines += [line for line in f if 'Published:' in line]
+    return lines
+
+
+def enqueue(queue_path, out_dir, names):
+    queue = JobQueue(str(queue_path))
+    for name in names:
+        queue.enqueue({'url': f"https://www.youtube.com/watch?v={name}", 'semitones': 0, 'output_dir': str(out_dir)})
+    return queue
+
+
+def test_each_job_is_published_once(tmp_path):
+    queue_path = tmp_path / 'queue.db'
+    out_dir = tmp_path / 'out'
+    names = [f"job{i:02d}" for i in range(30)]
+    queue = enqueue(queue_path, out_dir, names)
+    workers = start_workers(tmp_path, queue_path, 3)
+    wait_all(workers)
+
+    assert queue.counts()['done'] == len(names)
+    assert sorted(os.listdir(out_dir)) == sorted([f"{name}.mp3" for name in names] + ['.staging'])
+    assert os.listdir(out_dir / '.staging') == []
+    lines = published(tmp_path, workers)
+    assert len(lines) == len(names)
+    # 多個 worker 都有分到工作
+    assert sum(1 for worker_id in workers if any(line.startswith(f"[{worker_id}]") for line in lines)) > 1
+
+
+def test_killed_worker_job_is_requeued_after_lease_expires(tmp_path):
+    queue_path = tmp_path / 'queue.db'
+    out_dir = tmp_path / 'out'
+    names = ['slow0'] + [f"job{i:02d}" for i in range(5)]
+    queue = enqueue(queue_path, out_dir, names)
+    workers = start_workers(tmp_path, queue_path, 3, lease=2)
+
+    # 等到某個 worker 開始處理 slow0，在租約期間將它 SIGKILL
+    marker = tmp_path / 'markers' / 'slow0'
+    deadline = time.monotonic() + 30
+    while not marker.exists() or not marker.read_text().strip():
+        assert time.monotonic() < deadline, "slow job was never claimed"
+        time.sleep(0.05)
+    victim = marker.read_text().split()[0]
+    workers[victim].send_signal(signal.SIGKILL)
+    workers[victim].wait()
+    killed_at = time.monotonic()
+
+    survivors = {worker_id: p for worker_id, p in workers.items() if worker_id != victim}
+    while len(marker.read_text().split()) < 2:
+        assert time.monotonic() - killed_at < 30, "job was not requeued"
+        time.sleep(0.05)
+    requeued_after = time.monotonic() - killed_at
+    wait_all(survivors)
+
+    assert queue.counts()['done'] == len(names)
+    attempts = marker.read_text().split()
+    assert len(attempts) == 2 and attempts[0] == victim and attempts[1] != victim
+    # 最後一次 heartbeat 最多在 SIGKILL 前 1 秒，要等 2 秒的租約到期才會被其他 worker 接手
+    assert requeued_after >= 0.9
+    with sqlite3.connect(str(queue_path)) as conn:
+        assert conn.execute("SELECT attempts FROM jobs WHERE spec LIKE '%slow0%'").fetchone()[0] == 2
+    assert (out_dir / 'slow0.mp3').read_text() == attempts[1]
+    assert len(published(tmp_path, workers)) == len(names)
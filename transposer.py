@@ -1,10 +1,113 @@
+import argparse
+import os
 import sys
-from transposer_core import download_and_transpose
+from transposer_core import download_and_transpose, get_default_output_dir, OUTPUT_FORMATS
+from backends import BACKENDS
+from presets import PRESETS
+from profiling import profiled, is_profiling_enabled
+from local_input import is_local_input, process_local_inputs
 
-if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python transposer.py <YouTube_URL> <semitones>")
-        print("Example: python transposer.py https://youtu.be/xxxx -2")
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Download YouTube audio (or read local files) and transpose it",
+        epilog="Examples: python transposer.py https://youtu.be/xxxx -2 --start 1:30 --end 2:00 --loop 4\n"
+               "          python transposer.py ~/Music/recordings -2 --output-dir ~/practice --workers 4",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("url", help="YouTube URL, or a local audio file or folder (processed recursively)")
+    parser.add_argument("semitones", type=float, help="semitones to transpose (may be fractional)")
+    parser.add_argument("--tempo", type=float, help="tempo change in percent (pitch unchanged)")
+    parser.add_argument("--rate", type=float, help="rate change in percent (tempo and pitch)")
+    parser.add_argument("--bpm", type=float, help="target BPM")
+    parser.add_argument("--loudness", type=float, help="target integrated loudness in LUFS, e.g. -14")
+    parser.add_argument("--format", dest="output_format", default="mp3", choices=list(OUTPUT_FORMATS), help="output format")
+    parser.add_argument("--start", help="start of the section to process (seconds or mm:ss)")
+    parser.add_argument("--end", help="end of the section to process (seconds or mm:ss)")
+    parser.add_argument("--loop", type=int, default=1, help="repeat the rendered section N times")
+    parser.add_argument("--preset", choices=list(PRESETS), help="speed/quality preset (default: standard, or YT_TRANSPOSE_PRESET)")
+    parser.add_argument("--mono", action="store_true", help="downmix to mono before processing (practice tracks)")
+    parser.add_argument("--samplerate", type=int, help="process and encode at this sample rate, e.g. 22050")
+    parser.add_argument("--backend", choices=["auto", *BACKENDS], help="processing backend (default: auto, or YT_TRANSPOSE_BACKEND)")
+    parser.add_argument("--profile", action="store_true", default=None,
+                        help="write cProfile/tracemalloc reports next to the output (or set YT_TRANSPOSE_PROFILE=1)")
+    parser.add_argument("--output-dir", help="output directory (default: Downloads)")
+    parser.add_argument("--progressive", action="store_true", default=None,
+                        help="write the output in place while rendering so playback can start early (or set YT_TRANSPOSE_PROGRESSIVE=1)")
+    parser.add_argument("--dedupe", action="store_true", default=None,
+                        help="reuse a cached source with identical audio (re-uploads) instead of downloading (or set YT_TRANSPOSE_DEDUPE=1)")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="run in this process even if the background daemon (daemon.py) is running")
+    local = parser.add_argument_group("local files and folders")
+    local.add_argument("--workers", type=int, help="files processed in parallel (default: CPU count, or YT_TRANSPOSE_LOCAL_WORKERS)")
+    local.add_argument("--force", action="store_true", help="reprocess inputs even if unchanged since the last run")
+    local.add_argument("--verify-hash", action="store_true",
+                       help="when a file's mtime changed but its size did not, compare content hashes before reprocessing")
+    return parser
+
+def get_render_kwargs(args):
+    return dict(
+        tempo=args.tempo, rate=args.rate, bpm=args.bpm,
+        loudness=args.loudness,
+        output_format=args.output_format, loop=args.loop,
+        backend=args.backend, preset=args.preset,
+        channels=1 if args.mono else None, samplerate=args.samplerate,
+    )
+
+def print_progress(progress, message):
+    print(f"[{progress:5.1f}%] {message}" if progress is not None else message)
+
+def print_file_progress(done, message):
+    # 本機資料夾模式的進度為已完成的檔案數
+    print(f"[{done}] {message}")
+
+def submit_to_daemon(op, kwargs, args, progress_callback=print_progress):
+    """有常駐服務時交給服務執行（分析模式一律在本行程執行），回傳 (是否已處理, 結果)"""
+    # --profile 或 YT_TRANSPOSE_PROFILE=1：報告需在本行程量測
+    if is_profiling_enabled(args.profile) or args.no_daemon:
+        return False, None
+    import daemon
+    return daemon.submit(op, kwargs, progress_callback)
+
+def run_local(args):
+    if args.start or args.end:
+        print("Error: --start/--end are only supported for URLs")
+        sys.exit(2)
+    # 服務的工作目錄不同，路徑一律以絕對路徑傳送
+    kwargs = dict(
+        paths=[os.path.abspath(args.url)], semitones=args.semitones,
+        output_dir=os.path.abspath(args.output_dir or get_default_output_dir()), workers=args.workers,
+        incremental=not args.force, verify='hash' if args.verify_hash else 'mtime',
+        **get_render_kwargs(args),
+    )
+    handled, result = submit_to_daemon('local', kwargs, args, print_file_progress)
+    if handled:
+        processed, skipped, failed = result
+        print(f"Local input: {processed} processed, {skipped} skipped (unchanged), {failed} failed")
+    else:
+        processed, skipped, failed = process_local_inputs(**kwargs)
+    if failed:
+        sys.exit(1)
+
+def run_url(args):
+    kwargs = dict(
+        url=args.url, semitones=args.semitones,
+        output_dir=os.path.abspath(args.output_dir or get_default_output_dir()),
+        start=args.start, end=args.end, dedupe=args.dedupe, progressive=args.progressive,
+        **get_render_kwargs(args),
+    )
+    try:
+        handled, result = submit_to_daemon('transpose', kwargs, args)
+    except Exception as e:
+        print(f"Error: {e}")
         sys.exit(1)
-    
-    download_and_transpose(sys.argv[1], int(sys.argv[2]))
+    if handled:
+        print(f"Completed: {result}")
+        return
+    profiled(download_and_transpose, enabled=args.profile, **kwargs)
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    if is_local_input(args.url):
+        run_local(args)
+    else:
+        run_url(args)
@@ -1,4 +1,5 @@
-import subprocess, os, re, shutil, sys, tempfile
+import subprocess, os, re, shutil, sys, tempfile, math
+import metrics
 
 # Windows 上隱藏 subprocess 視窗的輔助函數
 def get_subprocess_kwargs():
@@ -78,6 +79,21 @@ def get_ffmpeg():
     
     return None
 
+def get_yt_dlp_command():
+    """無法導入 yt_dlp 時使用的 yt-dlp 命令列（回傳參數清單）"""
+    if getattr(sys, 'frozen', False):
+        # 打包環境：嘗試查找系統中的 yt-dlp 或 yt_dlp
+        yt_dlp_cmd = shutil.which('yt-dlp') or shutil.which('yt_dlp')
+        if yt_dlp_cmd:
+            return [yt_dlp_cmd]
+        # 最後備選：使用 Python（需要系統安裝 Python）
+        python_cmd = shutil.which('python') or shutil.which('py')
+        if python_cmd:
+            return [python_cmd, "-m", "yt_dlp"]
+        raise Exception("無法找到 yt-dlp。請確保已安裝 yt-dlp：pip install yt-dlp")
+    # 開發環境：使用 Python 模組模式
+    return [sys.executable, "-m", "yt_dlp"]
+
 def get_soundstretch():
     """取得 soundstretch 執行檔路徑"""
     # 在 Windows 上可能是 soundstretch.exe
@@ -134,6 +150,63 @@ def get_samplerate(path):
     # 如果偵測失敗，預設使用 48000
     return 48000
 
+def get_duration(path):
+    """取得音訊檔案的長度（秒），偵測失敗時回傳 None"""
+    ff = get_ffmpeg()
+    if not ff:
+        return None
+    result = subprocess.run(
+        [ff, "-i", path, "-hide_banner"],
+        capture_output=True, text=True, encoding='utf-8', errors='ignore',
+        **get_subprocess_kwargs()
+    )
+    # ffmpeg 在 stderr 中顯示 "Duration: 00:03:12.34"
+    match = re.search(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr or '')
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+# 響度正規化的增益上限（dB），避免將接近靜音的音檔放大成噪音
+MAX_LOUDNESS_GAIN_DB = 20.0
+
+def parse_integrated_loudness(ffmpeg_stderr):
+    """從 ffmpeg ebur128 濾鏡的摘要輸出中解析整合響度（LUFS）"""
+    if not ffmpeg_stderr:
+        return None
+    # 摘要在輸出最後，取最後一個 "I: xx LUFS" 即為整合響度
+    matches = re.findall(r'I:\s+(-?\d+(?:\.\d+)?)\s+LUFS', ffmpeg_stderr)
+    if not matches:
+        return None
+    return float(matches[-1])
+
+def get_loudness_gain(measured_lufs, target_lufs):
+    """計算將測得響度調整到目標響度所需的增益（dB）"""
+    if measured_lufs is None or measured_lufs <= -70.0:
+        # 無法測量或幾乎靜音時不調整
+        return 0.0
+    gain = target_lufs - measured_lufs
+    return max(-MAX_LOUDNESS_GAIN_DB, min(MAX_LOUDNESS_GAIN_DB, gain))
+
+# 響度增益套用後允許的最高取樣峰值（dBFS）
+LOUDNESS_PEAK_CEILING_DB = -1.0
+
+def limit_gain_to_peak(gain_db, wav_path):
+    """以 WAV 的取樣峰值限制正增益，避免響度正規化後削波（需要 numpy）"""
+    if gain_db <= 0:
+        return gain_db
+    try:
+        import pcm_io
+    except ImportError:
+        # 沒有 numpy 時不做峰值保護
+        return gain_db
+    # 以記憶體映射逐區塊掃描，不會將整個 WAV 載入記憶體
+    peak = pcm_io.measure_peak(wav_path)
+    if peak <= 0:
+        return gain_db
+    peak_db = 20 * math.log10(peak)
+    return min(gain_db, LOUDNESS_PEAK_CEILING_DB - peak_db)
+
 def get_default_output_dir():
     """取得預設輸出目錄（Windows Downloads 資料夾）"""
     try:
@@ -147,7 +220,281 @@ def get_default_output_dir():
         # 如果出錯，使用當前目錄的 downloads 資料夾
         return os.path.join(os.getcwd(), "downloads")
 
-def download_and_transpose(url, semitones, progress_callback=None, output_dir=None, tempo=None, rate=None, bpm=None):
+# 處理引擎版本：處理流程或編碼設定改變導致輸出不同時需遞增，讓舊的快取結果失效
+ENGINE_VERSION = "2"
+
+# 支援的輸出格式與對應的 ffmpeg 編碼參數
+OUTPUT_FORMATS = {
+    'mp3': ["-codec:a", "libmp3lame", "-q:a", "2"],  # 高品質 MP3 編碼
+    'm4a': ["-codec:a", "aac", "-b:a", "192k"],
+    'opus': ["-codec:a", "libopus", "-b:a", "128k"],
+    'ogg': ["-codec:a", "libvorbis", "-q:a", "6"],
+    'flac': ["-codec:a", "flac"],
+    'wav': ["-codec:a", "pcm_s16le"],
+}
+
+def get_encoder_args(output_format, preset=None):
+    """取得輸出格式對應的 ffmpeg 編碼參數（preset 可覆蓋編碼品質）"""
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f"Unsupported output format: {output_format} (supported: {', '.join(OUTPUT_FORMATS)})")
+    if preset is not None and output_format in preset.encoder_args:
+        return list(preset.encoder_args[output_format])
+    return list(OUTPUT_FORMATS[output_format])
+
+def get_format_args(channels=None, samplerate=None):
+    """降混聲道/降低取樣率的 ffmpeg 參數，None 表示沿用來源"""
+    args = []
+    if channels:
+        args.extend(["-ac", str(channels)])
+    if samplerate:
+        args.extend(["-ar", str(samplerate)])
+    return args
+
+def format_rate_label(samplerate):
+    """取樣率的檔名標記，例如 22050 -> 22.05k"""
+    return f"{samplerate / 1000:g}k"
+
+def normalize_semitones(semitones):
+    """正規化半音數：四捨五入到小數兩位，接近零的值視為 0"""
+    normalized = round(float(semitones), 2) if semitones != 0 else 0.0
+    if abs(normalized) < 0.01:
+        normalized = 0.0
+    return normalized
+
+def needs_audio_processing(normalized_semitones, tempo=None, rate=None, bpm=None, loudness=None, loop=1):
+    """只有當參數不是預設值時才需要處理"""
+    return (
+        normalized_semitones != 0 or
+        (tempo is not None and tempo != 0.0) or
+        (rate is not None and rate != 0.0) or
+        (bpm is not None and bpm != 120) or
+        loudness is not None or
+        loop > 1
+    )
+
+def resolve_render_settings(output_format, channels=None, samplerate=None, preset=None):
+    """驗證並決定 (預設, 處理聲道數, 處理取樣率, 編碼參數)"""
+    if channels is not None and channels not in (1, 2):
+        raise Exception("Channels must be 1 (mono) or 2 (stereo)")
+    if samplerate is not None and not 8000 <= samplerate <= 192000:
+        raise Exception("Sample rate must be between 8000 and 192000 Hz")
+    from presets import get_preset
+    preset = get_preset(preset)
+    # 明確指定的聲道/取樣率優先於預設中的設定
+    render_channels = channels or preset.channels
+    render_samplerate = samplerate or preset.samplerate
+    # 使用的預設記錄在輸出檔的中繼資料中
+    encoder_args = get_encoder_args(output_format, preset) + ["-metadata", f"comment={preset.metadata_comment()}"]
+    return preset, render_channels, render_samplerate, encoder_args
+
+def build_output_parts(normalized_semitones, tempo=None, rate=None, bpm=None, loudness=None, loop=1,
+                       channels=None, samplerate=None, preset=None, needs_processing=True, needs_transcode=False):
+    """依實際調整的參數產生輸出檔名的描述標記，例如 ['transpose-2', 'tempo+10.0']"""
+    parts = []
+    
+    if needs_processing:
+        # BPM 模式：只顯示 BPM
+        if bpm is not None:
+            parts.append(f"bpm{bpm:.0f}")
+        
+        # Rate 模式：只顯示 Rate
+        elif rate is not None:
+            parts.append(f"rate{rate:+.1f}")
+        
+        # 預設模式：顯示 transpose 和 tempo（根據實際值）
+        else:
+            # 使用正規化後的 semitones
+            if normalized_semitones != 0:
+                # 如果是整數，不顯示小數點；如果是浮點數，顯示最多兩位小數
+                if normalized_semitones == int(normalized_semitones):
+                    parts.append(f"transpose{int(normalized_semitones):+}")
+                else:
+                    parts.append(f"transpose{normalized_semitones:+.2f}")
+            if tempo is not None and tempo != 0.0:
+                parts.append(f"tempo{tempo:+.1f}")
+        
+        # 響度正規化：所有模式都可附加
+        if loudness is not None:
+            parts.append(f"lufs{loudness:g}")
+        
+        if loop > 1:
+            parts.append(f"loop{loop}")
+    
+    # 明確指定的聲道/取樣率與非預設的品質預設標示在檔名最後，避免與標準版本互相覆蓋
+    if needs_processing or needs_transcode:
+        if channels == 1:
+            parts.append("mono")
+        if samplerate:
+            parts.append(format_rate_label(samplerate))
+        if preset is not None and preset.name != 'standard':
+            parts.append(preset.name)
+    return parts
+
+def parse_time(value):
+    """解析時間（秒數，或 "mm:ss"、"hh:mm:ss"），空值回傳 None"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        seconds = 0.0
+        for part in text.split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise Exception(f"Invalid time: {value} (use seconds, mm:ss or hh:mm:ss)")
+    return seconds
+
+def format_time_label(seconds):
+    """將秒數轉為適合放在檔名中的標記，例如 90 -> 1m30s"""
+    seconds = round(seconds, 1)
+    minutes, secs = divmod(seconds, 60)
+    label = f"{int(minutes)}m" if minutes else ""
+    if secs == int(secs):
+        return f"{label}{int(secs)}s"
+    return f"{label}{secs:.1f}s"
+
+def get_cache_dir(name=None):
+    """取得持久快取目錄（可用環境變數 YT_TRANSPOSE_CACHE_DIR 指定）"""
+    base = os.environ.get('YT_TRANSPOSE_CACHE_DIR')
+    if not base:
+        if sys.platform == 'win32' and os.environ.get('LOCALAPPDATA'):
+            base = os.path.join(os.environ['LOCALAPPDATA'], 'yt_transpose')
+        else:
+            base = os.path.join(os.path.expanduser("~"), ".cache", "yt_transpose")
+    path = os.path.join(base, name) if name else base
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def extract_video_id(url):
+    """從 YouTube 網址解析影片 ID（不需網路），無法解析時回傳 None"""
+    patterns = [
+        r'(?:youtube\.com/.*[?&]v=|youtu\.be/|youtube\.com/(?:embed|v|shorts|live)/)([\w-]{11})',
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, url or '', re.IGNORECASE)
+        if match:
+            return match.group(1)
+    return None
+
+def find_duplicate_cached_source(source_cache, source_id, info, min_kbps, dedupe=None, progress_callback=None):
+    """以音訊指紋找出與這部影片內容相同的已快取來源，回傳快取檔路徑；未啟用、沒有相符或比對失敗時回傳 None"""
+    try:
+        import fingerprint
+    except ImportError:
+        # 需要 numpy
+        return None
+    if not fingerprint.is_dedupe_enabled(dedupe):
+        return None
+    try:
+        match = fingerprint.find_duplicate_source(source_id, info, source_cache, min_kbps)
+    except Exception as e:
+        print(f"Warning: fingerprint lookup failed: {e}")
+        return None
+    if match is None:
+        return None
+    cached_path, matched_id, ber = match
+    msg = f"Found identical cached audio ({matched_id}, bit error rate {ber:.2f}), skipping download"
+    if progress_callback:
+        progress_callback(30, msg)
+    print(msg)
+    return cached_path
+
+# 不需處理時下載的音訊統一轉換成的 MP3（-q:a 2 或 192k）的品質
+MP3_INTERMEDIATE_KBPS = 192
+
+def store_cached_source(source_cache, source_id, path, output_format, info, transcoded=False, dedupe=None):
+    """將下載的來源加入來源快取，記錄它實際的品質；快取失敗不影響本次結果
+
+    transcoded 為 True 時 path 是統一轉換的 MP3 而不是原始下載檔：它是有損的第二代編碼，
+    品質記錄為 MP3_INTERMEDIATE_KBPS，不會被當作最佳來源用在無損輸出上。
+    """
+    from format_policy import get_target_kbps
+    kbps = get_target_kbps(output_format)
+    if transcoded:
+        kbps = MP3_INTERMEDIATE_KBPS if kbps is None else min(kbps, MP3_INTERMEDIATE_KBPS)
+    try:
+        return source_cache.store(source_id, path, kbps, info.get('title'), info.get('duration'), dedupe)
+    except Exception as e:
+        print(f"Warning: failed to store source cache: {e}")
+        return None
+
+@metrics.track_job
+def download_and_transpose(url, semitones, progress_callback=None, output_dir=None, tempo=None, rate=None, bpm=None, loudness=None, stats=None, output_format='mp3', use_cache=True, start=None, end=None, loop=1, allow_video_fallback=False, backend=None, preset=None, channels=None, samplerate=None, dedupe=None, progressive=None):
+    """下載並處理一首歌曲，回傳輸出檔路徑（參數說明見 iter_transpose_steps）"""
+    from backends import run_plan
+    return run_plan(iter_transpose_steps(
+        url, semitones, progress_callback, output_dir, tempo, rate, bpm, loudness, stats, output_format,
+        use_cache, start, end, loop, allow_video_fallback, backend, preset, channels, samplerate, dedupe,
+        progressive,
+    ), progress_callback)
+
+def iter_transpose_steps(url, semitones, progress_callback=None, output_dir=None, tempo=None, rate=None, bpm=None, loudness=None, stats=None, output_format='mp3', use_cache=True, start=None, end=None, loop=1, allow_video_fallback=False, backend=None, preset=None, channels=None, samplerate=None, dedupe=None, progressive=None):
+    # 以產生器表示整個工作：外部命令（ffmpeg、soundstretch）以 RenderStep 交給執行端，
+    # 執行端把結果 send 回來，最後以 StopIteration.value 回傳輸出檔路徑。
+    # download_and_transpose 以 subprocess 同步執行，async_api 以 asyncio 子行程執行。
+    # loudness：目標整合響度（LUFS，例如 -14），None 表示不做響度正規化
+    # stats：可選的 dict，會填入本次工作的統計資訊（例如實際下載的位元組數）
+    # output_format：輸出格式（mp3、m4a、opus、ogg、flac、wav）
+    # use_cache：是否使用結果快取（相同影片與參數直接回傳先前的結果）
+    # start / end：只下載並處理這段時間（秒數或 "mm:ss"），loop：重複次數（練習用循環）
+    # allow_video_fallback：沒有純音訊格式時是否允許下載含影片的格式
+    # backend：處理引擎（auto、ffmpeg、soundstretch），None 時依環境變數 YT_TRANSPOSE_BACKEND
+    # preset：速度/品質預設（draft、standard、archival），None 時依環境變數 YT_TRANSPOSE_PRESET
+    # channels / samplerate：在解碼階段降混為單聲道（1）或降低取樣率，編碼沿用相同格式；None 時依預設
+    # dedupe：以音訊指紋找出內容相同的已快取來源（不同影片 ID 的重新上傳），None 時依環境變數 YT_TRANSPOSE_DEDUPE
+    # progressive：編碼時直接寫入輸出資料夾（旁邊有 .rendering 完成標記），可邊處理邊播放，None 時依環境變數 YT_TRANSPOSE_PROGRESSIVE
+    output_format = (output_format or 'mp3').lower()
+    start = parse_time(start)
+    end = parse_time(end)
+    if start is not None and start <= 0:
+        start = None
+    if start is not None and end is not None and end <= start:
+        raise Exception(f"End time ({end:g}s) must be after start time ({start:g}s)")
+    loop = int(loop or 1)
+    if loop < 1:
+        raise Exception("Loop count must be at least 1")
+    has_range = start is not None or end is not None
+    # 各階段耗時回報到指標登錄（metrics.py）
+    stage_timer = metrics.StageTimer(metrics.stage_duration())
+    preset, render_channels, render_samplerate, encoder_args = resolve_render_settings(
+        output_format, channels, samplerate, preset)
+    
+    # 先查詢結果快取：只需從網址解析影片 ID，不需任何網路請求
+    render_cache = None
+    if use_cache:
+        from render_cache import is_render_cache_enabled, get_render_cache, get_source_id, normalize_render_params, make_cache_key
+        if is_render_cache_enabled():
+            render_cache = get_render_cache()
+            cache_source_id = get_source_id(url)
+            cache_params = normalize_render_params(semitones, tempo, rate, bpm, loudness, output_format)
+            if has_range or loop > 1:
+                cache_params.update({'start': start, 'end': end, 'loop': loop})
+            if preset.name != 'standard':
+                cache_params['preset'] = preset.name
+            if channels or samplerate:
+                cache_params.update({'channels': channels, 'samplerate': samplerate})
+            from backends import RenderRequest, resolve_backend_name
+            cache_request = RenderRequest(cache_params['semitones'], tempo, rate, bpm, loudness, loop)
+            if cache_request.needs_stretch or loudness is not None:
+                # 不同處理引擎的輸出不同，分開快取
+                cache_params['backend'] = resolve_backend_name(backend, cache_request)
+            cache_key = make_cache_key(cache_source_id, cache_params, ENGINE_VERSION)
+            stage_timer.start('cache_lookup')
+            cached = render_cache.lookup(cache_key)
+            stage_timer.finish()
+            metrics.cache_lookups().inc(result='hit' if cached else 'miss')
+            if stats is not None:
+                stats['render_cache'] = 'hit' if cached else 'miss'
+            if cached:
+                cached_path, cached_filename = cached
+                result_path = render_cache.deliver(cached_path, cached_filename, output_dir or get_default_output_dir())
+                if progress_callback:
+                    progress_callback(100, "Completed! (cached)")
+                print(f"\nCompleted (cached): {result_path}")
+                return result_path
     # 在打包環境中，直接使用 yt_dlp 的 Python API，避免通過 subprocess 調用 sys.executable
     # 因為打包後的 sys.executable 指向 exe，會導致啟動新的應用程式視窗
     try:
@@ -156,22 +503,7 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
     except ImportError:
         use_python_api = False
         # 如果無法導入 yt_dlp，嘗試通過命令列調用
-        if getattr(sys, 'frozen', False):
-            # 打包環境：嘗試查找系統中的 yt-dlp 或 yt_dlp
-            yt_dlp_cmd = shutil.which('yt-dlp') or shutil.which('yt_dlp')
-            if yt_dlp_cmd:
-                yt = [yt_dlp_cmd]
-            else:
-                # 最後備選：使用 Python（需要系統安裝 Python）
-                import shutil as sh
-                python_cmd = shutil.which('python') or shutil.which('py')
-                if python_cmd:
-                    yt = [python_cmd, "-m", "yt_dlp"]
-                else:
-                    raise Exception("無法找到 yt-dlp。請確保已安裝 yt-dlp：pip install yt-dlp")
-        else:
-            # 開發環境：使用 Python 模組模式
-            yt = [sys.executable, "-m", "yt_dlp"]
+        yt = get_yt_dlp_command()
     
     ff = get_ffmpeg()
     
@@ -181,21 +513,40 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
     # 獲取標題
     if progress_callback:
         progress_callback(0, "Getting video title...")
+    stage_timer.start('metadata')
     
+    from metadata_cache import get_video_info, get_metadata_cache, is_metadata_cache_enabled
     if use_python_api:
-        # 使用 Python API 獲取標題
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            title = info.get('title', 'Unknown')
+        # 影片資訊先查快取（批次處理時通常已在背景預先解析），否則以共用的 YoutubeDL 連線池解析
+        # process=False 只解析影片資訊，下載時直接以這份資訊處理，不會再解析一次
+        from ytdl_pool import get_ytdl_pool
+        info, info_cached = get_video_info(url)
+        if stats is not None:
+            stats['metadata_cache'] = 'hit' if info_cached else 'miss'
+        title = info.get('title', 'Unknown')
+        duration = info.get('duration')
     else:
-        # 使用命令列獲取標題
-        title = subprocess.run([*yt, "--get-title", url], capture_output=True, text=True, **get_subprocess_kwargs()).stdout.strip()
+        # 命令列模式：沿用先前以 Python API 快取的資訊，沒有時以命令列獲取標題
+        cached_info = get_metadata_cache().lookup(extract_video_id(url)) if is_metadata_cache_enabled() else None
+        if not cached_info and not has_range:
+            # 批次下載（ytdlp_batch.py）已放入來源快取的影片，標題與長度記錄在來源快取中
+            from source_cache import is_source_cache_enabled, get_source_cache
+            from render_cache import get_source_id
+            if is_source_cache_enabled():
+                cached_info = get_source_cache().lookup_info(get_source_id(url))
+        if cached_info:
+            title = cached_info.get('title', 'Unknown')
+            duration = cached_info.get('duration')
+        else:
+            from backends import RenderStep
+            title = (yield RenderStep([*yt, "--get-title", url])).stdout.strip()
+            duration = None  # 命令列模式無法取得長度，暫存空間以預設長度估算
+    if has_range and (duration or end is not None):
+        # 只下載指定範圍，暫存空間依範圍長度估算
+        duration = (end if end is not None else (duration or 0)) - (start or 0)
     
     title = sanitize_filename(title)
+    video_id = extract_video_id(url)
     
     # 決定輸出目錄
     if output_dir is None:
@@ -204,88 +555,195 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
     # 確保輸出目錄存在
     os.makedirs(output_dir, exist_ok=True)
     
-    # 創建臨時工作目錄，所有操作都在這裡進行
-    temp_work_dir = tempfile.mkdtemp(prefix='yt_transpose_')
+    # 決定是否需要處理和輸出檔案名稱
+    # 正規化 semitones：確保接近零的值不被視為需要處理
+    normalized_semitones = normalize_semitones(semitones)
+    needs_processing = needs_audio_processing(normalized_semitones, tempo, rate, bpm, loudness, loop)
+    
+    from format_policy import get_target_kbps, select_audio_format, build_format_spec, estimate_size, describe_format
+    from resume import acquire_partial_dir, iter_completed_files, iter_retry_with_backoff, TransferStats
+    
+    # 不需處理但輸出格式不是 MP3（或指定了單聲道/取樣率）時，只需將下載的 MP3 直接轉檔
+    needs_transcode = not needs_processing and (output_format != 'mp3' or bool(channels or samplerate))
+    
+    # 漸進式輸出：只有會編碼輸出檔、且格式可串流時才有意義
+    import progressive as progressive_output
+    progressive = progressive_output.is_progressive_enabled(progressive) and (needs_processing or needs_transcode)
+    if progressive and not progressive_output.supports_progressive(output_format):
+        print(f"Progressive output is not supported for {output_format.upper()}, writing the file when complete")
+        progressive = False
+    if progressive:
+        encoder_args = encoder_args + progressive_output.get_progressive_args(output_format)
+    progressive_started = False
+    # 排程器（scheduler.py）放行的下載與處理階段
+    download_admission = None
+    render_admission = None
+    
+    if needs_processing:
+        # 選擇處理引擎（依執行時偵測到的工具能力）；無法處理時在下載前就失敗
+        from backends import RenderRequest, select_backend, probe_toolchain
+        render_request = RenderRequest(normalized_semitones, tempo, rate, bpm, loudness, loop,
+                                       output_format, encoder_args, preset,
+                                       channels=render_channels, samplerate=render_samplerate, duration=duration)
+        render_backend = select_backend(backend, render_request)
+    
+    # 依影片長度估算暫存空間，選擇放得下的暫存目錄（空間不足時排隊等待）
+    from scratch import get_scratch_manager, estimate_scratch_bytes
+    # 只有 soundstretch 引擎會在暫存目錄寫出 WAV，ffmpeg 引擎只需壓縮檔的空間
+    needs_wav_scratch = needs_processing and render_backend.name == 'soundstretch'
+    # 單聲道/降低取樣率時 WAV 也等比例變小
+    scratch_size = estimate_scratch_bytes(duration, samplerate=render_samplerate or 48000,
+                                          channels=render_channels or 2, needs_processing=needs_wav_scratch)
+    from backends import iter_wait
+    scratch = None
     
     # 初始化返回路徑，避免在 finally 區塊中未定義
     result_path = None
     
     try:
-        # 決定是否需要處理和輸出檔案名稱
-        # 只有當參數不是預設值時才需要處理
-        # 正規化 semitones：確保接近零的值不被視為需要處理
-        normalized_semitones = round(float(semitones), 2) if semitones != 0 else 0.0
-        if abs(normalized_semitones) < 0.01:
-            normalized_semitones = 0.0
+        # 預約在 try 之內：取得預約後任何一步失敗都會在 finally 中釋放
+        stage_timer.start('scratch_wait')
+        scratch = yield from iter_wait(get_scratch_manager().request(scratch_size, progress_callback))
+        stage_timer.finish()
         
-        needs_processing = (
-            normalized_semitones != 0 or 
-            (tempo is not None and tempo != 0.0) or 
-            (rate is not None and rate != 0.0) or 
-            (bpm is not None and bpm != 120)
-        )
+        # 創建臨時工作目錄，所有操作都在這裡進行
+        temp_work_dir = scratch.create_dir(prefix='yt_transpose_')
         
         # 生成描述性的檔案名稱，根據實際調整的參數
-        parts = []
+        parts = build_output_parts(normalized_semitones, tempo, rate, bpm, loudness, loop, channels, samplerate,
+                                   preset, needs_processing, needs_transcode)
         
-        if needs_processing:
-            # BPM 模式：只顯示 BPM
-            if bpm is not None:
-                parts.append(f"bpm{bpm:.0f}")
-            
-            # Rate 模式：只顯示 Rate
-            elif rate is not None:
-                parts.append(f"rate{rate:+.1f}")
-            
-            # 預設模式：顯示 transpose 和 tempo（根據實際值）
-            else:
-                # 使用正規化後的 semitones
-                if normalized_semitones != 0:
-                    # 如果是整數，不顯示小數點；如果是浮點數，顯示最多兩位小數
-                    if normalized_semitones == int(normalized_semitones):
-                        parts.append(f"transpose{int(normalized_semitones):+}")
-                    else:
-                        parts.append(f"transpose{normalized_semitones:+.2f}")
-                if tempo is not None and tempo != 0.0:
-                    parts.append(f"tempo{tempo:+.1f}")
+        # 時間範圍：放在最前面，例如 clip1m30s-2m0s
+        if has_range:
+            range_label = f"clip{format_time_label(start or 0)}-{format_time_label(end) if end is not None else 'end'}"
+            parts.insert(0, range_label)
         
         # 臨時工作目錄中的檔案路徑
         temp_input_path = os.path.join(temp_work_dir, f"{title}.mp3")
+        # 需要處理時，處理引擎直接從下載的原始檔解碼，不先轉成 MP3
+        keep_source = needs_processing
+        source_path = temp_input_path
         
         # 臨時工作目錄中的輸出檔案路徑（處理後的檔案）
         if parts:
-            temp_output_path = os.path.join(temp_work_dir, f"{title}_{'_'.join(parts)}.mp3")
+            temp_output_path = os.path.join(temp_work_dir, f"{title}_{'_'.join(parts)}.{output_format}")
+        elif needs_transcode:
+            temp_output_path = os.path.join(temp_work_dir, f"{title}.{output_format}")
         else:
             temp_output_path = temp_input_path  # 沒有處理，輸出和輸入相同
         
         # 最終輸出到目標資料夾的路徑
         if parts:
-            final_output_path = os.path.join(output_dir, f"{title}_{'_'.join(parts)}.mp3")
+            final_output_path = os.path.join(output_dir, f"{title}_{'_'.join(parts)}.{output_format}")
         else:
-            final_output_path = os.path.join(output_dir, f"{title}.mp3")
+            final_output_path = os.path.join(output_dir, f"{title}.{output_format}")
+        # 漸進式輸出時編碼器直接寫入最終路徑
+        render_output_path = final_output_path if progressive else temp_output_path
         
         # 下載檔案到臨時目錄
+        stage_timer.start('download')
         was_downloaded = False
+        # 來源快取：同一部影片先前下載過（或已在 GUI 載入波形）且品質足夠時不需再下載
+        source_cache = None
+        cached_source = None
+        if not has_range:
+            from source_cache import is_source_cache_enabled, get_source_cache
+            from render_cache import get_source_id
+            if is_source_cache_enabled():
+                source_cache = get_source_cache()
+                source_cache_id = get_source_id(url)
+                cached_source = source_cache.lookup(source_cache_id, get_target_kbps(output_format))
+                source_cache_result = 'hit' if cached_source else 'miss'
+                if cached_source is None and use_python_api:
+                    # 不同影片 ID 但內容相同（重新上傳）的已快取來源
+                    cached_source = find_duplicate_cached_source(
+                        source_cache, source_cache_id, info, get_target_kbps(output_format), dedupe, progress_callback)
+                    if cached_source is not None:
+                        source_cache_result = 'duplicate'
+                if stats is not None:
+                    stats['source_cache'] = source_cache_result
+        
+        if cached_source is None:
+            # 依學習到的下載速率預估頻寬，同時下載太多時排隊
+            from scheduler import request_download
+            from backends import iter_wait
+            stage_timer.start('download_admission')
+            download_admission = yield from iter_wait(
+                request_download(duration, get_target_kbps(output_format), progress_callback))
+            stage_timer.start('download')
+        
         # 下載（確保 yt-dlp 能找到 ffmpeg）
+        msg = f"Using cached source: {title}" if cached_source else f"Downloading: {title}"
         if progress_callback:
-            progress_callback(30, f"Downloading: {title}")
-        print(f"Downloading: {title}")
+            progress_callback(30, msg)
+        print(msg)
+        
+        def report_retry(attempt, delay, error):
+            msg = f"Download error, retrying in {delay:.1f}s (attempt {attempt}): {error}"
+            if progress_callback:
+                progress_callback(30, msg)
+            print(msg)
+            metrics.download_retries().inc()
         
         # 下載音訊
-        if use_python_api:
+        if cached_source is not None:
+            # 以硬連結放到工作目錄（跨檔案系統時複製），快取項目被淘汰也不影響本次工作
+            from render_cache import link_or_copy
+            local_source = os.path.join(temp_work_dir, f"{title}{os.path.splitext(cached_source)[1]}")
+            link_or_copy(cached_source, local_source)
+            if keep_source:
+                source_path = local_source
+            elif local_source != temp_input_path:
+                # 不需處理時仍統一轉換為 MP3
+                from backends import RenderStep
+                convert_cmd = [ff, "-i", local_source, "-vn", "-codec:a", "libmp3lame", "-q:a", "2", "-y", temp_input_path]
+                result = yield RenderStep(convert_cmd, 40, "Converting to MP3...", duration=duration)
+                if result.returncode != 0:
+                    raise Exception(f"轉換為 MP3 失敗: {result.stderr}")
+            was_downloaded = True
+        elif use_python_api:
             # 使用 Python API 下載（避免在打包環境中調用 sys.executable）
             # 輸出模板：去掉 .mp3 擴展名，yt-dlp 會自動添加
             output_template = temp_input_path.rsplit('.', 1)[0]  # 移除 .mp3
             
             # 統一下載為 MP3 格式
+            # 下載到以影片 ID 與格式區分的持久續傳目錄：失敗時保留 .part 檔，
+            # 重試或下次執行時以 HTTP Range 從中斷處續傳
+            partial_key = info.get('id') or video_id or sanitize_filename(title)
+            if has_range:
+                partial_key += f"_{start or 0:g}-{end if end is not None else 'end'}"
+            transfer_stats = TransferStats()
             ydl_opts = {
-                'format': 'bestaudio/best',  # 選擇最佳音訊格式
-                'outtmpl': output_template + '.%(ext)s',
+                'format': 'bestaudio',
+                'continuedl': True,
                 'postprocessors': [],
-                'quiet': True,
-                'no_warnings': True,
-                'progress_hooks': [],
+                'progress_hooks': [transfer_stats.progress_hook],
             }
+            # 依輸出品質選擇最小的純音訊格式（而非位元率最高的 bestaudio）
+            target_kbps = get_target_kbps(output_format)
+            if info.get('formats'):
+                source_duration = info.get('duration')
+                chosen_format, baseline_format = select_audio_format(
+                    info['formats'], target_kbps, allow_video_fallback, source_duration)
+                ydl_opts['format'] = chosen_format['format_id']
+                chosen_size = estimate_size(chosen_format, source_duration)
+                baseline_size = estimate_size(baseline_format, source_duration)
+                bytes_saved = max(0, baseline_size - chosen_size) if chosen_size and baseline_size else 0
+                if has_range and source_duration:
+                    # 只下載片段時，省下的量依片段比例計算
+                    bytes_saved = int(bytes_saved * min(1.0, duration / source_duration))
+                print(f"Audio format: {describe_format(chosen_format, source_duration)}, "
+                      f"saved ~{bytes_saved / 1024 ** 2:.1f} MB vs bestaudio")
+                if stats is not None:
+                    stats['audio_format'] = chosen_format['format_id']
+                    stats['format_bytes_saved'] = bytes_saved
+            else:
+                ydl_opts['format'] = build_format_spec(target_kbps, allow_video_fallback)
+            
+            if has_range:
+                # 只下載需要的範圍（yt-dlp 以 ffmpeg 對音訊串流做 HTTP Range 讀取）
+                ydl_opts['download_ranges'] = yt_dlp.utils.download_range_func(
+                    None, [(start or 0, end if end is not None else float('inf'))])
             
             # 統一轉換為 MP3（需要 ffmpeg）
             if ff:
@@ -294,7 +752,7 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
                 ffprobe_path = os.path.join(ffmpeg_dir, ffprobe_name)
                 
                 # 如果找到 ffprobe，使用後處理器自動轉換為 MP3
-                if os.path.exists(ffprobe_path):
+                if os.path.exists(ffprobe_path) and not keep_source:
                     # 有 ffprobe，使用 FFmpegExtractAudio 後處理器自動轉換為 MP3
                     ydl_opts['postprocessors'] = [{
                         'key': 'FFmpegExtractAudio',
@@ -309,9 +767,45 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
             else:
                 raise Exception("ffmpeg not found. Cannot convert to MP3 format.")
             
+            # 格式決定後才取得續傳目錄（不同格式的 .part 檔不能互相續傳），下載期間獨佔
+            partial = acquire_partial_dir(partial_key, ydl_opts['format'])
+            partial_dir = partial.path
+            ydl_opts['outtmpl'] = os.path.join(partial_dir, 'source.%(ext)s')
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
+                def download_attempt():
+                    # 從連線池借用 YoutubeDL，以先前取得的影片資訊直接下載
+                    transfer_stats.begin_attempt(partial_dir)
+                    try:
+                        with get_ytdl_pool().session(**ydl_opts) as ydl:
+                            ydl.process_ie_result(info, download=True)
+                    finally:
+                        transfer_stats.end_attempt()
+                
+                # 暫時性網路錯誤以指數退避重試（退避以 WaitStep 交給執行端等待）
+                try:
+                    yield from iter_retry_with_backoff(download_attempt, on_retry=report_retry)
+                except Exception as e:
+                    if not info_cached:
+                        raise
+                    # 快取資訊中的串流網址可能已過期：重新解析影片資訊後再試一次
+                    print(f"Download with cached metadata failed ({e}), refreshing metadata")
+                    info, info_cached = get_video_info(url, refresh=True)
+                    yield from iter_retry_with_backoff(download_attempt, on_retry=report_retry)
+                
+                # 將完成的檔案從續傳目錄移到臨時工作目錄，並移除續傳目錄
+                for completed_file in iter_completed_files(partial_dir):
+                    ext = os.path.splitext(completed_file)[1]
+                    shutil.move(completed_file, os.path.join(temp_work_dir, f"{title}{ext}"))
+                partial.release(remove=True)
+                
+                transferred = transfer_stats.as_dict()
+                if stats is not None:
+                    stats.update(transferred)
+                metrics.download_bytes().inc(transferred['bytes_transferred'], kind='transferred')
+                metrics.download_bytes().inc(transferred['bytes_resumed'], kind='resumed')
+                download_admission.record_download(transferred['bytes_transferred'])
+                print(f"Transferred: {transferred['bytes_transferred'] / 1024 ** 2:.1f} MB "
+                      f"(resumed: {transferred['bytes_resumed'] / 1024 ** 2:.1f} MB)")
                 
                 # 查找下載的檔案（統一為 MP3 格式）
                 downloaded_file = None
@@ -369,13 +863,11 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
                     raise Exception(f"無法找到下載的檔案。{debug_info}")
                 
                 # 如果下載的不是 MP3，需要手動轉換為 MP3
-                needs_conversion = not downloaded_file.endswith('.mp3')
+                needs_conversion = not downloaded_file.endswith('.mp3') and not keep_source
                 
                 if needs_conversion:
-                    if progress_callback:
-                        progress_callback(40, "Converting to MP3...")
-                    
                     # 使用 ffmpeg 轉換為 MP3
+                    from backends import RenderStep
                     convert_cmd = [
                         ff,
                         "-i", downloaded_file,
@@ -384,7 +876,7 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
                         "-y",  # 覆蓋輸出檔案
                         temp_input_path
                     ]
-                    result = subprocess.run(convert_cmd, capture_output=True, text=True, **get_subprocess_kwargs())
+                    result = yield RenderStep(convert_cmd, 40, "Converting to MP3...", duration=duration)
                     
                     if result.returncode != 0:
                         raise Exception(f"轉換為 MP3 失敗: {result.stderr}")
@@ -397,7 +889,9 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
                     downloaded_file = temp_input_path
                 
                 # 確保最終檔案名稱正確（在臨時目錄中）
-                if downloaded_file != temp_input_path:
+                if keep_source:
+                    source_path = downloaded_file
+                elif downloaded_file != temp_input_path:
                     if os.path.exists(temp_input_path):
                         try:
                             os.remove(temp_input_path)
@@ -414,147 +908,115 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
                             pass
                 
                 was_downloaded = True
+                
+                # 加入來源快取（以硬連結保存，快取失敗不影響本次結果）
+                if source_cache is not None:
+                    store_cached_source(source_cache, source_cache_id, source_path if keep_source else temp_input_path,
+                                        output_format, info, transcoded=not keep_source, dedupe=dedupe)
             except Exception as e:
                 raise Exception(f"Download failed: {str(e)}")
+            finally:
+                # 失敗時保留續傳目錄中的 .part 檔
+                partial.release()
         else:
-            # 使用命令列下載到臨時目錄
-            yt_cmd = [*yt, "-x", "--audio-format", "mp3", "-o", temp_input_path]
+            # 使用命令列下載到持久續傳目錄（--continue 以 HTTP Range 續傳）
+            partial_key = video_id or sanitize_filename(title)
+            if has_range:
+                partial_key += f"_{start or 0:g}-{end if end is not None else 'end'}"
+            format_spec = build_format_spec(get_target_kbps(output_format), allow_video_fallback)
+            partial = acquire_partial_dir(partial_key, format_spec)
+            partial_output = os.path.join(partial.path, "source.mp3")
+            yt_cmd = [*yt, "-x", "--audio-format", "mp3", "--continue", "-o", partial_output, "-f", format_spec]
+            if has_range:
+                # 只下載需要的範圍
+                yt_cmd.extend(["--download-sections", f"*{start or 0:g}-{end if end is not None else 'inf'}"])
             
             # 如果找到 ffmpeg，告訴 yt-dlp 它的位置
             if ff:
                 yt_cmd.extend(["--ffmpeg-location", ff])
             
-            result = subprocess.run(yt_cmd + [url], capture_output=True, text=True, **get_subprocess_kwargs())
-            if result.returncode != 0:
-                raise Exception(f"Download failed: {result.stderr}")
+            def iter_download_attempt():
+                from backends import RenderStep
+                result = yield RenderStep(yt_cmd + [url])
+                if result.returncode != 0:
+                    raise Exception(f"Download failed: {result.stderr}")
+            
+            try:
+                # 暫時性網路錯誤以指數退避重試（命令列模式無法取得傳輸位元組數）
+                yield from iter_retry_with_backoff(iter_download_attempt, on_retry=report_retry)
+                shutil.move(partial_output, temp_input_path)
+                partial.release(remove=True)
+            finally:
+                partial.release()
             was_downloaded = True
     
-        # 如果需要處理（轉調、速度調整等）
+        if download_admission is not None:
+            download_admission.release()
+        
+        if needs_processing or needs_transcode:
+            # 依處理引擎預估 CPU 與記憶體，資源不足時排隊
+            from scheduler import request_render
+            from backends import iter_wait
+            stage_timer.start('render_admission')
+            render_admission = yield from iter_wait(request_render(
+                render_backend.name if needs_processing else 'transcode',
+                render_channels, render_samplerate, progress_callback))
+        
+        if progressive:
+            progressive_output.begin(final_output_path)
+            progressive_started = True
+            msg = f"Progressive output: {final_output_path} (complete when {os.path.basename(progressive_output.get_marker_path(final_output_path))} is removed)"
+            if progress_callback:
+                progress_callback(70, msg)
+            print(msg)
+        
+        # 如果需要處理（轉調、速度調整、響度正規化等）
         if needs_processing:
-            # 檢查 soundstretch 是否可用
-            if not check_soundstretch_available():
-                local_dir = os.path.dirname(os.path.abspath(__file__))
-                error_msg = (
-                    "soundstretch CLI 未找到！\n\n"
-                    "請安裝 SoundTouch CLI 工具：\n"
-                    "1. 從以下網址下載：\n"
-                    "   - https://www.surina.net/soundtouch/download.html\n"
-                    "   - 或 https://github.com/SoundTouch/SoundTouch/releases\n\n"
-                    f"2. 解壓縮後，將 'soundstretch.exe' 複製到此目錄：\n"
-                    f"   {local_dir}\n\n"
-                    "3. 或者將 soundstretch 加入到系統 PATH\n\n"
-                    "執行 'python setup_env.py' 可檢查安裝狀態。"
-                )
-                raise Exception(error_msg)
-            
-            soundstretch = get_soundstretch()
-            
-            # 處理 - 使用 SoundTouch CLI (soundstretch)
+            stage_timer.start('render')
+            msg = f"{render_request.describe()} (using {render_backend.name})"
             if progress_callback:
-                if bpm is not None:
-                    progress_callback(70, f"Processing: Adjusting to {bpm} BPM (using SoundTouch CLI)")
-                    print(f"Processing: Adjusting to {bpm} BPM (using SoundTouch CLI)")
-                elif rate is not None:
-                    progress_callback(70, f"Processing: Rate {rate:+.1f}% (using SoundTouch CLI)")
-                    print(f"Processing: Rate {rate:+.1f}% (using SoundTouch CLI)")
-                else:
-                    msg_parts = []
-                    # 使用正規化後的 semitones
-                    if normalized_semitones != 0:
-                        msg_parts.append(f"Transpose {normalized_semitones:+} semitones")
-                    if tempo is not None:
-                        msg_parts.append(f"Tempo {tempo:+.1f}%")
-                    msg = ", ".join(msg_parts) if msg_parts else "Processing"
-                    progress_callback(70, f"{msg} (using SoundTouch CLI)")
-                    print(f"{msg} (using SoundTouch CLI)")
-            
-            # soundstretch 需要 WAV 格式，使用臨時檔案（在臨時工作目錄中）
-            temp_wav_input = os.path.join(temp_work_dir, "temp_input.wav")
-            temp_wav_output = os.path.join(temp_work_dir, "temp_output.wav")
-            
-            try:
-                # 將 MP3 轉換為 WAV（soundstretch 需要）
-                if progress_callback:
-                    progress_callback(75, "Converting to WAV format...")
-                convert_cmd = [
-                    ff,
-                    "-i", temp_input_path,
-                    "-y",  # 覆蓋輸出檔案
-                    "-acodec", "pcm_s16le",  # 16-bit PCM
-                    temp_wav_input
-                ]
-                result = subprocess.run(convert_cmd, capture_output=True, text=True, **get_subprocess_kwargs())
-                if result.returncode != 0:
-                    raise Exception(f"Failed to convert MP3 to WAV: {result.stderr}")
-                
-                # 使用 soundstretch 進行音調轉換和處理
-                if progress_callback:
-                    progress_callback(80, "Processing with SoundTouch...")
-                
-                # 構建 soundstretch 命令參數
-                soundstretch_cmd = [
-                    soundstretch,
-                    temp_wav_input,
-                    temp_wav_output
-                ]
-                
-                # 添加處理參數（按優先級：BPM > rate > tempo + transpose）
-                # 注意：BPM 和 rate 模式也會支援 pitch 調整
-                if bpm is not None:
-                    # BPM 模式：檢測並調整到指定 BPM
-                    soundstretch_cmd.append(f"-bpm={bpm}")
-                    # BPM 模式下也支援 pitch 調整（使用正規化後的 semitones）
-                    if normalized_semitones != 0:
-                        soundstretch_cmd.append(f"-pitch={normalized_semitones:.2f}")
-                elif rate is not None:
-                    # Rate 模式：同時改變速度和音調
-                    soundstretch_cmd.append(f"-rate={rate:.2f}")
-                    # Rate 模式下也支援額外的 pitch 調整（使用正規化後的 semitones）
-                    if normalized_semitones != 0:
-                        soundstretch_cmd.append(f"-pitch={normalized_semitones:.2f}")
-                else:
-                    # 預設模式：分別控制 transpose 和 tempo
-                    # 使用正規化後的 semitones
-                    if normalized_semitones != 0:
-                        soundstretch_cmd.append(f"-pitch={normalized_semitones:.2f}")
-                    if tempo is not None:
-                        soundstretch_cmd.append(f"-tempo={tempo:.2f}")
-                
-                result = subprocess.run(soundstretch_cmd, capture_output=True, text=True, **get_subprocess_kwargs())
-                if result.returncode != 0:
-                    raise Exception(f"SoundTouch processing failed: {result.stderr}")
-                
-                # 將 WAV 轉換回 MP3（在臨時工作目錄中）
-                if progress_callback:
-                    progress_callback(90, "Converting back to MP3...")
-                convert_back_cmd = [
-                    ff,
-                    "-i", temp_wav_output,
-                    "-q:a", "2",  # 高品質 MP3 編碼
-                    "-y",
-                    temp_output_path
-                ]
-                result = subprocess.run(convert_back_cmd, capture_output=True, text=True, **get_subprocess_kwargs())
-                if result.returncode != 0:
-                    raise Exception(f"Failed to convert WAV to MP3: {result.stderr}")
-                
-            finally:
-                # 清理臨時 WAV 檔案
-                for temp_file in [temp_wav_input, temp_wav_output]:
-                    if temp_file and os.path.exists(temp_file):
-                        try:
-                            os.remove(temp_file)
-                        except OSError:
-                            pass
+                progress_callback(70, msg)
+            print(msg)
+            # 常被重新處理的來源改從解碼後的 PCM 快取讀取（片段下載的來源不快取）
+            from pcm_cache import iter_decoded_source
+            from render_cache import get_source_id
+            render_request.decoded = yield from render_admission.track(iter_decoded_source(
+                None if has_range else get_source_id(url), source_path, render_backend.name, render_request))
+            yield from render_admission.track(
+                render_backend.plan(source_path, render_output_path, temp_work_dir, render_request, probe_toolchain()))
+            if stats is not None:
+                stats['backend'] = render_backend.name
+                stats['preset'] = preset.name
+        
+        if needs_transcode:
+            stage_timer.start('transcode')
+            # 沒有處理，只需將下載的 MP3 轉為指定的輸出格式
+            from backends import RenderStep
+            transcode_cmd = [ff, "-i", temp_input_path, *get_format_args(render_channels, render_samplerate),
+                             *encoder_args, "-y", render_output_path]
+            result = yield RenderStep(transcode_cmd, 90, f"Converting to {output_format.upper()}...", duration=duration)
+            render_admission.observe(result)
+            if result.returncode != 0:
+                raise Exception(f"Failed to convert MP3 to {output_format.upper()}: {result.stderr}")
+        
+        if render_admission is not None:
+            render_admission.release()
         
         # 所有操作完成後，將最終檔案從臨時目錄複製到目標目錄
+        stage_timer.start('deliver')
         if progress_callback:
             progress_callback(95, "Moving files to output directory...")
         
         final_input_path = os.path.join(output_dir, f"{title}.mp3")
+        if has_range:
+            # 只下載片段時，檔名需標示範圍，避免與完整版本混淆
+            final_input_path = final_output_path
         
         # 如果有處理，只複製處理後的檔案；如果沒有處理，複製原始檔案
-        if needs_processing and os.path.exists(temp_output_path):
+        if progressive:
+            # 已直接寫在輸出資料夾，移除完成標記即可
+            progressive_output.finish(final_output_path)
+        elif (needs_processing or needs_transcode) and os.path.exists(temp_output_path):
             # 有處理：只複製處理後的檔案
             if os.path.exists(final_output_path):
                 try:
@@ -576,17 +1038,32 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
                 shutil.copy2(temp_input_path, final_input_path)
         
         # 確定最終返回的路徑
-        if needs_processing:
+        if needs_processing or needs_transcode:
             result_path = final_output_path
         else:
             result_path = final_input_path
         
+        # 加入結果快取（以硬連結保存，快取失敗不影響本次結果）
+        if render_cache is not None and os.path.exists(result_path):
+            try:
+                render_cache.store(cache_key, cache_source_id, cache_params, result_path)
+            except Exception as e:
+                print(f"Warning: failed to store render cache: {e}")
+        
     finally:
-        # 清理臨時工作目錄
-        try:
-            shutil.rmtree(temp_work_dir)
-        except Exception:
-            pass
+        stage_timer.finish()
+        for admission in (download_admission, render_admission):
+            if admission is not None:
+                admission.release()
+        if progressive_started and result_path is None:
+            # 處理失敗或被取消：不留下不完整的輸出檔
+            progressive_output.abort(final_output_path)
+        # 清理臨時工作目錄並釋放預約的暫存空間
+        if scratch is not None:
+            try:
+                scratch.release()
+            except Exception:
+                pass
     
     # 完成（在 finally 之後，確保 result_path 已定義）
     if result_path is None:
@@ -598,3 +1075,133 @@ def download_and_transpose(url, semitones, progress_callback=None, output_dir=No
     print(f"\nCompleted: {result_path}")
     return result_path
 
+@metrics.track_job
+def transpose_file(input_path, semitones, progress_callback=None, output_dir=None, tempo=None, rate=None, bpm=None, loudness=None, stats=None, output_format='mp3', loop=1, backend=None, preset=None, channels=None, samplerate=None):
+    """處理一個本機音訊檔（不需下載），回傳輸出檔路徑（參數說明見 iter_transpose_file_steps）"""
+    from backends import run_plan
+    return run_plan(iter_transpose_file_steps(
+        input_path, semitones, progress_callback, output_dir, tempo, rate, bpm, loudness, stats, output_format,
+        loop, backend, preset, channels, samplerate,
+    ), progress_callback)
+
+def iter_transpose_file_steps(input_path, semitones, progress_callback=None, output_dir=None, tempo=None, rate=None, bpm=None, loudness=None, stats=None, output_format='mp3', loop=1, backend=None, preset=None, channels=None, samplerate=None):
+    # 與 iter_transpose_steps 相同的產生器形式，但從本機檔案開始，沒有下載與結果快取的階段；
+    # 處理引擎、預設與輸出檔名規則都與網址來源相同（檔名以原始檔名取代影片標題）
+    if not os.path.isfile(input_path):
+        raise Exception(f"Input file not found: {input_path}")
+    output_format = (output_format or 'mp3').lower()
+    loop = int(loop or 1)
+    if loop < 1:
+        raise Exception("Loop count must be at least 1")
+    stage_timer = metrics.StageTimer(metrics.stage_duration())
+    preset, render_channels, render_samplerate, encoder_args = resolve_render_settings(
+        output_format, channels, samplerate, preset)
+    
+    ff = get_ffmpeg()
+    if not ff:
+        raise Exception("ffmpeg not found. Please install imageio-ffmpeg: pip install imageio-ffmpeg")
+    
+    stage_timer.start('metadata')
+    title = sanitize_filename(os.path.splitext(os.path.basename(input_path))[0])
+    duration = get_duration(input_path)
+    stage_timer.finish()
+    
+    if output_dir is None:
+        output_dir = get_default_output_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    
+    normalized_semitones = normalize_semitones(semitones)
+    needs_processing = needs_audio_processing(normalized_semitones, tempo, rate, bpm, loudness, loop)
+    # 不需處理時，只有來源格式與輸出格式不同（或指定了單聲道/取樣率）才需要轉檔
+    source_format = os.path.splitext(input_path)[1].lower().lstrip('.')
+    needs_transcode = not needs_processing and (source_format != output_format or bool(channels or samplerate))
+    
+    parts = build_output_parts(normalized_semitones, tempo, rate, bpm, loudness, loop, channels, samplerate,
+                               preset, needs_processing, needs_transcode)
+    filename = f"{title}_{'_'.join(parts)}.{output_format}" if parts else f"{title}.{output_format}"
+    final_output_path = os.path.join(output_dir, filename)
+    
+    if not needs_processing and not needs_transcode:
+        # 沒有處理：複製原始檔案（輸出位置就是原始檔時不動作）
+        if not (os.path.exists(final_output_path) and os.path.samefile(input_path, final_output_path)):
+            shutil.copy2(input_path, final_output_path)
+        if progress_callback:
+            progress_callback(100, "Completed!")
+        print(f"\nCompleted: {final_output_path}")
+        return final_output_path
+    
+    if needs_processing:
+        from backends import RenderRequest, select_backend, probe_toolchain
+        render_request = RenderRequest(normalized_semitones, tempo, rate, bpm, loudness, loop,
+                                       output_format, encoder_args, preset,
+                                       channels=render_channels, samplerate=render_samplerate, duration=duration)
+        render_backend = select_backend(backend, render_request)
+    
+    from scratch import get_scratch_manager, estimate_scratch_bytes
+    needs_wav_scratch = needs_processing and render_backend.name == 'soundstretch'
+    scratch_size = estimate_scratch_bytes(duration, samplerate=render_samplerate or 48000,
+                                          channels=render_channels or 2, needs_processing=needs_wav_scratch)
+    from backends import iter_wait
+    scratch = None
+    render_admission = None
+    
+    try:
+        stage_timer.start('scratch_wait')
+        scratch = yield from iter_wait(get_scratch_manager().request(scratch_size, progress_callback))
+        stage_timer.finish()
+        temp_work_dir = scratch.create_dir(prefix='yt_transpose_')
+        # 先輸出到暫存目錄，完成後才移到輸出目錄，輸出目錄中不會出現寫到一半的檔案
+        temp_output_path = os.path.join(temp_work_dir, filename)
+        # 平行處理多個檔案時，依處理引擎預估的 CPU 與記憶體排隊
+        from scheduler import request_render
+        from backends import iter_wait
+        stage_timer.start('render_admission')
+        render_admission = yield from iter_wait(request_render(
+            render_backend.name if needs_processing else 'transcode',
+            render_channels, render_samplerate, progress_callback))
+        if needs_processing:
+            stage_timer.start('render')
+            msg = f"{title}: {render_request.describe()} (using {render_backend.name})"
+            if progress_callback:
+                progress_callback(70, msg)
+            print(msg)
+            from pcm_cache import iter_decoded_source, get_local_source_id
+            render_request.decoded = yield from render_admission.track(iter_decoded_source(
+                get_local_source_id(input_path), input_path, render_backend.name, render_request))
+            yield from render_admission.track(
+                render_backend.plan(input_path, temp_output_path, temp_work_dir, render_request, probe_toolchain()))
+            if stats is not None:
+                stats['backend'] = render_backend.name
+                stats['preset'] = preset.name
+        else:
+            stage_timer.start('transcode')
+            from backends import RenderStep
+            transcode_cmd = [ff, "-i", input_path, "-vn", *get_format_args(render_channels, render_samplerate),
+                             *encoder_args, "-y", temp_output_path]
+            result = yield RenderStep(transcode_cmd, 70, f"Converting to {output_format.upper()}...",
+                                      duration=duration, progress_end=90)
+            render_admission.observe(result)
+            if result.returncode != 0:
+                raise Exception(f"Failed to convert {input_path} to {output_format.upper()}: {result.stderr}")
+        
+        stage_timer.start('deliver')
+        if progress_callback:
+            progress_callback(95, "Moving files to output directory...")
+        if os.path.exists(final_output_path):
+            os.remove(final_output_path)
+        shutil.move(temp_output_path, final_output_path)
+    finally:
+        stage_timer.finish()
+        if render_admission is not None:
+            render_admission.release()
+        if scratch is not None:
+            try:
+                scratch.release()
+            except Exception:
+                pass
+    
+    if progress_callback:
+        progress_callback(100, "Completed!")
+    print(f"\nCompleted: {final_output_path}")
+    return final_output_path
+
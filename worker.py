@@ -0,0 +1,178 @@
+"""多主機 worker 模式
+
+多台主機共用同一個佇列檔（例如放在 NFS 上），各自執行 worker 領取工作：
+
+    python worker.py enqueue /shared/queue.db jobs.jsonl
+    python worker.py run /shared/queue.db
+    python worker.py status /shared/queue.db
+
+同一台機器上也可以同時啟動多個 worker 行程。
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import threading
+
+import metrics
+from job_queue import JobQueue, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS
+
+# 沒有工作時重新查詢佇列的間隔（秒）
+POLL_INTERVAL = 5.0
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Heartbeat:
+    """背景執行緒：處理工作期間定期延長租約"""
+
+    def __init__(self, queue, lease):
+        self.queue = queue
+        self.lease = lease
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = max(1.0, self.queue.lease_seconds / 3.0)
+        while not self._stop.wait(interval):
+            try:
+                if not self.queue.heartbeat(self.lease):
+                    self.lost = True
+                    print(f"Lease lost for job {self.lease.job_id}")
+                    return
+            except Exception as e:
+                # 暫時無法連線到佇列檔時繼續嘗試，租約到期前恢復即可
+                print(f"Heartbeat failed for job {self.lease.job_id}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_job(queue, lease):
+    """處理一個工作：先輸出到 worker 專屬的暫存目錄，租約確認後才原子地發布"""
+    from job_spec import validate_job_dict
+    from transposer_core import download_and_transpose, get_default_output_dir
+
+    job, error = validate_job_dict(lease.spec)
+    if job is None:
+        raise Exception(f"Invalid job spec: {error}")
+
+    output_dir = job.output_dir or get_default_output_dir()
+    # 暫存目錄與輸出目錄在同一個檔案系統上，發布時的 os.replace 才是原子操作
+    staging_dir = os.path.join(output_dir, ".staging", f"{lease.worker_id}-{lease.job_id}")
+    os.makedirs(staging_dir, exist_ok=True)
+    try:
+        kwargs = job.to_kwargs()
+        kwargs['output_dir'] = staging_dir
+        with Heartbeat(queue, lease) as heartbeat:
+            staged_path = download_and_transpose(**kwargs)
+        if heartbeat.lost:
+            print(f"Discarding result of job {lease.job_id}: lease was lost")
+            return None
+
+        def publish():
+            final_path = os.path.join(output_dir, os.path.basename(staged_path))
+            os.replace(staged_path, final_path)
+            return final_path
+
+        result_path = queue.complete(lease, publish)
+        if result_path is None:
+            print(f"Discarding result of job {lease.job_id}: lease expired before publishing")
+        return result_path
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def run_worker(queue_path, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+               max_attempts=DEFAULT_MAX_ATTEMPTS, exit_when_empty=False):
+    queue = JobQueue(queue_path, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    worker_id = worker_id or default_worker_id()
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Stopping after the current job...")
+        stopping.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    print(f"Worker {worker_id} started on {queue_path}")
+    while not stopping.is_set():
+        lease = queue.claim(worker_id)
+        counts = queue.counts()
+        # 共用佇列中等待中的工作數（所有 worker 合計）
+        metrics.queue_depth().set(counts['pending'], queue='worker')
+        if lease is None:
+            if exit_when_empty and counts['running'] == 0:
+                break
+            stopping.wait(POLL_INTERVAL)
+            continue
+
+        print(f"\n[{worker_id}] Job {lease.job_id} (attempt {lease.attempt}): {lease.spec.get('url')}")
+        try:
+            result_path = run_job(queue, lease)
+            if result_path:
+                print(f"[{worker_id}] Published: {result_path}")
+        except Exception as e:
+            print(f"[{worker_id}] Job {lease.job_id} failed: {e}")
+            queue.fail(lease, e)
+    print(f"Worker {worker_id} stopped")
+
+
+def enqueue_file(queue_path, job_file):
+    from job_spec import iter_job_specs
+
+    def valid_specs():
+        for line_no, job, error in iter_job_specs(job_file):
+            if job is None:
+                print(f"Skipping invalid line {line_no}: {error}")
+                continue
+            yield job.to_dict(), job.priority
+
+    count = JobQueue(queue_path).enqueue_many(valid_specs())
+    print(f"Enqueued {count} job(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="yt-transpose multi-node worker")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_enqueue = sub.add_parser("enqueue", help="add jobs from a urls.txt / JSONL job file")
+    p_enqueue.add_argument("queue")
+    p_enqueue.add_argument("job_file")
+
+    p_run = sub.add_parser("run", help="claim and process jobs")
+    p_run.add_argument("queue")
+    p_run.add_argument("--worker-id")
+    p_run.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help="lease length in seconds")
+    p_run.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    p_run.add_argument("--exit-when-empty", action="store_true", help="exit once no jobs are pending or running")
+    p_run.add_argument("--normal-priority", action="store_true", help="do not lower CPU/I-O priority")
+
+    p_status = sub.add_parser("status", help="show job counts per state")
+    p_status.add_argument("queue")
+
+    args = parser.parse_args()
+    if args.command == "enqueue":
+        enqueue_file(args.queue, args.job_file)
+    elif args.command == "run":
+        if not args.normal_priority:
+            from scheduler import set_background_priority
+            set_background_priority()
+        run_worker(args.queue, args.worker_id, args.lease, args.max_attempts, args.exit_when_empty)
+    else:
+        for state, count in JobQueue(args.queue).counts().items():
+            print(f"{state}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""長駐的 yt_dlp.YoutubeDL 連線池
+
+每次建立 YoutubeDL 都會重建 extractor、HTTP 連線、cookie jar 與播放器 JS 快取
+（例如 signature/nsig 解密結果）。批次、GUI 與服務模式共用這個連線池，
+讓這些狀態在多個工作之間重複使用。
+
+每個 YoutubeDL 同一時間只會借給一個執行緒使用；池大小可透過
+環境變數 YT_TRANSPOSE_YTDL_POOL_SIZE 或 configure_ytdl_pool() 設定。
+"""
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+DEFAULT_POOL_SIZE = 2
+
+# 所有工作共用的基本選項（工作專屬選項在借出時套用、歸還時還原）
+BASE_YTDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+}
+
+
+def get_pool_size_from_env():
+    """從環境變數讀取池大小，無效時使用預設值"""
+    try:
+        return max(1, int(os.environ.get('YT_TRANSPOSE_YTDL_POOL_SIZE', DEFAULT_POOL_SIZE)))
+    except ValueError:
+        return DEFAULT_POOL_SIZE
+
+
+class YoutubeDLPool:
+    """執行緒安全的 YoutubeDL 物件池"""
+
+    def __init__(self, size=None, base_opts=None):
+        self.size = size if size is not None else get_pool_size_from_env()
+        self.base_opts = dict(BASE_YTDL_OPTS if base_opts is None else base_opts)
+        self._idle = queue.LifoQueue()  # LIFO：優先重用最近使用、連線仍熱的實例
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create(self):
+        import yt_dlp
+        return yt_dlp.YoutubeDL(dict(self.base_opts))
+
+    def _acquire(self, timeout=None):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._closed:
+                raise Exception("YoutubeDL pool is closed")
+            if len(self._all) < self.size:
+                ydl = self._create()
+                self._all.append(ydl)
+                return ydl
+        # 已達上限，等待其他工作歸還
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise Exception("Timed out waiting for a YoutubeDL session")
+
+    def _release(self, ydl):
+        with self._lock:
+            if self._closed:
+                _close_ydl(ydl)
+                return
+        self._idle.put(ydl)
+
+    @contextmanager
+    def session(self, timeout=None, **job_opts):
+        """借出一個 YoutubeDL，在 with 區塊內套用工作專屬選項
+
+        job_opts 與 yt_dlp.YoutubeDL 的選項相同（含 format、outtmpl、
+        progress_hooks、postprocessors）；區塊結束時全部還原為借出前的狀態。
+        """
+        ydl = self._acquire(timeout)
+        saved_params = dict(ydl.params)
+        saved_hooks = list(ydl._progress_hooks)
+        saved_pps = {when: list(pps) for when, pps in ydl._pps.items()}
+        saved_format_selector = ydl.format_selector
+        try:
+            _apply_job_opts(ydl, job_opts)
+            yield ydl
+        finally:
+            try:
+                ydl.params.clear()
+                ydl.params.update(saved_params)
+                ydl._progress_hooks[:] = saved_hooks
+                for when, pps in saved_pps.items():
+                    ydl._pps[when][:] = pps
+                ydl.format_selector = saved_format_selector
+            finally:
+                self._release(ydl)
+
+    def close(self):
+        """關閉所有實例（閒置中的立即關閉，使用中的在歸還時關閉）"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                _close_ydl(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+def _apply_job_opts(ydl, job_opts):
+    # YoutubeDL 只在建構時讀取 hooks、postprocessors 與 format，
+    # 這些選項需透過對應的 API 套用到既有實例
+    opts = dict(job_opts)
+    for hook in opts.pop('progress_hooks', None) or []:
+        ydl.add_progress_hook(hook)
+    postprocessors = opts.pop('postprocessors', None) or []
+    outtmpl = opts.pop('outtmpl', None)
+    ydl.params.update(opts)
+    if 'format' in opts:
+        fmt = opts['format']
+        ydl.format_selector = fmt if fmt in (None, '-') or callable(fmt) else ydl.build_format_selector(fmt)
+    if postprocessors:
+        from yt_dlp.postprocessor import get_postprocessor
+        for pp_def_raw in postprocessors:
+            pp_def = dict(pp_def_raw)
+            when = pp_def.pop('when', 'post_process')
+            ydl.add_post_processor(get_postprocessor(pp_def.pop('key'))(ydl, **pp_def), when=when)
+    if outtmpl is not None:
+        ydl.params['outtmpl'] = outtmpl if isinstance(outtmpl, dict) else {'default': outtmpl}
+        # 補齊 yt-dlp 其他類型的預設輸出模板
+        if hasattr(ydl, '_parse_outtmpl'):
+            ydl._parse_outtmpl()
+
+
+def _close_ydl(ydl):
+    try:
+        ydl.close()
+    except Exception:
+        pass
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_ytdl_pool():
+    """取得行程內共用的連線池（第一次使用時建立）"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = YoutubeDLPool()
+        return _default_pool
+
+
+def configure_ytdl_pool(size):
+    """設定共用連線池大小（會關閉既有的連線池）"""
+    global _default_pool
+    with _default_pool_lock:
+        old = _default_pool
+        _default_pool = YoutubeDLPool(size=size)
+    if old is not None:
+        old.close()
+    return _default_pool
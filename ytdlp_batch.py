@@ -0,0 +1,337 @@
+"""命令列模式的批次下載
+
+無法導入 yt_dlp 時，每個工作都要以命令列啟動 yt-dlp 兩次（--get-title 與下載），
+200 個網址的批次就是 400 次直譯器啟動與擷取器初始化。批次處理時改為每個視窗
+（接下來的 N 個工作）只啟動一個 yt-dlp 行程：
+
+    yt-dlp -a <網址清單> -o "<續傳目錄>/%(id)s.%(ext)s" --print "after_move:<id/title/duration/filepath 的 JSON>"
+
+每下載完一個項目，yt-dlp 就在標準輸出印出一行 JSON，背景執行緒以影片 ID 對應回工作，
+立即加入來源快取（source_cache.py，標題與長度一併記錄）；失敗的項目則由標準錯誤的
+"ERROR: [擷取器] <影片 ID>: ..." 對應回工作。輪到某個工作時只需等待它的來源就緒，
+之後的 download_and_transpose 直接使用來源快取，不會再啟動 yt-dlp。
+批次下載失敗的工作照常以原本的命令列流程自行下載。
+
+工作檔以串流方式讀取（prefetch_sources）：背景下載最多領先正在處理的工作兩個視窗，
+記憶體中只保留這兩個視窗的工作；視窗大小也受來源快取容量限制，來源不會在輪到
+它的工作之前就被淘汰。每個 yt-dlp 行程開始前先在續傳目錄所在的磁碟預約空間，
+並向排程器（scheduler.py）取得下載准入，與其他下載共用頻寬與同時下載數的上限。
+
+同一個視窗中的網址依輸出格式的目標品質分組，每組以各自的格式選擇下載（無損輸出的
+工作以 bestaudio 下載，不影響其他工作依品質選擇較小的格式）；同一部影片出現在多組時
+以其中最高的品質下載一次。
+
+只有可解析出影片 ID 的完整影片網址會加入批次（片段下載的工作各自下載指定範圍），
+並且需要啟用來源快取。
+
+可用環境變數設定：
+    YT_TRANSPOSE_BATCH_WINDOW=16   每個視窗的工作數（另受來源快取容量限制）
+"""
+import json
+import os
+import re
+import subprocess
+import threading
+from collections import deque
+from itertools import islice
+
+# 下載完成（含移動到最終位置）後印出的資訊
+PRINT_TEMPLATE = "after_move:%(.{id,title,duration,filepath})j"
+# yt-dlp 的錯誤訊息，例如 "ERROR: [youtube] dQw4w9WgXcQ: Video unavailable"
+ERROR_PATTERN = re.compile(r'^ERROR: \[[^\]]+\] ([\w-]+): (.*)$')
+
+DEFAULT_WINDOW = 16
+
+
+def is_batch_download_needed():
+    """只有無法使用 yt_dlp 的 Python API（命令列模式）時才需要批次下載"""
+    try:
+        import yt_dlp  # noqa: F401
+        return False
+    except ImportError:
+        return True
+
+
+def get_batch_window(source_cache):
+    """每個視窗的工作數：同時在來源快取中的兩個視窗不超過快取容量的一半"""
+    try:
+        window = max(1, int(os.environ.get('YT_TRANSPOSE_BATCH_WINDOW', DEFAULT_WINDOW)))
+    except ValueError:
+        window = DEFAULT_WINDOW
+    from scratch import DEFAULT_DURATION, SOURCE_BITRATE
+    source_bytes = DEFAULT_DURATION * SOURCE_BITRATE / 8
+    return max(1, min(window, int(source_cache.max_bytes / 2 / (2 * source_bytes))))
+
+
+_download_space = None
+_download_space_lock = threading.Lock()
+
+
+def get_download_space():
+    """續傳目錄所在磁碟的空間預約（與暫存空間相同的預約與排隊方式）"""
+    global _download_space
+    with _download_space_lock:
+        if _download_space is None:
+            from scratch import ScratchManager
+            from transposer_core import get_cache_dir
+            _download_space = ScratchManager(dirs=[get_cache_dir('partial')])
+        return _download_space
+
+
+class BatchDownload:
+    """以一個 yt-dlp 行程下載一組影片（同一種目標品質），完成的項目立即加入來源快取"""
+
+    def __init__(self, source_ids, kbps, source_cache):
+        # 影片 ID -> 來源 ID
+        self.source_ids = dict(source_ids)
+        self.kbps = kbps
+        self.source_cache = source_cache
+        self.process = None
+        self.completed = set()
+        self.failed = {}
+        self.finished = False
+        # 尚未輪到的工作數，全部輪到後即可關閉
+        self.remaining = 0
+        self.bytes_downloaded = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._terminated = False
+        self._thread = None
+
+    def start(self):
+        """在背景執行緒中等待准入並執行 yt-dlp，不會擋住正在處理的工作"""
+        self._thread = threading.Thread(target=self._run, name='yt_transpose_batch', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self._download()
+        except Exception as e:
+            print(f"Batch download failed: {e}")
+        finally:
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def _download(self):
+        from transposer_core import get_yt_dlp_command, get_ffmpeg, get_subprocess_kwargs
+        from format_policy import build_format_spec
+        from resume import acquire_partial_dir
+        from scheduler import request_download
+        from scratch import estimate_scratch_bytes
+        format_spec = build_format_spec(self.kbps, False)
+        space = get_download_space().request(len(self.source_ids) * estimate_scratch_bytes(needs_processing=False))
+        with space.wait() as reservation:
+            with request_download(kbps=self.kbps).wait() as admission:
+                # 持久的續傳目錄：中斷的批次再次執行時以 --continue 從 .part 檔續傳
+                partial = acquire_partial_dir('batch', format_spec)
+                # 續傳目錄中已下載的檔案計入預約的已寫入空間，不與磁碟剩餘空間重複計算
+                reservation.track(partial.path)
+                try:
+                    batch_file = os.path.join(partial.path, 'urls.txt')
+                    with open(batch_file, 'w', encoding='utf-8') as f:
+                        for video_id in self.source_ids:
+                            f.write(f"https://www.youtube.com/watch?v={video_id}\n")
+                    cmd = [*get_yt_dlp_command(), "-a", batch_file, "--ignore-errors", "--continue", "--no-progress",
+                           "-f", format_spec,
+                           "-o", os.path.join(partial.path, "%(id)s.%(ext)s"),
+                           "--print", PRINT_TEMPLATE, "--no-simulate"]
+                    ff = get_ffmpeg()
+                    if ff:
+                        cmd.extend(["--ffmpeg-location", ff])
+                    with self._cond:
+                        if self._closed:
+                            return
+                        self.process = subprocess.Popen(
+                            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                            encoding='utf-8', errors='replace', bufsize=1, **get_subprocess_kwargs())
+                    errors = threading.Thread(target=self._read_errors, name='yt_transpose_batch_stderr', daemon=True)
+                    errors.start()
+                    self._read_results()
+                    # 兩個輸出都讀完後才視為結束，最後幾行錯誤訊息不會被漏掉
+                    errors.join()
+                    self.process.wait()
+                    admission.record_download(self.bytes_downloaded)
+                finally:
+                    # 正常結束時移除續傳目錄，中斷時保留 .part 檔供下次續傳
+                    with self._cond:
+                        interrupted = self._terminated or self.process is None
+                    partial.release(remove=not interrupted)
+
+    def _read_results(self):
+        for line in self.process.stdout:
+            line = line.strip()
+            if not line.startswith('{'):
+                continue
+            try:
+                info = json.loads(line)
+            except ValueError:
+                continue
+            self._complete(info)
+
+    def _complete(self, info):
+        video_id = info.get('id')
+        path = info.get('filepath')
+        source_id = self.source_ids.get(video_id)
+        if source_id is None or not path or not os.path.exists(path):
+            return
+        try:
+            size = os.path.getsize(path)
+            self.source_cache.store(source_id, path, self.kbps, info.get('title'), info.get('duration'))
+            ok = True
+        except Exception as e:
+            ok = False
+            with self._cond:
+                self.failed[video_id] = f"failed to store source cache: {e}"
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._cond:
+            if ok:
+                self.completed.add(video_id)
+                self.bytes_downloaded += size
+            self._cond.notify_all()
+
+    def _read_errors(self):
+        for line in self.process.stderr:
+            match = ERROR_PATTERN.match(line.strip())
+            if match and match.group(1) in self.source_ids:
+                with self._cond:
+                    self.failed[match.group(1)] = match.group(2)
+                    self._cond.notify_all()
+
+    def wait(self, url):
+        """等待這個網址的來源下載完成，已加入來源快取時回傳 True
+
+        不在批次中、下載失敗或 yt-dlp 已結束卻沒有結果時回傳 False（工作會自行下載）。
+        """
+        from transposer_core import extract_video_id
+        video_id = extract_video_id(url)
+        if video_id not in self.source_ids:
+            return False
+        with self._cond:
+            self._cond.wait_for(lambda: video_id in self.completed or video_id in self.failed or self.finished)
+            if video_id in self.completed:
+                return True
+            error = self.failed.get(video_id, "no result from yt-dlp")
+        print(f"Batch download failed for {url}: {error}; downloading individually")
+        return False
+
+    def close(self):
+        """結束 yt-dlp 行程（尚未完成的下載保留 .part 檔供下次續傳）"""
+        with self._cond:
+            self._closed = True
+            process = self.process
+        if process is not None and process.poll() is None:
+            with self._cond:
+                done = all(video_id in self.completed or video_id in self.failed for video_id in self.source_ids)
+            if done:
+                # 所有項目都已有結果，讓 yt-dlp 自行結束
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    pass
+        if process is not None and process.poll() is None:
+            with self._cond:
+                self._terminated = True
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        if self._thread is not None:
+            self._thread.join(timeout=15)
+
+
+def start_window(jobs, source_cache):
+    """為一個視窗的工作啟動下載，回傳 {影片 ID: BatchDownload}（已快取或不需批次的工作不在其中）"""
+    from transposer_core import extract_video_id
+    from render_cache import get_source_id
+    from format_policy import get_target_kbps
+    # 影片 ID -> (來源 ID, 目標品質)；同一部影片取最高的品質（None 為最佳品質）
+    wanted = {}
+    for job in jobs:
+        if job.start is not None or job.end is not None:
+            continue
+        video_id = extract_video_id(job.url)
+        if not video_id:
+            continue
+        kbps = get_target_kbps(job.output_format)
+        if video_id in wanted:
+            previous = wanted[video_id][1]
+            kbps = None if previous is None or kbps is None else max(previous, kbps)
+        wanted[video_id] = (get_source_id(job.url), kbps)
+    # 同一個行程只能指定一種格式：依目標品質分組，每組一個行程
+    groups = {}
+    for video_id, (source_id, kbps) in wanted.items():
+        if source_cache.lookup(source_id, kbps):
+            # 已在來源快取中
+            continue
+        groups.setdefault(kbps, {})[video_id] = source_id
+    batches = {}
+    for kbps, source_ids in groups.items():
+        batch = BatchDownload(source_ids, kbps, source_cache).start()
+        for video_id in source_ids:
+            batches[video_id] = batch
+    if groups:
+        print(f"Batch downloading {len(batches)} source(s) with {len(groups)} yt-dlp process(es)")
+    return batches
+
+
+def prefetch_sources(jobs, window=None):
+    """依序產生 jobs；命令列模式時在背景分批下載後面工作的來源到來源快取
+
+    產生每個工作之前先等待它的來源下載完成（批次下載失敗時工作照常自行下載）。
+    不需要或無法使用批次下載時直接產生 jobs。
+    """
+    if not is_batch_download_needed():
+        yield from jobs
+        return
+    from source_cache import is_source_cache_enabled, get_source_cache
+    if not is_source_cache_enabled():
+        yield from jobs
+        return
+    from transposer_core import extract_video_id
+    source_cache = get_source_cache()
+    window = window or get_batch_window(source_cache)
+    jobs = iter(jobs)
+    # 已讀取但尚未產生的工作與負責下載它的 BatchDownload（最多兩個視窗）
+    pending = deque()
+    # 最近一個視窗的下載行程：全部結束後才啟動下一個視窗
+    active = []
+    exhausted = False
+    try:
+        while True:
+            if not exhausted and len(pending) <= window and all(batch.finished for batch in active):
+                chunk = list(islice(jobs, window))
+                if chunk:
+                    batches = start_window(chunk, source_cache)
+                    active = list({id(batch): batch for batch in batches.values()}.values())
+                    for job in chunk:
+                        batch = None
+                        if job.start is None and job.end is None:
+                            batch = batches.get(extract_video_id(job.url))
+                        if batch is not None:
+                            batch.remaining += 1
+                        pending.append((job, batch))
+                else:
+                    exhausted = True
+            if not pending:
+                break
+            job, batch = pending.popleft()
+            if batch is not None:
+                batch.wait(job.url)
+            yield job
+            if batch is not None:
+                batch.remaining -= 1
+                if batch.remaining == 0:
+                    batch.close()
+    finally:
+        for batch in {id(batch): batch for _, batch in pending if batch is not None}.values():
+            batch.close()
+        for batch in active:
+            batch.close()